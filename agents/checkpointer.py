@@ -0,0 +1,146 @@
+"""Disk-backed checkpointer for the supervisor graph.
+
+`RetainingSqliteSaver` stores LangGraph checkpoints in a SQLite database in WAL mode and keeps it from growing with the
+lifetime of the deployment:
+
+- only the newest `keep` checkpoints of each thread (and their pending writes) are retained, since every checkpoint
+  holds the complete graph state and older ones are never resumed;
+- the message history stored in a checkpoint is capped at `max_thread_bytes` by dropping its oldest messages;
+- threads idle for longer than `max_idle` seconds are deleted, and the freed pages and the WAL are given back to the
+  file system every `compact_every` checkpoints (see `compact`).
+
+The async methods used by `graph.ainvoke`/`graph.astream` (see `asgi.py`) run the synchronous ones in a worker thread;
+the saver's lock serializes access to the shared connection either way.
+"""
+import asyncio
+import sqlite3
+import time
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+# pylint: disable=C0301
+
+CHECKPOINT_DB = "checkpoints.sqlite"
+KEEP_CHECKPOINTS = 2  # the latest checkpoint, plus its parent for an interrupted step
+MAX_THREAD_BYTES = 4 * 1024 * 1024
+MAX_IDLE_SECONDS = 7 * 24 * 3600
+COMPACT_EVERY = 256  # checkpoints written between two compactions
+
+
+class RetainingSqliteSaver(SqliteSaver):
+    """SQLite checkpointer with per-thread retention, a per-thread size cap and periodic compaction.
+
+    Args:
+        conn (sqlite3.Connection): connection to the checkpoint database, shared by the threads of the app
+        keep (int): checkpoints retained per thread and namespace
+        max_thread_bytes (int): serialized size above which the oldest messages of a checkpoint are dropped
+        max_idle (float): seconds without a new checkpoint after which a thread is deleted by `compact`
+        compact_every (int): checkpoints written between two automatic compactions
+    """
+
+    def __init__(self, conn: sqlite3.Connection, keep: int = KEEP_CHECKPOINTS, max_thread_bytes: int = MAX_THREAD_BYTES,
+                 max_idle: float = MAX_IDLE_SECONDS, compact_every: int = COMPACT_EVERY):
+        super().__init__(conn)
+        self.keep = keep
+        self.max_thread_bytes = max_thread_bytes
+        self.max_idle = max_idle
+        self.compact_every = compact_every
+        self._written = 0
+
+    @classmethod
+    def from_path(cls, db_path: str = CHECKPOINT_DB, **kwargs) -> "RetainingSqliteSaver":
+        """Opens (or creates) the checkpoint database at `db_path`."""
+        return cls(sqlite3.connect(db_path, check_same_thread=False), **kwargs)
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        # Incremental vacuuming can only be enabled before the first table is created
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        super().setup()
+        self.conn.executescript(
+            """
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS thread_activity (
+                thread_id TEXT PRIMARY KEY,
+                updated REAL NOT NULL
+            );
+            """
+        )
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        next_config = super().put(config, self._capped(checkpoint), metadata, new_versions)
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self.cursor() as cur:
+            cur.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN "
+                "(SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT ?)",
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep),
+            )
+            if cur.rowcount:
+                cur.execute(
+                    "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN "
+                    "(SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?)",
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+                )
+            cur.execute("INSERT OR REPLACE INTO thread_activity (thread_id, updated) VALUES (?, ?)", (thread_id, time.time()))
+
+        self._written += 1
+        if self._written % self.compact_every == 0:
+            self.compact()
+        return next_config
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):  # pylint: disable=W0622
+        for checkpoint in await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit))):
+            yield checkpoint
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    def _capped(self, checkpoint: dict) -> dict:
+        """Returns the checkpoint with its oldest messages dropped until it serializes to at most `max_thread_bytes`.
+        The newest message is always kept."""
+        messages = checkpoint.get("channel_values", {}).get("messages")
+        if not messages or len(self.serde.dumps_typed(checkpoint)[1]) <= self.max_thread_bytes:
+            return checkpoint
+
+        capped = {**checkpoint, "channel_values": dict(checkpoint["channel_values"])}
+        # Binary search for the fewest oldest messages to drop, so only O(log n) serializations run
+        low, high = 1, len(messages) - 1
+        while low < high:
+            middle = (low + high) // 2
+            capped["channel_values"]["messages"] = messages[middle:]
+            if len(self.serde.dumps_typed(capped)[1]) <= self.max_thread_bytes:
+                high = middle
+            else:
+                low = middle + 1
+        capped["channel_values"]["messages"] = messages[high:]
+        return capped
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Deletes all checkpoints and writes of a thread, e.g. when its chat session is reset."""
+        with self.cursor() as cur:
+            for table in ("checkpoints", "writes", "thread_activity"):
+                cur.execute(f"DELETE FROM {table} WHERE thread_id = ?", (str(thread_id),))
+
+    def compact(self) -> None:
+        """Deletes threads idle for longer than `max_idle`, returns free pages to the file system and truncates the
+        write-ahead log."""
+        cutoff = time.time() - self.max_idle
+        with self.cursor() as cur:
+            cur.execute("SELECT thread_id FROM thread_activity WHERE updated < ?", (cutoff,))
+            idle = [(thread_id,) for thread_id, in cur.fetchall()]
+            for table in ("checkpoints", "writes", "thread_activity"):
+                cur.executemany(f"DELETE FROM {table} WHERE thread_id = ?", idle)
+        with self.cursor() as cur:
+            cur.execute("PRAGMA incremental_vacuum")
+            cur.fetchall()
+            cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            cur.fetchall()
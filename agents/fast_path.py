@@ -0,0 +1,100 @@
+"""Deterministic fast path in front of the supervisor graph.
+
+Routine chat commands are recognised by a few anchored patterns and answered locally, without any LLM call:
+
+- "show the file" / "view the pcap" renders the first rows of the session log, "show the full file" (also 'entire',
+  'complete', 'whole', 'all') renders all of it, "show the errors" renders only pairs with an error;
+- "what is NRC 0x22" / "what does SID 27 mean" looks the code up in the UDS code database.
+
+`classify` only matches short, unambiguous messages. Anything else, including code lookups the database has no entry
+for, returns None and goes to the supervisor as before.
+"""
+import re
+from typing import NamedTuple
+
+from utils import uds_codes
+from .pcap_renderer import session_table_handle, HEAD_ROWS
+
+# -------------------
+# Rules
+# -------------------
+_POLITE = r"(?:(?:please|can you|could you|pls)\s+)?"
+_END = r"\s*(?:please)?\s*[.!?]*$"
+
+_RENDER = re.compile(
+    rf"^{_POLITE}(?:show|view|display|render|open|print)\s+(?:me\s+)?(?:the\s+)?"
+    r"(?P<full>(?:full|entire|complete|whole|all(?:\s+of)?(?:\s+the)?)\s+)?"
+    r"(?:uploaded\s+)?(?:pcap\s+|csv\s+)?(?:file|capture|session\s+log|log|table|pcap|csv)"
+    rf"(?P<in_full>\s+in\s+full)?{_END}",
+    re.IGNORECASE,
+)
+_RENDER_ERRORS = re.compile(
+    rf"^{_POLITE}(?:show|view|display|list|render)\s+(?:me\s+)?(?:all\s+|only\s+)?(?:the\s+)?"
+    rf"(?:errors|negative\s+(?:responses|replies)|failures|failed\s+requests)(?:\s+only)?{_END}",
+    re.IGNORECASE,
+)
+_CODE_LOOKUP = re.compile(
+    rf"^{_POLITE}(?:(?:what(?:'s|\s+is|\s+does)|explain|describe|look\s*up|lookup|meaning\s+of)\s+)?(?:the\s+)?(?:uds\s+)?"
+    r"(?P<kind>nrc|negative\s+response\s+code|sid|service(?:\s+id)?)\s*(?:code\s*)?"
+    r"(?P<code>(?:0x)?[0-9a-f]{1,2})(?:\s+(?:mean|stand\s+for))?"
+    rf"{_END}",
+    re.IGNORECASE,
+)
+
+
+class Intent(NamedTuple):
+    """A recognised chat command: `name` is 'render_head', 'render_full', 'render_errors' or 'code_lookup'."""
+    name: str
+    arguments: dict
+
+
+def classify(message: str) -> Intent | None:
+    """Matches a chat message against the fast path rules.
+
+    Args:
+        message (str): the user's message
+
+    Returns:
+        Intent | None: the recognised command, or None if the message needs the supervisor
+    """
+    text = " ".join(message.split())
+    if len(text) > 80:
+        return None
+
+    if match := _RENDER.match(text):
+        return Intent("render_full" if match.group("full") or match.group("in_full") else "render_head", {})
+    if _RENDER_ERRORS.match(text):
+        return Intent("render_errors", {})
+    if match := _CODE_LOOKUP.match(text):
+        table = "nrc" if match.group("kind").lower().startswith(("nrc", "negative")) else "sid"
+        return Intent("code_lookup", {"table": table, "code": int(match.group("code"), 16)})
+    return None
+
+
+def respond(message: str, session_id: str) -> str | None:
+    """Answers a chat message through the fast path.
+
+    Args:
+        message (str): the user's message
+        session_id (str): chat session, which is also the graph thread id
+
+    Returns:
+        str | None: the assistant's response, or None if the message has to go to the supervisor
+    """
+    intent = classify(message)
+    if intent is None:
+        return None
+
+    config = {"configurable": {"thread_id": session_id}}
+    if intent.name == "render_head":
+        return session_table_handle(config, limit=HEAD_ROWS)
+    if intent.name == "render_full":
+        return session_table_handle(config)
+    if intent.name == "render_errors":
+        return session_table_handle(config, error="*")
+
+    table, code = intent.arguments["table"], intent.arguments["code"]
+    description = uds_codes.table(table)[code]
+    if description is None:
+        return None  # not in the database, the supervisor can search the internet
+    return f"{'NRC' if table == 'nrc' else 'SID'} 0x{code:02X}: {description}"
@@ -1,14 +1,16 @@
-import os
 from typing import Literal
 
-import pandas as pd
-
 from langchain_core.messages import HumanMessage
 from langchain_core.tools import tool
-from langgraph.types import Command, interrupt
+from langchain_core.runnables import RunnableConfig
+from langgraph.types import Command
 from langgraph.prebuilt import create_react_agent
 
-from utils import instantiate_llm, convert_session_log_to_str
+from utils import instantiate_llm, uds_codes, get_session_log, get_payload_index
+from pipeline.summary import summarize_session_log, format_session_log_rows, DEFAULT_TOKEN_BUDGET
+from pipeline.compare import compare_session_logs, format_comparison
+from pipeline.payloads import format_details
+from pipeline.sessions import filter_session_log
 from .state import State
 
 # Initialize the LLM model
@@ -17,41 +19,91 @@ llm = instantiate_llm()
 # -------------------
 # Configuration
 # -------------------
-UPLOAD_FOLDER = "uploads"
+SESSION_LOG_TOKEN_BUDGET = DEFAULT_TOKEN_BUDGET  # approximate size of the session log summary passed to the LLM
+DRILL_DOWN_MAX_ROWS = 200  # rows returned by one drill-down request
+PAYLOAD_MAX_ROWS = 50  # rows decoded by one payload details request
 
 # -------------------
 # Tool for PCAP Analyzer Agent
 # -------------------
 @tool
-def select_and_read_csv(state: State) -> str:
+def select_and_read_csv(state: State, config: RunnableConfig) -> str:
     """
-    Searches for a CSV file in the UPLOAD_FOLDER:
-      - If no CSV is found, returns an error message.
-      - If more than one CSV file is found, interrupts to prompt the user for a selection.
-      - Otherwise, reads the CSV (as a pandas DataFrame), converts it via
-        `convert_session_log_to_str`, and returns the string representation.
+    Loads the session log of the PCAP file uploaded in this chat session:
+      - If no PCAP file was uploaded, returns an error message.
+      - Otherwise, returns a summary of the session log that fits the token budget (see
+        `pipeline.summary.summarize_session_log`): per-ECU and per-NRC aggregates, every error with its surrounding
+        pairs, and runs of identical pairs collapsed into one line. Short logs are returned in full.
     """
-    csv_files = [f for f in os.listdir(UPLOAD_FOLDER) if f.lower().endswith('.csv')]
-    
-    if not csv_files:
-        return "Error: No CSV files found in the uploads directory. Have you uploaded a PCAP file?"
+    df = get_session_log(config)
+    if isinstance(df, str):
+        return df
     
-    if len(csv_files) > 1:
-        # Interrupt to ask the user which CSV file to process.
-        selected_file = interrupt({
-            "message": "Multiple CSV files found. Please select one to process:",
-            "options": csv_files
-        })
-    else:
-        selected_file = csv_files[0]
+    return summarize_session_log(df, SESSION_LOG_TOKEN_BUDGET, codes=uds_codes)
+
+@tool
+def read_session_log_rows(start: int, stop: int, config: RunnableConfig, ecu: str | None = None) -> str:
+    """
+    Drill-down into the session log: returns the request/reply pairs with row numbers from `start` up to (excluding)
+    `stop` in full, optionally only those of one ECU address (e.g. '0x0E80'). Use the row numbers (#first-last) shown
+    in the summary returned by `select_and_read_csv`. At most 200 rows are returned per call.
+    """
+    df = get_session_log(config)
+    if isinstance(df, str):
+        return df
     
-    csv_path = os.path.join(UPLOAD_FOLDER, selected_file)
+    stop = min(stop, start + DRILL_DOWN_MAX_ROWS)
+    rows = format_session_log_rows(df, start, stop, ecu)
+    return rows or f"No rows #{start}-{stop - 1} found (the session log has {len(df)} rows)."
+
+@tool
+def read_payload_details(start: int, stop: int, config: RunnableConfig, ecu: str | None = None, sid: str | None = None) -> str:
+    """
+    Decodes the full request and reply payloads of the session log rows with row numbers from `start` up to
+    (excluding) `stop`, optionally only those of one ECU address (e.g. '0x0E80') or one request or reply SID (e.g.
+    '0x22'): sub-functions, data identifiers (DIDs) and their values, routine identifiers, DTCs with their status,
+    security access levels and seeds. Use it when the row numbers of the summary or of `read_session_log_rows` are
+    known and the SID alone does not explain what happened. At most 50 rows are decoded per call.
+    """
+    df = get_session_log(config)
+    if isinstance(df, str):
+        return df
+    payloads = get_payload_index(config)
+    if isinstance(payloads, str):
+        return payloads
+
+    rows = filter_session_log(df.iloc[start:stop], ecu=ecu, sid=sid).index[:PAYLOAD_MAX_ROWS]
+    if not len(rows):
+        return f"No rows #{start}-{stop - 1} found (the session log has {len(df)} rows)."
     try:
-        df = pd.read_csv(csv_path)
-    except Exception as e:
-        return f"Error reading CSV file '{selected_file}': {e}"
-    
-    return convert_session_log_to_str(df)
+        details = payloads.details(rows)
+    except OSError as error:
+        return f"Error: The payloads cannot be read: {error}"
+
+    lines = []
+    for row in details:
+        line = f"#{row['row']} {df['ecu_address'].iat[row['row']]} request: {format_details(row['request']) or 'not found'}"
+        if row['reply'] is not None:
+            line += f" | reply: {format_details(row['reply'])}"
+        lines.append(line)
+    return "\n".join(lines)
+
+@tool
+def compare_captures(baseline: str, config: RunnableConfig, candidate: str | None = None) -> str:
+    """
+    Compares two PCAP files uploaded in this chat session, given by file name: `baseline` is the reference (e.g. a
+    good bench capture) and `candidate` the capture under test, by default the active (most recently uploaded) one.
+    Returns new and resolved NRCs per ECU and SID, services with more missing replies, p95 latency regressions and
+    services requested in only one of the captures.
+    """
+    baseline_log = get_session_log(config, baseline)
+    if isinstance(baseline_log, str):
+        return baseline_log
+    candidate_log = get_session_log(config, candidate)
+    if isinstance(candidate_log, str):
+        return candidate_log
+
+    return format_comparison(compare_session_logs(baseline_log, candidate_log), baseline, candidate or "the active capture")
 
 # -------------------
 # Prompt Template for Analysis
@@ -73,10 +125,14 @@ def analysis_prompt() -> str:
     return (
         "You are a diagnostic analyst specializing in Unified Diagnostic Services (UDS) logs. "
         "Your task is to analyze a PCAP file that has been converted into CSV format. However, no CSV data is provided by default. "
-        "Your very first action MUST be to call the tool `select_and_read_csv` to load the CSV data from the uploads directory. "
+        "Your very first action MUST be to call the tool `select_and_read_csv` to load the session log of the uploaded PCAP file. "
         "Do not assume that any CSV content is present in the conversation history. "
         "Once you have loaded the CSV data, analyze the UDS log and produce a concise summary (max. 25 words) "
         "that highlights key events and notes any potential errors. "
+        "Long session logs are summarized: runs of identical request/reply pairs are collapsed and some rows may be omitted. "
+        "If the user asks about details that are not in the summary, call the tool `read_session_log_rows` with the row numbers shown in the summary. "
+        "For the contents of requests and replies (DIDs and their values, routines, DTCs, sub-functions, security access levels), call the tool `read_payload_details` with the row numbers. "
+        "Several PCAP files can be uploaded in one session. If the user asks to compare two of them (e.g. a good and a bad capture), call the tool `compare_captures` with their file names. "
         "If you are uncertain about the user's request or if the query is ambiguous, ask a clarifying question rather than simply echoing the input."
     )
 
@@ -86,7 +142,7 @@ def analysis_prompt() -> str:
 # Create the React agent. Initially no CSV content is provided, so the prompt forces the agent to call the select_and_read_csv tool.
 pcap_analyzer_agent = create_react_agent(
     llm,
-    tools=[select_and_read_csv],
+    tools=[select_and_read_csv, read_session_log_rows, read_payload_details, compare_captures],
     prompt=analysis_prompt()
 )
 
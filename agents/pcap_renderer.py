@@ -1,75 +1,69 @@
-import os
+import html
 from typing import Literal
 
-import pandas as pd
-
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, ToolMessage
 from langchain_core.tools import tool
+from langchain_core.runnables import RunnableConfig
 from langgraph.types import Command
 from langgraph.prebuilt import create_react_agent
 
-from utils import instantiate_llm
+from utils import instantiate_llm, session_store
 from .state import State
 
 # -------------------
 # Configuration
 # -------------------
-UPLOAD_FOLDER = "uploads"
+HEAD_ROWS = 5
 
 # -------------------
 # Tool for the PCAP Renderer Agent
 # -------------------
-@tool
-def render_dataframe_head(state: State) -> str:
+def session_table_handle(config: RunnableConfig, limit: int | None = None, **filters) -> str:
     """
-    Loads the PCAP CSV file and renders ONLY the first 5 rows as HTML.
+    Returns the handle of a session log table: a small placeholder element that the chat page replaces with a table
+    whose rows it fetches from /session_log window by window. The table itself never passes through the LLM.
     """
-    csv_files = [f for f in os.listdir(UPLOAD_FOLDER) if f.lower().endswith('.csv')]
-    if not csv_files:
-        return "Error: No CSV file found in the uploads directory."
-    
-    # For simplicity, if there is more than one CSV, choose the first.
-    selected_file = csv_files[0]
-    csv_path = os.path.join(UPLOAD_FOLDER, selected_file)
-    try:
-        df = pd.read_csv(csv_path)
-    except Exception as e:
-        return f"Error reading CSV file: {e}"
+    session_id = str(config.get("configurable", {}).get("thread_id"))
+    captures = session_store.captures(session_id)
+    if not captures:
+        return "Error: No PCAP file has been uploaded in this session. Please upload a PCAP file first."
     
-    html = df.head().to_html(classes="dataframe", index=False)
-    
-    return html
+    attributes = {"capture": captures[-1], **{name: value for name, value in filters.items() if value}}
+    if limit is not None:
+        attributes["limit"] = limit
+    data = " ".join(f'data-{name}="{html.escape(str(value), quote=True)}"' for name, value in attributes.items())
+    return f'<div class="session-table" {data}></div>'
 
 @tool
-def render_dataframe_full(state: State) -> str:
+def render_dataframe_head(state: State, config: RunnableConfig, details: bool = False) -> str:
     """
-    Loads the PCAP CSV file and renders the FULL DATAFRAME as HTML.
+    Renders ONLY the first 5 rows of the session log of the uploaded PCAP file. Returns a table handle.
+    With `details`, the decoded request and reply payloads (sub-functions, DIDs, routines, DTCs, security levels) are
+    shown as well.
     """
-    csv_files = [f for f in os.listdir(UPLOAD_FOLDER) if f.lower().endswith('.csv')]
-    if not csv_files:
-        return "Error: No CSV file found in the uploads directory."
-    
-    # For simplicity, if there is more than one CSV, choose the first.
-    selected_file = csv_files[0]
-    csv_path = os.path.join(UPLOAD_FOLDER, selected_file)
-    try:
-        df = pd.read_csv(csv_path)
-    except Exception as e:
-        return f"Error reading CSV file: {e}"
-    
-    html = df.to_html(classes="dataframe", index=False)
-    
-    return html
+    return session_table_handle(config, limit=HEAD_ROWS, details=1 if details else None)
+
+@tool
+def render_dataframe_full(state: State, config: RunnableConfig, ecu: str | None = None, sid: str | None = None, error: str | None = None,
+                          details: bool = False) -> str:
+    """
+    Renders the FULL session log of the uploaded PCAP file as a scrollable table. Returns a table handle.
+    Optionally only shows the rows of one ECU address (e.g. '0x0E80'), of one request or reply SID (e.g. '0x22'),
+    or with one error (e.g. '0x31', or '*' for all errors). With `details`, the decoded request and reply payloads
+    (sub-functions, DIDs, routines, DTCs, security levels) are shown as well.
+    """
+    return session_table_handle(config, ecu=ecu, sid=sid, error=error, details=1 if details else None)
 
 def renderer_prompt() -> str:
     """
     Returns the prompt for the PCAP Renderer Agent.
     """
     return (
-        "You are a file viewer agent whose sole responsibility is to render a PCAP file (as a CSV) as HTML. Your output must contain ONLY the HTML representation of the CSV file and nothing else."
+        "You are a file viewer agent whose sole responsibility is to render a PCAP file (as a session log table). Your output must contain ONLY the table handle returned by your tool and nothing else."
         "\n"
-        "You have two tools at your disposal: `render_dataframe_head` and `render_dataframe_full`. The former renders only the first 5 rows of the CSV file, while the latter renders the entire CSV file."
-        "Use `render_dataframe_head` by default, otherwise `render_dataframe_full` if the user requests to view the full PCAP file using words like 'full', 'all', or 'complete'."
+        "You have two tools at your disposal: `render_dataframe_head` and `render_dataframe_full`. The former renders only the first 5 rows of the session log, while the latter renders the entire session log, optionally filtered by ECU, SID or error."
+        "Use `render_dataframe_head` by default, otherwise `render_dataframe_full` if the user requests to view the full PCAP file using words like 'full', 'all', or 'complete', or asks to see only some ECU, SID or errors."
+        " Set `details` when the user asks for payload details such as DIDs, routines, DTCs, sub-functions or security levels."
     )
 
 # -------------------
@@ -90,10 +84,17 @@ def pcap_renderer_node(state: State) -> Command[Literal["supervisor"]]:
     """
     result = pcap_renderer_agent.invoke(state)
     
+    # Pass on the table handle exactly as the tool returned it, rather than the model's copy of it
+    content = result["messages"][-1].content
+    for message in reversed(result["messages"]):
+        if isinstance(message, ToolMessage):
+            content = message.content
+            break
+    
     return Command(
         update={
             "messages": [
-                HumanMessage(content=result["messages"][-1].content, name="pcap_renderer")
+                HumanMessage(content=content, name="pcap_renderer")
             ]
         },
         goto="supervisor",
@@ -1,13 +1,14 @@
 import pandas as pd
 from typing import Literal
 import sqlite3
+from datetime import datetime, timedelta, timezone
 
 from langgraph.types import Command
 from langgraph.prebuilt import create_react_agent
 from langchain_core.tools import tool
 from langchain_core.messages import HumanMessage
 
-from utils import instantiate_llm
+from utils import instantiate_llm, capture_warehouse
 from agents.state import State  # Adjust if needed
 
 
@@ -42,6 +43,91 @@ def sql_search(query: str) -> str:
     except Exception as e:
         return f"SQL error: {str(e)}"
 
+# -------------------
+# Capture Statistics Tools
+# -------------------
+STATISTICS_MAX_ROWS = 20  # rows returned by one statistics query
+
+def time_window(days: float | None, since: str | None, until: str | None) -> tuple[str | None, str | None]:
+    """Resolves the time arguments of the statistics tools: the last `days` days, or an explicit range."""
+    if days is not None:
+        return (datetime.now(timezone.utc) - timedelta(days=days)).isoformat(), None
+    return since, until
+
+@tool
+def capture_nrc_statistics(nrc: str | None = None, ecu: str | None = None, sid: str | None = None, days: float | None = None,
+                           since: str | None = None, until: str | None = None) -> str:
+    """
+    Statistics over all PCAP files processed so far: counts negative replies per ECU, request SID and NRC, most frequent
+    first. Use it for questions like "which ECU returned NRC 0x33 most last week".
+
+    Args:
+      nrc (str | None): only this NRC, e.g. '0x33'
+      ecu (str | None): only this ECU address, e.g. '0x0e80'
+      sid (str | None): only this request SID, e.g. '0x27'
+      days (float | None): only requests of the last `days` days
+      since (str | None): only requests from this UTC date/time on, e.g. '2024-09-01' (ignored if `days` is given)
+      until (str | None): only requests before this UTC date/time (ignored if `days` is given)
+    """
+    since, until = time_window(days, since, until)
+    try:
+        df = capture_warehouse.nrc_counts(nrc, since, until, ecu, sid, limit=STATISTICS_MAX_ROWS)
+    except ValueError as e:
+        return f"Invalid argument: {e}"
+    if df.empty:
+        return "No matching negative replies found in the processed captures."
+    return df.to_string(index=False)
+
+@tool
+def capture_latency_statistics(sid: str | None = None, ecu: str | None = None, by_ecu: bool = False, days: float | None = None,
+                               since: str | None = None, until: str | None = None) -> str:
+    """
+    Statistics over all PCAP files processed so far: response latency percentiles (p50, p95, p99 in milliseconds) per
+    request SID, optionally per SID and ECU. Use it for questions like "p95 latency per SID".
+
+    Args:
+      sid (str | None): only this request SID, e.g. '0x22'
+      ecu (str | None): only this ECU address, e.g. '0x0e80'
+      by_ecu (bool): one row per SID and ECU instead of per SID
+      days (float | None): only requests of the last `days` days
+      since (str | None): only requests from this UTC date/time on, e.g. '2024-09-01' (ignored if `days` is given)
+      until (str | None): only requests before this UTC date/time (ignored if `days` is given)
+    """
+    since, until = time_window(days, since, until)
+    try:
+        df = capture_warehouse.latency_percentiles(since, until, ecu, sid, by_ecu)
+    except ValueError as e:
+        return f"Invalid argument: {e}"
+    if df.empty:
+        return "No matching replies found in the processed captures."
+    return df.head(STATISTICS_MAX_ROWS).to_string(index=False)
+
+@tool
+def capture_service_statistics(ecu: str | None = None, sid: str | None = None, days: float | None = None,
+                               since: str | None = None, until: str | None = None) -> str:
+    """
+    Statistics over all PCAP files processed so far: number of requests, negative replies and missing replies per ECU
+    and request SID, most requested first. The result starts with the request time range covered by the processed
+    captures.
+
+    Args:
+      ecu (str | None): only this ECU address, e.g. '0x0e80'
+      sid (str | None): only this request SID, e.g. '0x22'
+      days (float | None): only requests of the last `days` days
+      since (str | None): only requests from this UTC date/time on, e.g. '2024-09-01' (ignored if `days` is given)
+      until (str | None): only requests before this UTC date/time (ignored if `days` is given)
+    """
+    since, until = time_window(days, since, until)
+    first, last = capture_warehouse.time_range()
+    if first is None:
+        return "No captures have been processed yet."
+    try:
+        df = capture_warehouse.service_counts(since, until, ecu, sid, limit=STATISTICS_MAX_ROWS)
+    except ValueError as e:
+        return f"Invalid argument: {e}"
+    header = f"Processed captures cover requests from {first:%Y-%m-%d %H:%M} to {last:%Y-%m-%d %H:%M} UTC.\n"
+    return header + ("No matching requests found." if df.empty else df.to_string(index=False))
+
 # -------------------
 # Prompt & React Agent for UDS Codes
 # -------------------
@@ -69,13 +155,15 @@ def prompt() -> str:
         "Type (string): contains 'SID' for service or 'NRC' for negative response code; "
         "Description (string): a description of the particular code. "
         "Use ONLY the provided `sql_search` tool to retrieve detailed UDS code information. "
+        "For statistics across all PCAP files processed so far (e.g. which ECU returned an NRC most often, latency percentiles per SID, "
+        "request counts per ECU), use the tools `capture_nrc_statistics`, `capture_latency_statistics` and `capture_service_statistics` instead of SQL. "
         "Always provide clear, concise answers based on the retrieved information."
     )
 
 
 uds_description_search_agent = create_react_agent(
     llm,
-    tools=[sql_search],
+    tools=[sql_search, capture_nrc_statistics, capture_latency_statistics, capture_service_statistics],
     prompt=prompt()
 )
 
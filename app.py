@@ -1,42 +1,54 @@
 import os
+import json
 from typing import Literal
 from typing_extensions import TypedDict
 
-import nest_asyncio
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, render_template, request, jsonify, session, stream_with_context, g
 from werkzeug.utils import secure_filename
+from langchain_core.messages import AIMessageChunk
 from langgraph.types import Command
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, MessagesState, START, END
 
-from utils import instantiate_llm, pcap_transformation_wrapper
+from utils import instantiate_llm, pcap_transformation, session_store, llm_cache, capture_warehouse
+from pipeline.jobs import JobQueue, QueueFull
+from pipeline.sessions import session_log_window
+from pipeline.uploads import CaptureStorage, QuotaExceeded
+from pipeline.compare import compare_session_logs, comparison_to_dict, format_comparison
+from pipeline.llm_cache import cache_scope
+from pipeline import metrics
 from agents.state import State
+from agents.checkpointer import RetainingSqliteSaver, CHECKPOINT_DB
+from agents import fast_path
 from agents.internet_search import internet_search_node
 from agents.pcap_analyzer import pcap_analyzer_node
 from agents.pcap_renderer import pcap_renderer_node
 from agents.uds_codes import uds_description_search_node
 
-nest_asyncio.apply()  # Needed for running async functions with Flask
-
 # -------------------
 # Configuration
 # -------------------
-UPLOAD_FOLDER = "uploads"  # Folder to store PCAP files
-ALLOWED_EXTENSIONS = {"pcap"}
+UPLOAD_FOLDER = "uploads"  # Folder to store PCAP files, one sub-folder per chat session
+ALLOWED_EXTENSIONS = {"pcap", "log"}  # DoIP or SocketCAN captures, candump logs
+UPLOAD_WORKERS = 2  # uploads decoded and analysed concurrently
+MAX_UNFINISHED_UPLOADS = 8  # further uploads are rejected until one finishes
+SESSION_LOG_PAGE_LIMIT = 500  # rows per /session_log request
+EXPORT_CSV = True  # also write each session log to the session's upload folder as CSV; the agents read it from session_store
+METRICS = True  # record pipeline stage and graph node timings, LLM tokens and tool calls, served at /metrics
+TIMING_HEADER = False  # add a Server-Timing header with the stage and node timings of each request
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.secret_key = "some-secure-and-random-secret-key"  # TODO
 
-# Ensure the upload folder exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+metrics.enable(METRICS)
+
+# Uploads are kept per session within quotas; folders of idle sessions are deleted in the background
+capture_storage = CaptureStorage(UPLOAD_FOLDER)
+capture_storage.start_cleanup()
 
-# Delete existing PCAP and CSV files on startup
-for file in os.listdir(UPLOAD_FOLDER):
-    file_path = os.path.join(UPLOAD_FOLDER, file)
-    if os.path.isfile(file_path) and file.lower().endswith((".pcap", ".csv")):
-        os.remove(file_path)
+# Background jobs for uploads, polled through /jobs/<job_id>
+upload_jobs = JobQueue(workers=UPLOAD_WORKERS, max_unfinished=MAX_UNFINISHED_UPLOADS)
 
 # -------------------
 # In-Memory Chat History Storage
@@ -66,7 +78,7 @@ class Router(TypedDict):
 def supervisor_node(state: MessagesState) -> Command[Literal[*nodes, "__end__"]]:
     system_prompt = (
         "You are a supervisor tasked with managing a conversation between the following workers: "
-        f"{nodes}. The conversation context may include an active PCAP file, a UDS code query, or a request to view a PCAP file. If a user asks about the active PCAP file, respond with its filename as stored in the conversation context. If the user's request is ambiguous, ask clarifying questions instead of echoing the query. If the user asks for information about UDS codes, delegate first to the `uds_description_search` worker. If the answer cannot be found in the database, resort to the `internet_search worker`. "
+        f"{nodes}. The conversation context may include an active PCAP file, a UDS code query, or a request to view a PCAP file. If a user asks about the active PCAP file, respond with its filename as stored in the conversation context. If the user's request is ambiguous, ask clarifying questions instead of echoing the query. If the user asks for information about UDS codes, delegate first to the `uds_description_search` worker. If the answer cannot be found in the database, resort to the `internet_search worker`. If the user asks to compare uploaded PCAP files, delegate to the `pcap_analyzer` worker. If the user asks for statistics across past captures (e.g. which ECU returned an NRC most often, latency percentiles per SID), delegate to the `uds_description_search` worker. "
         "Based on the conversation below, determine the next worker to act and respond with that worker's name. "
         "When finished, respond with FINISH."
     )
@@ -77,8 +89,8 @@ def supervisor_node(state: MessagesState) -> Command[Literal[*nodes, "__end__"]]
         goto = END
     return Command(goto=goto)
 
-# Initialize memory saver (could be replaced with SQLite)
-memory = MemorySaver()
+# Checkpoints are kept per chat session (thread_id = session id) in SQLite, with old checkpoints pruned
+memory = RetainingSqliteSaver.from_path(CHECKPOINT_DB)
 
 # Create the state graph and add nodes (including the new UDS code search node)
 builder = StateGraph(State)
@@ -95,6 +107,21 @@ graph = builder.compile(checkpointer=memory, debug=False)
 # Flask Routes
 # -------------------
 
+@app.before_request
+def start_timing():
+    """Collects the stage and node timings of the request for the Server-Timing header."""
+    if TIMING_HEADER:
+        g.timing_spans = metrics.start_collection()
+
+@app.after_request
+def add_timing_header(response):
+    """Adds the collected timings as a Server-Timing header. Streamed responses only include the timings recorded
+    before streaming started."""
+    spans = g.get("timing_spans")
+    if spans:
+        response.headers["Server-Timing"] = metrics.format_server_timing(spans)
+    return response
+
 @app.before_request
 def initialize_chat():
     """Ensures chat history is initialized per session in memory."""
@@ -118,6 +145,40 @@ def chat_history():
     session_id = session.get("session_id")
     return jsonify({"history": chat_histories.get(session_id, [WELCOME_MESSAGE])})
 
+def prepare_chat_turn(session_id: str, user_message: str) -> tuple[dict, dict | None, str | None]:
+    """Sets up one chat turn: answers routine commands through the fast path, otherwise builds the graph input.
+
+    Args:
+        session_id (str): chat session, also the graph thread id
+        user_message (str): the user's message
+
+    Returns:
+        tuple: graph config, graph input (None if answered by the fast path) and the fast path response (or None)
+    """
+    config = {"configurable": {"thread_id": session_id}, "recursion_limit": 15, "callbacks": metrics.callbacks()}
+    has_thread = bool(graph.get_state(config).values.get("messages"))
+
+    # Routine commands (show the file, look up a code) are answered without the LLM. The exchange is still added
+    # to the session's thread, so the supervisor sees it in later turns.
+    assistant_response = fast_path.respond(user_message, session_id)
+    if assistant_response is not None:
+        if has_thread:
+            graph.update_state(config, {"messages": [{"role": "user", "content": user_message}, {"role": "assistant", "content": assistant_response}]})
+        return config, None, assistant_response
+
+    # The session's thread already holds the conversation; seed it with the full history only when it is new
+    # (first message, or the thread expired or was reset).
+    if has_thread:
+        conversation = [{"role": "user", "content": user_message}]
+    else:
+        conversation = chat_histories[session_id] + [{"role": "user", "content": user_message}]
+    return config, {"messages": conversation}, None
+
+def record_chat_turn(session_id: str, user_message: str, assistant_response: str) -> None:
+    """Appends a finished exchange to the session's chat history."""
+    chat_histories[session_id].append({"role": "user", "content": user_message})
+    chat_histories[session_id].append({"role": "assistant", "content": assistant_response})
+
 @app.route("/chat", methods=["POST"])
 def chat():
     """Handles chat messages and stores them in memory per session."""
@@ -126,35 +187,143 @@ def chat():
     user_message = data.get("message", "").strip()
 
     try:
-        # Include the full conversation history to provide context.
-        conversation = chat_histories[session_id] + [{"role": "user", "content": user_message}]
-        inputs = {"messages": conversation}
-        result = graph.invoke(inputs, config={"configurable": {"thread_id": 42}, "recursion_limit": 15})
-        assistant_response = result["messages"][-1].content
+        config, inputs, assistant_response = prepare_chat_turn(session_id, user_message)
+        if inputs is not None:
+            with cache_scope(session_store.digest(session_id) or ""):
+                result = graph.invoke(inputs, config=config)
+            assistant_response = result["messages"][-1].content
 
-        chat_histories[session_id].append({"role": "user", "content": user_message})
-        chat_histories[session_id].append({"role": "assistant", "content": assistant_response})
+        record_chat_turn(session_id, user_message, assistant_response)
 
         return jsonify({"response": assistant_response})
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def server_sent_event(event: str, data: dict) -> str:
+    """Formats one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+STREAM_MODES = ["updates", "messages"]
+
+def stream_events(mode: str, payload) -> list[str]:
+    """Converts one item streamed by the graph (with `stream_mode=STREAM_MODES`) into Server-Sent Events."""
+    if mode == "messages":
+        chunk, metadata = payload
+        # Only model output; the namespace starts with the graph node whose agent produced it
+        if isinstance(chunk, AIMessageChunk) and isinstance(chunk.content, str) and chunk.content:
+            node = metadata.get("langgraph_checkpoint_ns", "").split(":")[0] or metadata.get("langgraph_node")
+            return [server_sent_event("token", {"node": node, "text": chunk.content})]
+        return []
+    return [server_sent_event("node", {"node": node}) for node in payload]
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Streaming variant of /chat. Responds with Server-Sent Events while the graph runs:
+    - `node`: a worker (or the supervisor) finished a step, {"node": name}
+    - `token`: text generated by a model inside a node, {"node": name, "text": chunk}
+    - `done`: the final response, {"response": text}, or `error`: {"error": message}
+    """
+    session_id = session.get("session_id")
+    data = request.get_json()
+    user_message = data.get("message", "").strip()
+
+    def events():
+        try:
+            config, inputs, assistant_response = prepare_chat_turn(session_id, user_message)
+            if inputs is not None:
+                with cache_scope(session_store.digest(session_id) or ""):
+                    for mode, payload in graph.stream(inputs, config=config, stream_mode=STREAM_MODES):
+                        yield from stream_events(mode, payload)
+                assistant_response = graph.get_state(config).values["messages"][-1].content
+
+            record_chat_turn(session_id, user_message, assistant_response)
+            yield server_sent_event("done", {"response": assistant_response})
+
+        except Exception as e:
+            yield server_sent_event("error", {"error": str(e)})
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route("/reset", methods=["GET"])
 def reset_chat():
     """Clears chat history for the current session and re-adds the welcome message."""
     session_id = session.get("session_id")
     chat_histories[session_id] = [WELCOME_MESSAGE]
+    memory.delete_thread(session_id)
+    session_store.drop(session_id)
+    capture_storage.drop(session_id)
     session.pop("uploaded_file_info", None)
     return jsonify({"message": "Chat history cleared."})
 
 def allowed_file(filename):
-    """Check if the uploaded file has a .pcap extension."""
+    """Check if the uploaded file has a .pcap (or candump .log) extension."""
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def activate_capture(session_id: str, filename: str, df, payloads=None) -> tuple[dict, dict]:
+    """Makes a decoded capture the active one of a session: stores its session log (and CSV export) and starts a new
+    conversation about it.
+
+    Args:
+        session_id (str): chat session that uploaded the file
+        filename (str): secured file name
+        df (pd.DataFrame): session log of the capture
+        payloads (PayloadIndex | None): payload index of the capture, see `utils.pcap_transformation`
+
+    Returns:
+        tuple: graph config and input of the initial analysis
+    """
+    session_store.put(session_id, filename, df, payloads)
+    with metrics.span("warehouse"):
+        capture_warehouse.add(df, filename, source="upload", digest=session_store.digest(session_id))
+    if EXPORT_CSV:
+        with metrics.span("csv_export"):
+            df.to_csv(capture_storage.export_path(session_id, filename), index=False)
+
+    # Reset the conversation context so that the new file is clearly active; earlier captures stay available for comparison.
+    earlier = [capture for capture in session_store.captures(session_id) if capture != filename]
+    notice = f"Active PCAP file is now '{filename}'."
+    if earlier:
+        notice += f" Earlier uploads in this session: {', '.join(repr(capture) for capture in earlier)}."
+    chat_histories[session_id] = [{"role": "assistant", "content": notice}]
+    memory.delete_thread(session_id)
+    inputs = {"messages": chat_histories[session_id] + [{"role": "user", "content": "Please analyze the uploaded PCAP file."}]}
+    return {"configurable": {"thread_id": session_id}, "callbacks": metrics.callbacks()}, inputs
+
+def process_upload(job, session_id: str, filename: str, filepath: str) -> dict:
+    """Background job: decodes an uploaded PCAP file, stores its session log (and CSV export) and runs the initial
+    analysis.
+
+    Args:
+        job (Job): job to report progress to
+        session_id (str): chat session that uploaded the file
+        filename (str): secured file name
+        filepath (str): path of the saved upload
+
+    Returns:
+        dict: message and file path reported to the client
+    """
+    # Process the PCAP file and hand the typed session log to the agents of this session.
+    with metrics.collecting() as spans:
+        try:
+            job.update(stage="decoding")
+            df, payloads = pcap_transformation(filepath, progress=job.update)
+            config, inputs = activate_capture(session_id, filename, df, payloads)
+            # Automatically trigger analysis for the new file using the pcap_analyzer.
+            job.update(stage="analyzing")
+            with cache_scope(session_store.digest(session_id) or ""):
+                result = graph.invoke(inputs, config=config)
+            chat_histories[session_id].append({"role": "assistant", "content": result["messages"][-1].content})
+            job.update(stage="done")
+        finally:
+            job.update(timings_ms=metrics.timings_ms(spans))
+
+    return {"message": f"File {filename} uploaded successfully", "filepath": filepath}
+
 @app.route("/upload", methods=["POST"])
 def upload_file():
-    """Endpoint for uploading PCAP files."""
+    """Endpoint for uploading PCAP files. Saves the file and queues its processing; returns the job id to poll at 
+    /jobs/<job_id>."""
     session_id = session.get("session_id")
     if "file" not in request.files:
         return jsonify({"error": "No file part"}), 400
@@ -165,37 +334,102 @@ def upload_file():
 
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        
-        # Delete any existing PCAP or CSV files in the UPLOAD_FOLDER.
-        for f in os.listdir(app.config["UPLOAD_FOLDER"]):
-            file_path = os.path.join(app.config["UPLOAD_FOLDER"], f)
-            if os.path.isfile(file_path) and f.lower().endswith((".pcap", ".csv")):
-                os.remove(file_path)
-        
-        filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-        file.save(filepath)
-        
-        # Process the PCAP file and write out its CSV version.
-        df = pcap_transformation_wrapper(filepath)
-        csv_path = os.path.join(app.config["UPLOAD_FOLDER"], f"{filename.split('.')[0]}.csv")
-        df.to_csv(csv_path, index=False)
+
+        # Stored in the session's own folder; the session's oldest captures make room if it is over quota.
+        try:
+            filepath = capture_storage.save(session_id, filename, file.stream)
+        except QuotaExceeded as e:
+            return jsonify({"error": str(e)}), 413
+
+        try:
+            job = upload_jobs.submit(process_upload, session_id, filename, filepath)
+        except QueueFull as e:
+            return jsonify({"error": str(e)}), 503
 
         # Update the session with the new file's name.
         session["uploaded_file_info"] = filename
 
-        # Reset the conversation context so that the new file is clearly active.
-        chat_histories[session_id] = [
-            {"role": "assistant", "content": f"Active PCAP file is now '{filename}'."}
-        ]
-        # Automatically trigger analysis for the new file using the pcap_analyzer.
-        inputs = {"messages": chat_histories[session_id] + [{"role": "user", "content": "Please analyze the uploaded PCAP file."}]}
-        result = graph.invoke(inputs, config={"configurable": {"thread_id": 42}})
-        analysis_response = result["messages"][-1].content
-        chat_histories[session_id].append({"role": "assistant", "content": analysis_response})
+        return jsonify({"message": f"File {filename} received, processing", "job_id": job.id}), 202
+
+    return jsonify({"error": "Invalid file type. Only .pcap files and candump .log files are allowed."}), 400
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Reports the status and progress of a background job (packets decoded, pairs matched, analysis stage)."""
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
 
-        return jsonify({"message": f"File {filename} uploaded successfully", "filepath": filepath})
+@app.route("/session_log", methods=["GET"])
+def session_log_rows():
+    """Serves a window of rows of the session's active (or `capture`) session log as JSON, for the table rendered by
+    the pcap_renderer agent. Query parameters: offset, limit, the ecu, sid and error filters (see 
+    `pipeline.sessions.filter_session_log`), and details=1 to add the decoded request and reply payloads."""
+    session_id = session.get("session_id")
+    capture = request.args.get("capture") or None
+    df = session_store.get(session_id, capture)
+    if df is None:
+        return jsonify({"error": "No PCAP file has been uploaded in this session."}), 404
+
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", 100, type=int), 0), SESSION_LOG_PAGE_LIMIT)
+    filters = {name: request.args.get(name) for name in ("ecu", "sid", "error")}
+    payloads = session_store.payloads(session_id, capture) if request.args.get("details") else None
+    try:
+        return jsonify(session_log_window(df, offset, limit, payloads, **filters))
+    except OSError as error:  # the capture file is gone, so show the rows without details
+        return jsonify({**session_log_window(df, offset, limit, **filters), "details_error": str(error)})
 
-    return jsonify({"error": "Invalid file type. Only .pcap files are allowed."}), 400
+@app.route("/captures", methods=["GET"])
+def list_captures():
+    """Lists the captures of the session whose session logs are loaded, the active one last."""
+    session_id = session.get("session_id")
+    return jsonify({"captures": session_store.captures(session_id)})
+
+def compare_session_captures(session_id: str, baseline_name: str | None, candidate_name: str | None = None) -> tuple[dict, int]:
+    """Compares two captures of a session by ECU, SID and NRC, see `pipeline.compare.compare_session_logs`.
+
+    Args:
+        session_id (str): chat session
+        baseline_name (str | None): file name of the reference capture
+        candidate_name (str | None): file name of the capture under test, defaults to the active capture
+
+    Returns:
+        tuple: JSON response (the differences and their text form, or an error) and HTTP status
+    """
+    captures = session_store.captures(session_id)
+    candidate_name = candidate_name or (captures[-1] if captures else None)
+    baseline = session_store.get(session_id, baseline_name) if baseline_name else None
+    candidate = session_store.get(session_id, candidate_name) if candidate_name else None
+    if baseline is None or candidate is None:
+        return {"error": "Unknown capture.", "captures": captures}, 404
+
+    comparison = compare_session_logs(baseline, candidate)
+    return {**comparison_to_dict(comparison), "text": format_comparison(comparison, baseline_name, candidate_name)}, 200
+
+@app.route("/compare", methods=["GET"])
+def compare_captures():
+    """Compares two captures of the session: query parameters `baseline` and `candidate` (defaults to the active
+    capture)."""
+    response, status = compare_session_captures(session.get("session_id"), request.args.get("baseline"), request.args.get("candidate"))
+    return jsonify(response), status
+
+@app.route("/llm_cache", methods=["GET"])
+def llm_cache_stats():
+    """Reports the hit/miss counts and size of the shared LLM response cache."""
+    return jsonify(llm_cache.stats())
+
+def metrics_page() -> str:
+    """Returns the pipeline, graph and LLM cache metrics in the Prometheus text format."""
+    stats = llm_cache.stats()
+    counters = {f"uds_llm_cache_{name}_total": stats[name] for name in ("hits", "misses", "expired", "evicted", "stored")}
+    return metrics.registry.render(counters=counters, gauges={"uds_llm_cache_bytes": stats["bytes"]})
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Serves the metrics for Prometheus: stage and graph node timings, LLM tokens and tool calls, LLM cache counts."""
+    return Response(metrics_page(), mimetype="text/plain; version=0.0.4")
 
 # -------------------
 # Main Entry Point
@@ -0,0 +1,311 @@
+"""Async serving mode of the web app.
+
+Serves the same routes as `app.py` from a single event loop: graph invocations run through `graph.ainvoke` and
+`graph.astream`, uploads are processed as tasks of an `AsyncJobQueue`, and CPU-bound capture decoding runs in a pool
+of worker processes, so many sessions can chat and upload at the same time. The graph, the checkpointer, the session
+logs and the chat histories are those defined in `app.py`.
+
+Each endpoint has a concurrency limit (`CONCURRENCY_LIMITS`); requests beyond it wait up to `LIMIT_WAIT_SECONDS` for
+a slot and are then rejected with 503.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from fastapi import FastAPI, Request, UploadFile, File
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.middleware.sessions import SessionMiddleware
+from werkzeug.utils import secure_filename
+
+from app import (app as flask_app, graph, memory, chat_histories, capture_storage, WELCOME_MESSAGE, SESSION_LOG_PAGE_LIMIT,
+                 MAX_UNFINISHED_UPLOADS, STREAM_MODES, TIMING_HEADER, prepare_chat_turn, record_chat_turn, activate_capture, allowed_file,
+                 compare_session_captures, server_sent_event, stream_events, metrics_page)
+from utils import pcap_transformation, session_store, llm_cache
+from pipeline.jobs import AsyncJobQueue, QueueFull
+from pipeline.uploads import QuotaExceeded
+from pipeline.sessions import session_log_window
+from pipeline.llm_cache import cache_scope
+from pipeline import metrics
+
+# pylint: disable=C0301
+
+# -------------------
+# Configuration
+# -------------------
+CONCURRENCY_LIMITS = {  # requests handled at the same time, per endpoint
+    "chat": 16,  # /chat and /chat/stream; each holds a graph run
+    "upload": 4,  # receiving upload bodies
+    "session_log": 32,
+    "compare": 8,
+    "reset": 8,
+}
+LIMIT_WAIT_SECONDS = 30  # time a request waits for a slot before it is rejected
+DECODE_WORKERS = max((os.cpu_count() or 1) // 2, 1)  # processes decoding captures
+ANALYSIS_WORKERS = 4  # uploads analysed by the graph at the same time
+
+upload_jobs = AsyncJobQueue(workers=ANALYSIS_WORKERS, max_unfinished=MAX_UNFINISHED_UPLOADS)
+decode_pool = None  # created on startup, see `lifespan`
+_slots = {endpoint: asyncio.Semaphore(limit) for endpoint, limit in CONCURRENCY_LIMITS.items()}
+
+
+class Busy(Exception):
+    """Raised when a request finds no free slot of its endpoint within `LIMIT_WAIT_SECONDS`."""
+
+
+async def acquire(endpoint: str) -> None:
+    """Waits for a free slot of `endpoint`, or raises `Busy`."""
+    try:
+        await asyncio.wait_for(_slots[endpoint].acquire(), LIMIT_WAIT_SECONDS)
+    except TimeoutError as e:
+        raise Busy(f"Too many concurrent {endpoint} requests, try again later.") from e
+
+
+@asynccontextmanager
+async def limited(endpoint: str):
+    """Holds a slot of `endpoint` for the duration of the block."""
+    await acquire(endpoint)
+    try:
+        yield
+    finally:
+        _slots[endpoint].release()
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global decode_pool  # pylint: disable=W0603
+    decode_pool = ProcessPoolExecutor(max_workers=DECODE_WORKERS)
+    try:
+        yield
+    finally:
+        decode_pool.shutdown(cancel_futures=True)
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(SessionMiddleware, secret_key=flask_app.secret_key)
+
+
+@app.exception_handler(Busy)
+async def busy_handler(_request: Request, e: Busy) -> JSONResponse:
+    return JSONResponse({"error": str(e)}, status_code=503)
+
+
+async def server_timing(request: Request, call_next):
+    """Adds the stage and node timings of the request as a Server-Timing header, see `app.TIMING_HEADER`."""
+    with metrics.collecting() as spans:
+        response = await call_next(request)
+    if spans:
+        response.headers["Server-Timing"] = metrics.format_server_timing(spans)
+    return response
+
+
+if TIMING_HEADER:  # only installed when enabled, so requests pay nothing otherwise
+    app.middleware("http")(server_timing)
+
+
+def chat_session(request: Request) -> str:
+    """Returns the session id of the request, initializing the session and its chat history on first use."""
+    session_id = request.session.get("session_id")
+    if session_id is None:
+        session_id = os.urandom(16).hex()
+        request.session["session_id"] = session_id
+
+    if session_id not in chat_histories:
+        chat_histories[session_id] = [WELCOME_MESSAGE]
+        request.session.pop("uploaded_file_info", None)
+    return session_id
+
+# -------------------
+# Routes
+# -------------------
+
+@app.get("/")
+async def index():
+    """Render the main chat interface."""
+    return FileResponse("templates/index.html")
+
+@app.get("/history")
+async def chat_history(request: Request):
+    """Retrieve the stored chat history for the session."""
+    session_id = chat_session(request)
+    return {"history": chat_histories.get(session_id, [WELCOME_MESSAGE])}
+
+@app.post("/chat")
+async def chat(request: Request):
+    """Handles chat messages and stores them in memory per session."""
+    session_id = chat_session(request)
+    data = await request.json()
+    user_message = data.get("message", "").strip()
+
+    async with limited("chat"):
+        try:
+            config, inputs, assistant_response = await asyncio.to_thread(prepare_chat_turn, session_id, user_message)
+            if inputs is not None:
+                with cache_scope(session_store.digest(session_id) or ""):
+                    result = await graph.ainvoke(inputs, config=config)
+                assistant_response = result["messages"][-1].content
+
+            record_chat_turn(session_id, user_message, assistant_response)
+            return {"response": assistant_response}
+
+        except Exception as e:  # pylint: disable=W0718
+            return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """Streaming variant of /chat, with the same Server-Sent Events as in `app.py`."""
+    session_id = chat_session(request)
+    data = await request.json()
+    user_message = data.get("message", "").strip()
+
+    async def events():
+        try:
+            async with limited("chat"):
+                config, inputs, assistant_response = await asyncio.to_thread(prepare_chat_turn, session_id, user_message)
+                if inputs is not None:
+                    with cache_scope(session_store.digest(session_id) or ""):
+                        async for mode, payload in graph.astream(inputs, config=config, stream_mode=STREAM_MODES):
+                            for event in stream_events(mode, payload):
+                                yield event
+                    assistant_response = (await graph.aget_state(config)).values["messages"][-1].content
+
+            record_chat_turn(session_id, user_message, assistant_response)
+            yield server_sent_event("done", {"response": assistant_response})
+
+        except Exception as e:  # pylint: disable=W0718
+            yield server_sent_event("error", {"error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/reset")
+async def reset_chat(request: Request):
+    """Clears chat history for the current session and re-adds the welcome message."""
+    session_id = chat_session(request)
+    async with limited("reset"):
+        chat_histories[session_id] = [WELCOME_MESSAGE]
+        await asyncio.to_thread(memory.delete_thread, session_id)
+        session_store.drop(session_id)
+        await asyncio.to_thread(capture_storage.drop, session_id)
+    request.session.pop("uploaded_file_info", None)
+    return {"message": "Chat history cleared."}
+
+async def process_upload(job, session_id: str, filename: str, filepath: str) -> dict:
+    """Background job: decodes an uploaded PCAP file in `decode_pool`, stores its session log and runs the initial
+    analysis, see `app.process_upload`.
+
+    Args:
+        job (Job): job to report progress to
+        session_id (str): chat session that uploaded the file
+        filename (str): secured file name
+        filepath (str): path of the saved upload
+
+    Returns:
+        dict: message and file path reported to the client
+    """
+    with metrics.collecting() as spans:
+        try:
+            job.update(stage="decoding")
+            # The decoding stages are timed in the worker process and recorded here
+            decode = partial(metrics.collect_call, pcap_transformation, filepath, enabled=metrics.registry.enabled)
+            (df, payloads), decode_spans = await asyncio.get_running_loop().run_in_executor(decode_pool, decode)
+            metrics.replay(decode_spans)
+            job.update(pairs=len(df))
+            config, inputs = await asyncio.to_thread(activate_capture, session_id, filename, df, payloads)
+            job.update(stage="analyzing")
+            with cache_scope(session_store.digest(session_id) or ""):
+                result = await graph.ainvoke(inputs, config=config)
+            chat_histories[session_id].append({"role": "assistant", "content": result["messages"][-1].content})
+            job.update(stage="done")
+        finally:
+            job.update(timings_ms=metrics.timings_ms(spans))
+
+    return {"message": f"File {filename} uploaded successfully", "filepath": filepath}
+
+@app.post("/upload")
+async def upload_file(request: Request, file: UploadFile | None = File(None)):
+    """Endpoint for uploading PCAP files. Saves the file and queues its processing; returns the job id to poll at
+    /jobs/<job_id>."""
+    session_id = chat_session(request)
+    if file is None:
+        return JSONResponse({"error": "No file part"}, status_code=400)
+    if file.filename == "":
+        return JSONResponse({"error": "No selected file"}, status_code=400)
+    if not allowed_file(file.filename):
+        return JSONResponse({"error": "Invalid file type. Only .pcap files and candump .log files are allowed."}, status_code=400)
+
+    async with limited("upload"):
+        filename = secure_filename(file.filename)
+        try:
+            filepath = await asyncio.to_thread(capture_storage.save, session_id, filename, file.file)
+        except QuotaExceeded as e:
+            return JSONResponse({"error": str(e)}, status_code=413)
+
+    try:
+        job = upload_jobs.submit(process_upload, session_id, filename, filepath)
+    except QueueFull as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+
+    # Update the session with the new file's name.
+    request.session["uploaded_file_info"] = filename
+    return JSONResponse({"message": f"File {filename} received, processing", "job_id": job.id}, status_code=202)
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Reports the status and progress of a background job (pairs decoded, analysis stage)."""
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    return job.to_dict()
+
+@app.get("/session_log")
+async def session_log_rows(request: Request, offset: int = 0, limit: int = 100, ecu: str | None = None, sid: str | None = None,
+                           error: str | None = None, capture: str | None = None, details: bool = False):
+    """Serves a window of rows of the session's active (or `capture`) session log as JSON, see `app.session_log_rows`."""
+    session_id = chat_session(request)
+    df = session_store.get(session_id, capture or None)
+    if df is None:
+        return JSONResponse({"error": "No PCAP file has been uploaded in this session."}, status_code=404)
+
+    async with limited("session_log"):
+        offset = max(offset, 0)
+        limit = min(max(limit, 0), SESSION_LOG_PAGE_LIMIT)
+        payloads = session_store.payloads(session_id, capture or None) if details else None
+        try:
+            return await asyncio.to_thread(session_log_window, df, offset, limit, payloads, ecu=ecu, sid=sid, error=error)
+        except OSError as exception:  # the capture file is gone, so show the rows without details
+            window = await asyncio.to_thread(session_log_window, df, offset, limit, ecu=ecu, sid=sid, error=error)
+            return {**window, "details_error": str(exception)}
+
+@app.get("/captures")
+async def list_captures(request: Request):
+    """Lists the captures of the session whose session logs are loaded, the active one last."""
+    return {"captures": session_store.captures(chat_session(request))}
+
+@app.get("/compare")
+async def compare_captures(request: Request, baseline: str | None = None, candidate: str | None = None):
+    """Compares two captures of the session, see `app.compare_session_captures`."""
+    session_id = chat_session(request)
+    async with limited("compare"):
+        response, status = await asyncio.to_thread(compare_session_captures, session_id, baseline, candidate)
+    return JSONResponse(response, status_code=status)
+
+@app.get("/llm_cache")
+async def llm_cache_stats():
+    """Reports the hit/miss counts and size of the shared LLM response cache."""
+    return llm_cache.stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Serves the metrics for Prometheus, see `app.metrics_page`."""
+    return PlainTextResponse(metrics_page(), media_type="text/plain; version=0.0.4")
+
+# -------------------
+# Main Entry Point
+# -------------------
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("asgi:app", host="0.0.0.0", port=8000)
@@ -0,0 +1,89 @@
+"""Benchmark of `combine_request_reply` on synthetic UDS sessions.
+
+Builds typed packet tables (as returned by `scan_pcap_file`) with a configurable number of packets, ECUs and
+missing-reply rate, and times the request/reply matcher on its own and the full combine step including the
+description merges.
+
+    python -m benchmarks.combine_request_reply --packets 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from pipeline.matching import match_request_reply
+from utils import combine_request_reply
+
+# pylint: disable=C0301
+
+SIDS = np.array([0x10, 0x22, 0x27, 0x2E, 0x31, 0x3E], dtype=np.uint8)
+NRCS = np.array([0x11, 0x22, 0x31, 0x33, 0x78], dtype=np.uint8)
+TESTER_ADDRESS = 0x0E00
+
+
+def synthetic_session(packets: int, ecus: int = 8, missing_rate: float = 0.01, negative_rate: float = 0.05, seed: int = 0) -> pd.DataFrame:
+    """Generates a typed UDS packet table of alternating requests and replies.
+
+    Args:
+        packets (int): approximate number of packets
+        ecus (int): number of ECU addresses the tester talks to
+        missing_rate (float): share of requests that get no reply
+        negative_rate (float): share of replies that are negative responses
+        seed (int): random seed
+
+    Returns:
+        pd.DataFrame: typed UDS packets, see `pipeline.scan.UDS_PACKET_DTYPES`
+    """
+    rng = np.random.default_rng(seed)
+    n_requests = packets // 2
+    ecu = (0x1000 + rng.integers(0, ecus, n_requests)).astype(np.uint16)
+    sid = SIDS[rng.integers(0, len(SIDS), n_requests)]
+    answered = rng.random(n_requests) >= missing_rate
+    negative = rng.random(n_requests) < negative_rate
+
+    request_number = np.arange(n_requests, dtype=np.int64) * 4 + 1
+    reply_number = request_number + rng.integers(1, 3, n_requests)
+    reply_sid = np.where(negative, 0x7F, sid + 0x40).astype(np.uint8)
+    reply_error = np.where(negative, NRCS[rng.integers(0, len(NRCS), n_requests)], 0).astype(np.uint8)
+
+    number = np.concatenate([request_number, reply_number[answered]])
+    order = np.argsort(number, kind='stable')
+    timestamp = (1_700_000_000_000_000_000 + number * 1_000_000).view('datetime64[ns]')
+
+    return pd.DataFrame({
+        'number': number.astype(np.uint32),
+        'timestamp': timestamp,
+        'source': np.concatenate([np.full(n_requests, TESTER_ADDRESS, dtype=np.uint16), ecu[answered]]),
+        'target': np.concatenate([ecu, np.full(answered.sum(), TESTER_ADDRESS, dtype=np.uint16)]),
+        'request': np.concatenate([np.ones(n_requests, dtype=bool), np.zeros(answered.sum(), dtype=bool)]),
+        'sid': np.concatenate([sid, reply_sid[answered]]),
+        'error': np.concatenate([np.zeros(n_requests, dtype=np.uint8), reply_error[answered]]),
+    }).iloc[order].reset_index(drop=True)
+
+
+def timed(function, *args) -> tuple[float, object]:
+    """Returns the wall time in seconds of a single call, and its result."""
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--packets', type=int, default=1_000_000)
+    parser.add_argument('--ecus', type=int, default=8)
+    parser.add_argument('--missing-rate', type=float, default=0.01)
+    parser.add_argument('--negative-rate', type=float, default=0.05)
+    args = parser.parse_args()
+
+    session = synthetic_session(args.packets, args.ecus, args.missing_rate, args.negative_rate)
+    print(f"{len(session):,} packets, {session['request'].sum():,} requests, {args.ecus} ECUs")
+
+    seconds, (requests, replies) = timed(match_request_reply, session['number'].to_numpy(), session['source'].to_numpy(),
+                                         session['target'].to_numpy(), session['sid'].to_numpy(), session['request'].to_numpy())
+    print(f"match_request_reply:   {seconds:8.3f} s  ({len(requests) / seconds:,.0f} requests/s)")
+
+    seconds, combined = timed(combine_request_reply, session)
+    print(f"combine_request_reply: {seconds:8.3f} s  ({len(combined):,} pairs)")
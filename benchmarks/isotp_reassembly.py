@@ -0,0 +1,171 @@
+"""Benchmark of CAN log ingestion and ISO-TP reassembly.
+
+Generates synthetic UDS over CAN traffic: a tester talking to up to 16 ECUs (`--ecus`) on 11-bit IDs 0x700+0x10*i
+(requests) and 0x708+0x10*i (replies), with single-frame requests and replies of 1 to `MAX_PAYLOAD` bytes, so longer replies are sent as
+a first frame, a flow control frame from the tester and consecutive frames. Exchanges with different ECUs overlap in
+time. A share of the consecutive frames is dropped (`--drop-rate`) or swapped with the next one (`--swap-rate`),
+which the reassembler must reject. All frames are padded to 8 bytes.
+
+The traffic is written as a candump log and as a SocketCAN pcap file (both reused from `--directory` when they already
+exist). Reading both, `reassemble` and the frame-by-frame `IsoTpReassembler` are timed in frames per second, and the
+benchmark checks that both files give the same frames and that both reassemblers give the same messages.
+
+    python -m benchmarks.isotp_reassembly --frames 1000000 10000000 --drop-rate 0.001
+"""
+import argparse
+import os
+import struct
+
+import numpy as np
+
+from pipeline.doip import UDS_NEGATIVE_RESPONSE, UDS_REPLY_FLAG
+from pipeline.isotp import IsoTpReassembler, LINKTYPE_CAN_SOCKETCAN, RESPONSE_ID_OFFSET, read_candump, read_socketcan_pcap, reassemble
+from benchmarks.combine_request_reply import timed
+
+# pylint: disable=C0301
+
+REQUEST_ID = 0x700
+ECU_ID_STEP = 0x10  # between the request IDs of two ECUs
+START_TIME_NS = 1_726_646_400_000_000_000  # 2024-09-18 08:00 UTC
+MAX_PAYLOAD = 62  # longest reply written, in bytes
+FRAME_INTERVAL_NS = 100_000  # between the frames of one exchange
+EXCHANGE_INTERVAL_NS = 1_000_000  # mean time between the starts of two exchanges, exponential
+REFERENCE_MAX_FRAMES = 2_000_000  # the frame-by-frame reassembler is only timed up to this many frames
+SIDS = np.array([0x10, 0x11, 0x19, 0x22, 0x22, 0x22, 0x27, 0x2E, 0x31, 0x3E, 0x3E], dtype=np.uint8)
+HEX_DIGITS = np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)
+
+
+def synthetic_frames(frames: int, ecus: int = 8, drop_rate: float = 0.0, swap_rate: float = 0.0, negative_rate: float = 0.05,
+                     seed: int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Generates about `frames` CAN frames of UDS exchanges, see the module docstring.
+
+    Returns:
+        tuple: timestamps (ns), arbitration IDs and data (frames x 8), in capture order
+    """
+    rng = np.random.default_rng(seed)
+    exchanges = max(frames // 4, 1)
+    ecu = rng.integers(0, ecus, exchanges)
+    sid = SIDS[rng.integers(0, len(SIDS), exchanges)]
+    negative = rng.random(exchanges) < negative_rate
+
+    # Messages: the request and the reply of every exchange
+    request_length = rng.integers(2, 8, exchanges)
+    reply_length = np.where(negative, 3, rng.integers(1, MAX_PAYLOAD + 1, exchanges))
+    length = np.stack([request_length, reply_length], axis=1).ravel()
+    payload = rng.integers(0, 256, (2 * exchanges, MAX_PAYLOAD + 8), dtype=np.uint8)
+    payload[0::2, 1] = sid
+    payload[1::2, 1] = np.where(negative, UDS_NEGATIVE_RESPONSE, sid | UDS_REPLY_FLAG)
+    payload[1::2, 2] = np.where(negative, sid, payload[1::2, 2])
+    payload[:, 0] = 0  # column 0 pads the window of first frames, see below
+    can_id = REQUEST_ID + ECU_ID_STEP * np.stack([ecu, ecu], axis=1).ravel() + np.tile([0, RESPONSE_ID_OFFSET], exchanges)
+
+    # Frames: a single frame, or a first frame, a flow control frame (on the other ID) and consecutive frames
+    multi = length > 7
+    count = np.where(multi, 2 + (length - 6 + 6) // 7, 1)
+    message = np.repeat(np.arange(len(length)), count)
+    position = np.arange(len(message)) - np.concatenate([[0], np.cumsum(count)[:-1]])[message]
+    frame_length = length[message]
+    is_multi = multi[message]
+    start = np.where(~is_multi, 1, np.where(position == 0, 0, 6 + (position - 2) * 7 + 1))  # first payload column, +1 for the pad
+    data = payload[message[:, None], start[:, None] + np.arange(7)]
+    header = np.where(~is_multi, frame_length, np.where(position == 0, 0x10 | frame_length >> 8, np.where(position == 1, 0x30, 0x20 | ((position - 1) & 0xF))))
+    data = np.concatenate([header[:, None].astype(np.uint8), data], axis=1)
+    first = is_multi & (position == 0)
+    data[first, 1] = frame_length[first] & 0xFF
+    flow_control = is_multi & (position == 1)
+    data[flow_control, 1:] = 0
+    last = np.where(is_multi, np.minimum(7, frame_length - (6 + (position - 2) * 7)) + 1, frame_length + 1)
+    data[np.arange(8) >= np.where(first | flow_control, 8, last)[:, None]] = 0xAA
+    ids = np.where(flow_control, can_id[message] + np.where(message % 2, -RESPONSE_ID_OFFSET, RESPONSE_ID_OFFSET), can_id[message])
+
+    # Timing: exchanges start at random times and overlap, frames of an exchange follow each other
+    exchange_start = START_TIME_NS + np.cumsum(rng.exponential(EXCHANGE_INTERVAL_NS, exchanges)).astype(np.int64)
+    exchange_position = np.arange(len(message)) - np.concatenate([[0], np.cumsum(count.reshape(-1, 2).sum(axis=1))[:-1]])[message // 2]
+    timestamp = exchange_start[message // 2] + exchange_position * FRAME_INTERVAL_NS
+
+    consecutive = is_multi & (position >= 2)
+    swap = np.flatnonzero(consecutive[:-1] & consecutive[1:] & (message[:-1] == message[1:]) & (rng.random(len(message) - 1) < swap_rate))
+    swap = swap[np.concatenate([[True], np.diff(swap) > 1])] if len(swap) else swap
+    data[swap], data[swap + 1] = data[swap + 1].copy(), data[swap].copy()
+    keep = ~(consecutive & (rng.random(len(message)) < drop_rate))
+
+    order = np.argsort(timestamp[keep], kind='stable')
+    return timestamp[keep][order], ids[keep][order].astype(np.uint32), data[keep][order]
+
+
+def write_candump(path: str, timestamp: np.ndarray, can_id: np.ndarray, data: np.ndarray) -> None:
+    """Writes 11-bit frames of 8 bytes as a candump log, e.g. '(1726646400.000100) can0 7E0#0322F190AAAAAAAA'."""
+    seconds, microseconds = timestamp // 1_000_000_000, timestamp // 1_000 % 1_000_000
+    columns = [np.full((len(can_id), 1), ord('('), dtype=np.uint8)]
+    columns += [(ord('0') + seconds // 10 ** power % 10).astype(np.uint8)[:, None] for power in range(9, -1, -1)]
+    columns += [np.full((len(can_id), 1), ord('.'), dtype=np.uint8)]
+    columns += [(ord('0') + microseconds // 10 ** power % 10).astype(np.uint8)[:, None] for power in range(5, -1, -1)]
+    columns += [np.tile(np.frombuffer(b') can0 ', dtype=np.uint8), (len(can_id), 1))]
+    columns += [HEX_DIGITS[(can_id >> shift) & 0xF][:, None] for shift in (8, 4, 0)]
+    columns += [np.full((len(can_id), 1), ord('#'), dtype=np.uint8)]
+    columns += [np.stack([HEX_DIGITS[data >> 4], HEX_DIGITS[data & 0xF]], axis=2).reshape(len(can_id), -1)]
+    columns += [np.full((len(can_id), 1), ord('\n'), dtype=np.uint8)]
+    with open(path, 'wb') as stream:
+        stream.write(np.concatenate(columns, axis=1).tobytes())
+
+
+def write_socketcan_pcap(path: str, timestamp: np.ndarray, can_id: np.ndarray, data: np.ndarray) -> None:
+    """Writes frames of 8 bytes as a pcap file with LINKTYPE_CAN_SOCKETCAN records."""
+    record = np.dtype([('seconds', '<u4'), ('microseconds', '<u4'), ('captured', '<u4'), ('length', '<u4'),
+                       ('can_id', '>u4'), ('dlc', 'u1'), ('pad', 'u1', 3), ('data', 'u1', 8)])
+    records = np.zeros(len(can_id), dtype=record)
+    records['seconds'] = timestamp // 1_000_000_000
+    records['microseconds'] = timestamp // 1_000 % 1_000_000
+    records['captured'] = records['length'] = 16
+    records['can_id'] = can_id
+    records['dlc'] = 8
+    records['data'] = data
+    with open(path, 'wb') as stream:
+        stream.write(struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, LINKTYPE_CAN_SOCKETCAN))
+        stream.write(records.tobytes())
+
+
+def reference_messages(frames, timeout: float) -> list[tuple[int, int, int, int]]:
+    """Reassembles frame by frame with `IsoTpReassembler`, as (frame number, CAN ID, length, SID) per message."""
+    reassembler = IsoTpReassembler(timeout)
+    add = reassembler.add
+    messages = []
+    for number, timestamp, can_id, length, data in zip(frames.number.tolist(), frames.timestamp.tolist(), frames.can_id.tolist(), frames.length.tolist(), frames.data):
+        payload = add(timestamp, can_id, data[:length].tobytes())
+        if payload:
+            messages.append((number, can_id, len(payload), payload[0]))
+    return messages
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--ecus', type=int, default=8)
+    parser.add_argument('--drop-rate', type=float, default=0.001)
+    parser.add_argument('--swap-rate', type=float, default=0.001)
+    parser.add_argument('--timeout', type=float, default=1.0)
+    parser.add_argument('--directory', default='.', help="where the synthetic logs are written")
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    for size in args.frames:
+        base = os.path.join(args.directory, f"synthetic_can_{size}_{args.ecus}_{args.drop_rate}_{args.swap_rate}")
+        if not (os.path.exists(base + '.log') and os.path.exists(base + '.pcap')):
+            columns = synthetic_frames(size, args.ecus, args.drop_rate, args.swap_rate)
+            write_candump(base + '.log', *columns)
+            write_socketcan_pcap(base + '.pcap', *columns)
+
+        log_seconds, log_frames = timed(read_candump, base + '.log')
+        pcap_seconds, frames = timed(read_socketcan_pcap, base + '.pcap')
+        same_frames = all(np.array_equal(a, b) for a, b in zip(log_frames, frames))
+        vector_seconds, (messages, stats) = timed(reassemble, frames, args.timeout)
+        n = len(frames.number)
+        print(f"{n:,} frames, {stats['messages']:,} messages; " + ', '.join(f"{name.replace('_', ' ')}: {count:,}" for name, count in stats.items() if name not in ('frames', 'messages')))
+        print(f"  read candump log:     {log_seconds:8.3f} s  ({n / log_seconds / 1e6:7.2f} M frames/s)")
+        print(f"  read SocketCAN pcap:  {pcap_seconds:8.3f} s  ({n / pcap_seconds / 1e6:7.2f} M frames/s)  same frames: {same_frames}")
+        print(f"  reassemble:           {vector_seconds:8.3f} s  ({n / vector_seconds / 1e6:7.2f} M frames/s)")
+        if n <= REFERENCE_MAX_FRAMES:
+            reference_seconds, reference = timed(reference_messages, frames, args.timeout)
+            vectorized = list(zip(messages.number.tolist(), messages.can_id.tolist(), messages.length.tolist(), messages.sid.tolist()))
+            print(f"  IsoTpReassembler:     {reference_seconds:8.3f} s  ({n / reference_seconds / 1e6:7.2f} M frames/s)  identical: {vectorized == reference}")
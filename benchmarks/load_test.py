@@ -0,0 +1,79 @@
+"""Load test of the web app with concurrent chat sessions.
+
+Every simulated session has its own cookie jar. It optionally uploads a capture and polls its job until the analysis
+is done, then sends chat messages and reads pages of its session log. Requests per second and latency percentiles are
+reported per endpoint. Works against both serving modes:
+
+    uvicorn asgi:app --port 8000          # or: python app.py
+    python -m benchmarks.load_test --sessions 1 8 32 --capture data/example.pcap
+
+The default messages are answered by the fast path (see `agents.fast_path`), so the test measures the serving stack
+rather than the model; pass `--message` to send other prompts.
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+
+import httpx
+import numpy as np
+
+# pylint: disable=C0301
+
+DEFAULT_MESSAGES = ["show the file", "what is NRC 0x22", "show the errors"]
+POLL_SECONDS = 0.5
+
+
+async def timed_request(client: httpx.AsyncClient, latencies: dict, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    latencies[endpoint if response.is_success else f"{endpoint} ({response.status_code})"].append(time.perf_counter() - start)
+    return response
+
+
+async def run_session(base_url: str, args: argparse.Namespace, latencies: dict) -> None:
+    """One chat session: history, optional upload and analysis, then chat turns and session log pages."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+        await timed_request(client, latencies, "history", "GET", "/history")
+        if args.capture:
+            with open(args.capture, "rb") as stream:
+                response = await timed_request(client, latencies, "upload", "POST", "/upload", files={"file": (args.capture.split("/")[-1], stream)})
+            if response.status_code == 202:
+                job_id = response.json()["job_id"]
+                start = time.perf_counter()
+                while (await client.get(f"/jobs/{job_id}")).json()["status"] not in ("done", "failed"):
+                    await asyncio.sleep(POLL_SECONDS)
+                latencies["upload job"].append(time.perf_counter() - start)
+
+        for turn in range(args.turns):
+            message = args.message[turn % len(args.message)]
+            await timed_request(client, latencies, "chat", "POST", "/chat", json={"message": message})
+            if args.capture:
+                await timed_request(client, latencies, "session_log", "GET", "/session_log", params={"offset": turn * 200, "limit": 200})
+
+
+async def run(base_url: str, sessions: int, args: argparse.Namespace) -> tuple[float, dict]:
+    latencies = defaultdict(list)
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(base_url, args, latencies) for _ in range(sessions)))
+    return time.perf_counter() - start, latencies
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 8, 32], help='concurrent sessions, one run per value')
+    parser.add_argument('--turns', type=int, default=10, help='chat messages per session')
+    parser.add_argument('--capture', help='PCAP file uploaded by every session before chatting')
+    parser.add_argument('--message', nargs='+', default=DEFAULT_MESSAGES)
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    for sessions in args.sessions:
+        seconds, latencies = asyncio.run(run(args.url, sessions, args))
+        requests = sum(len(values) for endpoint, values in latencies.items() if endpoint != 'upload job')
+        print(f"{sessions:3d} sessions: {requests} requests in {seconds:.2f} s ({requests / seconds:.1f} requests/s)")
+        for endpoint, values in sorted(latencies.items()):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            print(f"    {endpoint:<20} n={len(values):5d}  p50 {p50:8.1f} ms  p95 {p95:8.1f} ms  p99 {p99:8.1f} ms")
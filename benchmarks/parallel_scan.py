@@ -0,0 +1,33 @@
+"""Benchmark of parallel capture decoding.
+
+Times `scan_pcap_file` on one core against `scan_pcap_file_parallel` with an increasing number of worker processes,
+and checks that every parallel result is identical to the serial one.
+
+    python -m benchmarks.parallel_scan /path/to/large.pcap --workers 2 4 8
+"""
+import argparse
+import os
+
+from pipeline.parallel import scan_pcap_file_parallel, CHUNK_BYTES
+from pipeline.scan import scan_pcap_file
+from benchmarks.combine_request_reply import timed
+
+# pylint: disable=C0301
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('capture')
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, os.cpu_count() or 1])
+    parser.add_argument('--chunk-mb', type=float, default=CHUNK_BYTES / 2**20)
+    args = parser.parse_args()
+
+    size = os.path.getsize(args.capture) / 2**20
+    serial_seconds, serial = timed(scan_pcap_file, args.capture)
+    print(f"{size:,.0f} MiB, {len(serial):,} UDS messages")
+    print(f"serial:      {serial_seconds:8.3f} s  ({size / serial_seconds:6.1f} MiB/s)")
+
+    for workers in args.workers:
+        seconds, packets = timed(scan_pcap_file_parallel, args.capture, workers, int(args.chunk_mb * 2**20))
+        print(f"{workers:3d} workers: {seconds:8.3f} s  ({size / seconds:6.1f} MiB/s, x{serial_seconds / seconds:.2f})  identical: {packets.equals(serial)}")
@@ -0,0 +1,209 @@
+"""End-to-end benchmark of the capture pipeline, stage by stage.
+
+Writes synthetic captures of increasing size (see `benchmarks.synthetic_capture`; reused from `--captures` when they
+already exist) and runs every stage of an upload on each of them:
+
+- `scan_pcap_file` and `format_uds_packets` (together `read_pcap_file`)
+- `pair_packets` and `describe_request_reply` (together `combine_request_reply`)
+- `merge_sid_description` and `merge_nrc_description`
+- `convert_session_log_to_str`
+
+Every capture size runs in a fresh process, so its memory figures do not depend on the sizes before it. For every
+stage the wall time (the fastest of up to `--repeat` runs) and the peak resident set size of the process while it
+ran are recorded. On Linux the peak is reset before every stage (`/proc/self/clear_refs`); elsewhere it is the peak
+of the process so far.
+
+Results are written as JSON. With `--baseline`, stages that are slower or use more memory than in the baseline file
+beyond the tolerances are reported and the script exits with status 1; `--update-baseline` writes the results to the
+baseline file instead.
+
+    python -m benchmarks.pipeline_stages --packets 1000 10000 100000 1000000 10000000
+    python -m benchmarks.pipeline_stages --baseline benchmarks/baseline_pipeline_stages.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks.synthetic_capture import write_capture
+
+# pylint: disable=C0301
+
+DEFAULT_PACKETS = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline_pipeline_stages.json")
+MIN_STAGE_SECONDS = 2.0  # a stage is not repeated once its runs took this long in total
+TIME_TOLERANCE = 0.25  # relative slowdown reported as a regression
+TIME_NOISE_SECONDS = 0.01  # smaller absolute differences are never regressions
+RSS_TOLERANCE = 0.10
+RSS_NOISE_MIB = 16.0
+
+
+def _reset_peak_rss() -> None:
+    """Resets the peak RSS of this process to its current RSS, where the platform allows it."""
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as stream:
+            stream.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mib() -> float:
+    """Returns the peak resident set size of this process in MiB."""
+    try:
+        with open('/proc/self/status', encoding='ascii') as stream:
+            for line in stream:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KiB on Linux
+
+
+def run_stages(capture: str, repeat: int) -> dict:
+    """Worker: runs the pipeline stages on one capture.
+
+    Args:
+        capture (str): pcap file
+        repeat (int): most runs per stage, the fastest counts
+
+    Returns:
+        dict: 'messages' (UDS messages), 'pairs', 'baseline_rss_mib' (before the first stage) and 'stages', with the
+            'seconds' and 'peak_rss_mib' of every stage
+    """
+    # pylint: disable=C0415
+    from pipeline.scan import scan_pcap_file, format_uds_packets, parse_uds_packets
+    from pipeline.matching import pair_packets
+    from utils import describe_request_reply, merge_sid_description, merge_nrc_description, convert_session_log_to_str
+
+    results = {'baseline_rss_mib': round(_peak_rss_mib(), 1), 'stages': {}}
+
+    def stage(name, function, *args):
+        seconds = []
+        _reset_peak_rss()
+        while not seconds or (len(seconds) < repeat and sum(seconds) < MIN_STAGE_SECONDS):
+            start = time.perf_counter()
+            result = function(*args)
+            seconds.append(time.perf_counter() - start)
+        results['stages'][name] = {'seconds': round(min(seconds), 6), 'peak_rss_mib': round(_peak_rss_mib(), 1)}
+        return result
+
+    packets = stage('scan_pcap_file', scan_pcap_file, capture)
+    stage('format_uds_packets', format_uds_packets, packets)
+    pairs = stage('pair_packets', lambda typed: pair_packets(parse_uds_packets(typed)), packets)
+    session_log = stage('describe_request_reply', describe_request_reply, pairs)
+    codes = session_log[['ecu_address', 'request_sid', 'reply_sid', 'error']]
+    stage('merge_sid_description', merge_sid_description, codes)
+    stage('merge_nrc_description', merge_nrc_description, codes)
+    stage('convert_session_log_to_str', convert_session_log_to_str, session_log)
+
+    results.update(messages=len(packets), pairs=len(session_log))
+    return results
+
+
+def synthetic_capture(folder: str, packets: int, seed: int = 0) -> str:
+    """Returns the path of the synthetic capture with `packets` frames in `folder`, writing it if it is missing."""
+    path = os.path.join(folder, f"synthetic-{packets}-{seed}.pcap")
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        write_capture(path + ".tmp", packets, seed=seed)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def run_benchmark(packet_counts: list[int], captures: str, repeat: int = 3) -> dict:
+    """Runs `run_stages` on synthetic captures of every size, each in a fresh process.
+
+    Returns:
+        dict: run metadata ('created', 'commit', 'python', 'platform', 'cpus') and 'results' by packet count
+    """
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=False).stdout.strip() or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'results': {},
+    }
+    for packets in packet_counts:
+        capture = synthetic_capture(captures, packets)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as worker:
+            result = worker.submit(run_stages, capture, repeat).result()
+        report['results'][str(packets)] = {'capture_mib': round(os.path.getsize(capture) / 2**20, 1), **result}
+        print_result(packets, report['results'][str(packets)])
+    return report
+
+
+def print_result(packets: int, result: dict) -> None:
+    """Prints the stage timings of one capture size."""
+    print(f"\n{packets:,} packets ({result['capture_mib']:,} MiB, {result['messages']:,} UDS messages, {result['pairs']:,} pairs), {result['baseline_rss_mib']:,} MiB RSS before the first stage")
+    for name, stage in result['stages'].items():
+        print(f"  {name:<28} {stage['seconds']:10.4f} s  {stage['peak_rss_mib']:10,.1f} MiB peak")
+
+
+def find_regressions(report: dict, baseline: dict, time_tolerance: float = TIME_TOLERANCE, rss_tolerance: float = RSS_TOLERANCE) -> list[str]:
+    """Compares the stage timings and peak memory of a run with a baseline run.
+
+    Only capture sizes and stages present in both runs are compared. A stage regresses if it is more than
+    `time_tolerance` slower (and at least `TIME_NOISE_SECONDS`) or its peak RSS is more than `rss_tolerance` higher
+    (and at least `RSS_NOISE_MIB`) than in the baseline.
+
+    Returns:
+        list[str]: one line per regression, empty if there are none
+    """
+    regressions = []
+    for packets, result in report['results'].items():
+        reference = baseline['results'].get(packets)
+        if reference is None:
+            continue
+        for name, stage in result['stages'].items():
+            before = reference['stages'].get(name)
+            if before is None:
+                continue
+            if stage['seconds'] > before['seconds'] * (1 + time_tolerance) and stage['seconds'] - before['seconds'] >= TIME_NOISE_SECONDS:
+                regressions.append(f"{int(packets):,} packets, {name}: {stage['seconds']:.4f} s (baseline {before['seconds']:.4f} s, x{stage['seconds'] / before['seconds']:.2f})")
+            if stage['peak_rss_mib'] > before['peak_rss_mib'] * (1 + rss_tolerance) and stage['peak_rss_mib'] - before['peak_rss_mib'] >= RSS_NOISE_MIB:
+                regressions.append(f"{int(packets):,} packets, {name}: {stage['peak_rss_mib']:,.1f} MiB peak RSS (baseline {before['peak_rss_mib']:,.1f} MiB)")
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--packets', type=int, nargs='+', default=DEFAULT_PACKETS, help="capture sizes in frames")
+    parser.add_argument('--captures', default=os.path.join('cache', 'synthetic'), help="folder the synthetic captures are kept in")
+    parser.add_argument('--repeat', type=int, default=3, help="most runs per stage, the fastest counts")
+    parser.add_argument('--output', default=None, help="JSON file for the results (default: pipeline_stages-<time>.json)")
+    parser.add_argument('--baseline', nargs='?', const=DEFAULT_BASELINE, default=None, help=f"fail on regressions against this results file (default: {DEFAULT_BASELINE})")
+    parser.add_argument('--update-baseline', action='store_true', help="write the results to the baseline file")
+    parser.add_argument('--time-tolerance', type=float, default=TIME_TOLERANCE)
+    parser.add_argument('--rss-tolerance', type=float, default=RSS_TOLERANCE)
+    args = parser.parse_args()
+
+    report = run_benchmark(args.packets, args.captures, args.repeat)
+    if args.update_baseline:
+        output = args.baseline or DEFAULT_BASELINE
+    else:
+        output = args.output or f"pipeline_stages-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, 'w', encoding='utf-8') as stream:
+        json.dump(report, stream, indent=2)
+    print(f"\nResults: {output}")
+
+    if args.baseline and not args.update_baseline:
+        with open(args.baseline, encoding='utf-8') as stream:
+            baseline = json.load(stream)
+        if (baseline.get('platform'), baseline.get('cpus')) != (report['platform'], report['cpus']):
+            print(f"Note: the baseline was recorded on {baseline.get('platform')} with {baseline.get('cpus')} CPUs")
+        regressions = find_regressions(report, baseline, args.time_tolerance, args.rss_tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (commit {baseline.get('commit')})")
@@ -0,0 +1,271 @@
+"""Generator of synthetic DoIP/UDS captures.
+
+Writes a pcap file that looks like a tester session recorded on a DoIP gateway: Ethernet/IPv4/TCP frames on port
+13400 between the tester (logical address 0x0E00) and the gateway, one DoIP diagnostic message (payload type 0x8001)
+per frame, each request acknowledged by the gateway (0x8002) and answered by the addressed ECU. Requests follow each
+other sequentially; a request is sent once the final reply of the previous one has arrived, or after the P2 timeout
+if no reply comes. The service mix, the number of ECUs and the rates of negative replies, missing replies and
+response pending chains (NRC 0x78 before the final reply) are configurable, and the same seed always produces the
+same capture. Bare TCP acknowledgements are not written.
+
+Frames are built in chunks with NumPy (fixed-size header templates plus a padded payload matrix, compacted into
+variable-length records); ten million frames take about 20 seconds.
+
+    python -m benchmarks.synthetic_capture synthetic.pcap --packets 1000000 --ecus 16 --nrc-rate 0.05 --pending-rate 0.02
+"""
+import argparse
+import struct
+
+import numpy as np
+
+from pipeline.doip import DOIP_PORT, DOIP_DIAGNOSTIC_MESSAGE, UDS_NEGATIVE_RESPONSE, UDS_RESPONSE_PENDING, UDS_REPLY_FLAG
+from pipeline.timing import DEFAULT_TIMING
+
+# pylint: disable=C0301
+
+TESTER_ADDRESS = 0x0E00
+DOIP_DIAGNOSTIC_ACK = 0x8002
+START_TIME_US = 1_726_646_400_000_000  # 2024-09-18 08:00 UTC
+CHUNK_FRAMES = 1 << 16
+
+# SID: (parameter prefixes of the request, request length, positive reply length, request parameter bytes echoed in the reply)
+SERVICES = {
+    0x10: ([b'\x01', b'\x02', b'\x03'], 2, 6, 1),  # DiagnosticSessionControl, reply carries P2/P2* server
+    0x11: ([b'\x01', b'\x03'], 2, 2, 1),  # ECUReset
+    0x14: ([b'\xff\xff\xff'], 4, 1, 0),  # ClearDiagnosticInformation
+    0x19: ([b'\x02\xff', b'\x02\x08'], 3, 24, 1),  # ReadDTCInformation, availability mask and five DTC records
+    0x22: ([b'\xf1\x90', b'\xf1\x87', b'\xf1\x8c', b'\xf1\x95'], 3, 20, 2),  # ReadDataByIdentifier
+    0x27: ([b'\x01', b'\x03'], 2, 6, 1),  # SecurityAccess, requestSeed with a four-byte seed
+    0x2E: ([b'\xf1\x98', b'\xf1\x99'], 11, 3, 2),  # WriteDataByIdentifier
+    0x31: ([b'\x01\xff\x00', b'\x01\x02\x03'], 4, 5, 3),  # RoutineControl
+    0x3E: ([b'\x00'], 2, 2, 1),  # TesterPresent
+}
+GENERIC_SERVICE = ([b''], 2, 2, 1)  # SIDs of a custom mix that are not listed above
+DEFAULT_SID_MIX = {0x3E: 0.30, 0x22: 0.30, 0x10: 0.08, 0x19: 0.08, 0x31: 0.08, 0x27: 0.06, 0x2E: 0.05, 0x11: 0.03, 0x14: 0.02}
+DEFAULT_NRCS = np.array([0x10, 0x11, 0x12, 0x13, 0x22, 0x24, 0x31, 0x33, 0x35, 0x7E, 0x7F], dtype=np.uint8)
+MAX_PAYLOAD = 32  # longest UDS payload written, in bytes
+
+LATENCY_MEDIAN_US = 2_000  # first reply after the request, log-normal
+LATENCY_SIGMA = 0.6
+ACK_LATENCY_US = 100
+PENDING_INTERVAL_US = (100_000, 2_000_000)  # between two replies of a response pending chain, uniform
+GAP_MEDIAN_US = 1_000  # between the final reply and the next request, log-normal
+
+REQUEST, ACK, PENDING, FINAL = 0, 1, 2, 3
+
+# Frame layout: pcap record header, Ethernet, IPv4, TCP (no options), DoIP header, DoIP source/target address, UDS
+HEADER_LENGTH = 16 + 14 + 20 + 20 + 8 + 4
+FRAME = np.dtype({
+    'names': ['seconds', 'microseconds', 'captured', 'length', 'ip_length', 'ip_id', 'ip_checksum', 'sequence', 'acknowledgement', 'payload_type', 'doip_length', 'source', 'target'],
+    'formats': ['<u4', '<u4', '<u4', '<u4', '>u2', '>u2', '>u2', '>u4', '>u4', '>u2', '>u4', '>u2', '>u2'],
+    'offsets': [0, 4, 8, 12, 32, 34, 40, 54, 58, 72, 74, 78, 80],
+    'itemsize': HEADER_LENGTH + MAX_PAYLOAD,
+})
+HOSTS = ((b'\x02\x00\x00\x00\x00\x01', b'\x0a\x00\x00\x01', 49_152),  # tester: MAC, IP, TCP port
+         (b'\x02\x00\x00\x00\x00\x02', b'\x0a\x00\x00\x02', DOIP_PORT))  # DoIP gateway
+INITIAL_SEQUENCE = (0x1000_0000, 0x2000_0000)
+
+
+def _header_template(direction: int) -> np.ndarray:
+    """Constant header bytes of a frame from the tester (direction 0) or from the gateway (direction 1)."""
+    (source_mac, source_ip, source_port), (target_mac, target_ip, target_port) = HOSTS[direction], HOSTS[1 - direction]
+    header = (bytes(16) + target_mac + source_mac + b'\x08\x00'
+              + struct.pack('>BBHHHBBH4s4s', 0x45, 0, 0, 0, 0x4000, 64, 6, 0, source_ip, target_ip)
+              + struct.pack('>HHIIBBHHH', source_port, target_port, 0, 0, 0x50, 0x18, 0xFFFF, 0, 0)
+              + b'\x02\xfd' + bytes(10))
+    return np.frombuffer(header, dtype=np.uint8)
+
+
+TEMPLATES = np.stack([_header_template(0), _header_template(1)])
+
+
+def parse_sid_mix(text: str) -> dict[int, float]:
+    """Parses a service mix such as '22=40,3E=30,31=5' (hex SIDs, relative weights)."""
+    mix = {}
+    for item in text.split(','):
+        sid, weight = item.split('=')
+        mix[int(sid, 16)] = float(weight)
+    return mix
+
+
+class _Session:
+    """State carried from one chunk of frames to the next."""
+
+    def __init__(self, seed: int):
+        self.rng = np.random.default_rng(seed)
+        self.clock = START_TIME_US
+        self.frames = 0
+        self.sent = [0, 0]  # TCP payload bytes sent per direction
+
+
+def _requests(session: _Session, n: int, ecus: np.ndarray, sids: np.ndarray, weights: np.ndarray, nrc_rate: float,
+              missing_rate: float, pending_rate: float, max_pending: int) -> dict:
+    """Draws `n` requests with their outcome, timing, request payload and final reply payload."""
+    rng = session.rng
+    sid = sids[rng.choice(len(sids), n, p=weights)]
+    replied = rng.random(n) >= missing_rate
+    negative = replied & (rng.random(n) < nrc_rate)
+    pending = np.where(replied & (rng.random(n) < pending_rate), rng.integers(1, max_pending + 1, n), 0)
+
+    request_payload = rng.integers(0, 256, (n, MAX_PAYLOAD), dtype=np.uint8)
+    reply_payload = rng.integers(0, 256, (n, MAX_PAYLOAD), dtype=np.uint8)
+    request_length = np.empty(n, dtype=np.int64)
+    reply_length = np.empty(n, dtype=np.int64)
+    request_payload[:, 0] = sid
+    reply_payload[:, 0] = sid | UDS_REPLY_FLAG
+    for code in np.unique(sid):
+        rows = np.flatnonzero(sid == code)
+        prefixes, request_length[rows], reply_length[rows], echo = SERVICES.get(int(code), GENERIC_SERVICE)
+        prefix = np.frombuffer(b''.join(prefixes), dtype=np.uint8).reshape(len(prefixes), -1)
+        if prefix.shape[1]:
+            request_payload[rows, 1:1 + prefix.shape[1]] = prefix[rng.integers(0, len(prefix), len(rows))]
+        reply_payload[rows, 1:1 + echo] = request_payload[rows, 1:1 + echo]
+    negative_payload = np.stack([np.full(n, UDS_NEGATIVE_RESPONSE, dtype=np.uint8), sid, DEFAULT_NRCS[rng.integers(0, len(DEFAULT_NRCS), n)]], axis=1)
+    reply_payload[negative, :3] = negative_payload[negative]
+    reply_length[negative] = 3
+
+    latency = np.maximum(rng.lognormal(np.log(LATENCY_MEDIAN_US), LATENCY_SIGMA, n), 2 * ACK_LATENCY_US).astype(np.int64)
+    interval = rng.integers(*PENDING_INTERVAL_US, n)
+    duration = np.where(replied, latency + pending * interval, int(DEFAULT_TIMING.p2 * 1e6))
+    gap = rng.lognormal(np.log(GAP_MEDIAN_US), LATENCY_SIGMA, n).astype(np.int64) + 1
+    time = session.clock + np.concatenate([[0], np.cumsum(duration + gap)[:-1]])
+    session.clock = int(time[-1] + duration[-1] + gap[-1])
+
+    return {'ecu': ecus[rng.integers(0, len(ecus), n)], 'sid': sid, 'replied': replied, 'pending': pending, 'time': time,
+            'latency': latency, 'interval': interval, 'request_payload': request_payload, 'request_length': request_length,
+            'reply_payload': reply_payload, 'reply_length': reply_length}
+
+
+def _frames(session: _Session, requests: dict, acks: bool, limit: int) -> tuple[bytes, np.ndarray, np.ndarray]:
+    """Expands requests into their frames (request, acknowledgement, pending replies, final reply) and serializes them.
+
+    Returns:
+        tuple: the pcap records of at most `limit` frames, and the kind and UDS SID byte of every frame written
+    """
+    replied, pending = requests['replied'], requests['pending']
+    counts = 1 + int(acks) + pending + replied
+    request = np.repeat(np.arange(len(counts)), counts)[:limit]
+    position = np.arange(len(request)) - np.concatenate([[0], np.cumsum(counts)[:-1]])[request]
+    kind = np.where(position == 0, REQUEST, np.where(position <= int(acks), ACK, np.where(replied[request] & (position == counts[request] - 1), FINAL, PENDING)))
+    n = len(kind)
+
+    start = requests['time'][request]
+    first_reply = start + requests['latency'][request]
+    interval = requests['interval'][request]
+    time = np.select([kind == REQUEST, kind == ACK, kind == PENDING],
+                     [start, start + ACK_LATENCY_US, first_reply + (position - int(acks) - 1) * interval],
+                     first_reply + pending[request] * interval)
+
+    payload = np.zeros((n, MAX_PAYLOAD), dtype=np.uint8)
+    length = np.ones(n, dtype=np.int64)  # acknowledgements carry a single 0x00 code
+    for frame_kind, matrix, lengths in ((REQUEST, requests['request_payload'], requests['request_length']), (FINAL, requests['reply_payload'], requests['reply_length'])):
+        rows = kind == frame_kind
+        payload[rows] = matrix[request[rows]]
+        length[rows] = lengths[request[rows]]
+    rows = kind == PENDING
+    payload[rows, 0] = UDS_NEGATIVE_RESPONSE
+    payload[rows, 1] = requests['sid'][request[rows]]
+    payload[rows, 2] = UDS_RESPONSE_PENDING
+    length[rows] = 3
+
+    direction = (kind != REQUEST).astype(np.int64)
+    tcp_length = 12 + length  # DoIP header, source and target address, UDS payload
+    raw = np.empty((n, FRAME.itemsize), dtype=np.uint8)
+    raw[:, :HEADER_LENGTH] = TEMPLATES[direction]
+    raw[:, HEADER_LENGTH:] = payload
+    frame = raw.view(FRAME)[:, 0]
+    frame['seconds'] = time // 1_000_000
+    frame['microseconds'] = time % 1_000_000
+    frame['captured'] = frame['length'] = HEADER_LENGTH - 16 + length
+    frame['ip_length'] = 40 + tcp_length
+    frame['ip_id'] = (session.frames + np.arange(n)) & 0xFFFF
+    frame['payload_type'] = np.where(kind == ACK, DOIP_DIAGNOSTIC_ACK, DOIP_DIAGNOSTIC_MESSAGE)
+    frame['doip_length'] = 4 + length
+    ecu = requests['ecu'][request]
+    frame['source'] = np.where(kind == REQUEST, TESTER_ADDRESS, ecu)
+    frame['target'] = np.where(kind == REQUEST, ecu, TESTER_ADDRESS)
+
+    sent = []  # TCP bytes sent by each direction before every frame
+    for side in (0, 1):
+        own = np.where(direction == side, tcp_length, 0)
+        sent.append(session.sent[side] + np.cumsum(own) - own)
+        session.sent[side] += int(own.sum())
+    frame['sequence'] = (np.choose(direction, INITIAL_SEQUENCE) + np.choose(direction, sent)) & 0xFFFFFFFF
+    frame['acknowledgement'] = (np.choose(1 - direction, INITIAL_SEQUENCE) + np.choose(1 - direction, sent)) & 0xFFFFFFFF
+
+    words = (raw[:, 30:50:2].astype(np.uint32) << 8) + raw[:, 31:50:2]
+    checksum = words.sum(axis=1)
+    checksum = (checksum & 0xFFFF) + (checksum >> 16)
+    checksum = (checksum & 0xFFFF) + (checksum >> 16)
+    frame['ip_checksum'] = ~checksum & 0xFFFF
+
+    session.frames += n
+    return raw[np.arange(FRAME.itemsize) < (HEADER_LENGTH + length)[:, None]].tobytes(), kind, payload[:, 0]
+
+
+def write_capture(file_path: str, packets: int, ecus: int = 8, sid_mix: dict[int, float] | None = None, nrc_rate: float = 0.05,
+                  missing_rate: float = 0.01, pending_rate: float = 0.02, max_pending: int = 3, acks: bool = True, seed: int = 0) -> dict:
+    """Writes a synthetic DoIP/UDS capture, see the module docstring.
+
+    Args:
+        file_path (str): pcap file to write
+        packets (int): number of frames in the capture
+        ecus (int): number of ECUs the tester talks to, at logical addresses 0x1000, 0x1001, ...
+        sid_mix (dict | None): relative weight of every request SID, defaults to `DEFAULT_SID_MIX`
+        nrc_rate (float): share of answered requests whose final reply is negative
+        missing_rate (float): share of requests that get no reply at all
+        pending_rate (float): share of answered requests with a response pending chain before the final reply
+        max_pending (int): longest response pending chain (NRC 0x78 replies), chains are 1 to `max_pending` long
+        acks (bool): write the gateway's DoIP diagnostic message acknowledgement of every request
+        seed (int): random seed
+
+    Returns:
+        dict: number of 'frames', 'requests', 'replies' (final replies), 'negative' (final replies), 'missing' and
+            'pending' (response pending replies) written
+    """
+    sid_mix = sid_mix or DEFAULT_SID_MIX
+    sids = np.array(list(sid_mix), dtype=np.uint8)
+    weights = np.array(list(sid_mix.values()), dtype=float)
+    weights /= weights.sum()
+    addresses = (0x1000 + np.arange(ecus)).astype(np.uint16)
+    frames_per_request = 1 + acks + (1 - missing_rate) * (1 + pending_rate * (1 + max_pending) / 2)
+
+    session = _Session(seed)
+    counts = dict.fromkeys(['frames', 'requests', 'replies', 'negative', 'missing', 'pending'], 0)
+    with open(file_path, 'wb') as stream:
+        stream.write(struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 262_144, 1))  # microsecond timestamps, Ethernet
+        while session.frames < packets:
+            remaining = packets - session.frames
+            requests = _requests(session, max(1, int(min(remaining, CHUNK_FRAMES) / frames_per_request) + 1), addresses, sids, weights,
+                                 nrc_rate, missing_rate, pending_rate, max_pending)
+            records, kind, sid = _frames(session, requests, acks, remaining)
+            stream.write(records)
+
+            written = np.bincount(kind, minlength=4)
+            counts['requests'] += int(written[REQUEST])
+            counts['replies'] += int(written[FINAL])
+            counts['pending'] += int(written[PENDING])
+            counts['negative'] += int(np.count_nonzero((kind == FINAL) & (sid == UDS_NEGATIVE_RESPONSE)))
+    counts['frames'] = session.frames
+    counts['missing'] = counts['requests'] - counts['replies']
+    return counts
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output', help="pcap file to write")
+    parser.add_argument('--packets', type=int, default=100_000, help="frames in the capture")
+    parser.add_argument('--ecus', type=int, default=8)
+    parser.add_argument('--sid-mix', type=parse_sid_mix, default=None, help="request SIDs and relative weights, e.g. '22=40,3E=30,31=5'")
+    parser.add_argument('--nrc-rate', type=float, default=0.05)
+    parser.add_argument('--missing-rate', type=float, default=0.01)
+    parser.add_argument('--pending-rate', type=float, default=0.02)
+    parser.add_argument('--max-pending', type=int, default=3)
+    parser.add_argument('--no-acks', action='store_true', help="omit the DoIP diagnostic message acknowledgements")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    written = write_capture(args.output, args.packets, args.ecus, args.sid_mix, args.nrc_rate, args.missing_rate, args.pending_rate,
+                            args.max_pending, not args.no_acks, args.seed)
+    print(", ".join(f"{count:,} {name}" for name, count in written.items()))
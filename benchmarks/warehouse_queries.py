@@ -0,0 +1,68 @@
+"""Benchmark of the capture warehouse at scale.
+
+Fills a fresh warehouse database with synthetic session logs (random ECUs, SIDs, NRCs and log-normal latencies over
+30 days), then times the statistics queries the agents use.
+
+    python -m benchmarks.warehouse_queries --pairs 20000000 --db /tmp/warehouse.db
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from pipeline.warehouse import CaptureWarehouse
+from benchmarks.combine_request_reply import timed
+
+# pylint: disable=C0301
+
+CAPTURE_PAIRS = 1_000_000
+ECUS = [f"0x{address:04x}" for address in (0x0e80, 0x1032, 0x17fe, 0xe001, 0x0010, 0x0011, 0x0012, 0x0013)]
+SIDS = ['0x10', '0x11', '0x14', '0x19', '0x22', '0x27', '0x2E', '0x31', '0x3E']
+NRCS = ['0x10', '0x12', '0x13', '0x22', '0x31', '0x33', '0x35', '0x7E', '0x7F']
+
+
+def synthetic_session_log(pairs: int, seed: int) -> pd.DataFrame:
+    """Random session log of one capture, see `utils.combine_request_reply` (without descriptions)."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2024-09-01') + pd.Timedelta(days=float(rng.uniform(0, 30)))
+    reply = rng.choice(['positive', 'negative', 'missing'], pairs, p=[0.9, 0.09, 0.01])
+    return pd.DataFrame({
+        'ecu_address': rng.choice(ECUS, pairs),
+        'request_sid': rng.choice(SIDS, pairs),
+        'reply_sid': np.where(reply == 'positive', '0x62', np.where(reply == 'negative', '0x7F', None)),
+        'error': np.where(reply == 'negative', rng.choice(NRCS, pairs), np.where(reply == 'missing', 'p6 parameter timout', 'No error')),
+        'request_timestamp': start + pd.to_timedelta(np.cumsum(rng.integers(1, 5_000_000, pairs))),
+        'latency_ms': np.where(reply == 'missing', np.nan, rng.lognormal(1.5, 0.8, pairs)),
+        'pending_responses': np.zeros(pairs, np.uint16),
+    })
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pairs', type=int, default=10_000_000)
+    parser.add_argument('--db', default='warehouse_benchmark.db')
+    args = parser.parse_args()
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    warehouse = CaptureWarehouse(args.db)
+
+    seconds = 0.0
+    for capture in range(0, args.pairs, CAPTURE_PAIRS):
+        session_log = synthetic_session_log(min(CAPTURE_PAIRS, args.pairs - capture), capture)
+        seconds += timed(warehouse.add, session_log, f"synthetic-{capture}", 'benchmark', f"synthetic-{capture}")[0]
+    print(f"ingest: {args.pairs:,} pairs in {seconds:.1f} s ({args.pairs / seconds:,.0f} pairs/s), {os.path.getsize(args.db) / 2**20:,.0f} MiB")
+
+    queries = {
+        "ECUs returning NRC 0x33, one week": lambda: warehouse.nrc_counts('0x33', since='2024-09-20', until='2024-09-27', limit=5),
+        "NRCs of all ECUs, all time": lambda: warehouse.nrc_counts(limit=20),
+        "p50/p95/p99 latency per SID, all time": warehouse.latency_percentiles,
+        "p95 latency per SID and ECU, one week": lambda: warehouse.latency_percentiles(since='2024-09-20', until='2024-09-27', by_ecu=True),
+        "requests per service of one ECU": lambda: warehouse.service_counts(ecu='0x0e80'),
+    }
+    for name, query in queries.items():
+        seconds, result = timed(query)
+        print(f"{name:<40} {seconds * 1000:8.1f} ms  ({len(result)} rows)")
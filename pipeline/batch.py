@@ -0,0 +1,232 @@
+"""Headless batch analysis of directories of captures.
+
+Walks a directory tree for pcap/pcapng files, turns each capture into a session log in a pool of worker processes
+(the same decoding, pairing and description as an upload, see `utils.combine_request_reply`) and writes:
+
+- `<output>/pairs/`: all request/reply pairs as one Parquet dataset, partitioned by request date and ECU address
+  (`date=2024-09-18/ecu_address=0x1032/<path hash>-0.parquet`), with the capture id (content hash) and path on every
+  row;
+- `<output>/progress.jsonl`: one line per processed capture with its error summary (pairs, negative replies per NRC,
+  missing replies, timing violations), appended as captures finish;
+- `<output>/summary.parquet`: the error summaries of all captures, consolidated at the end of a run.
+
+Runs are resumable: captures recorded in `progress.jsonl` with the same size and modification time are skipped.
+With `--analyze`, the pcap analyzer agent additionally writes a short diagnosis for every capture that contains
+negative replies or missing replies; all other captures never reach the LLM. With `--warehouse`, the pairs are also
+appended to the capture warehouse (see `pipeline.warehouse`).
+
+    python -m pipeline.batch /data/bench-captures --output fleet --workers 8 --analyze
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from .cache import file_digest
+from .streaming import CAPTURE_EXTENSIONS
+from .warehouse import CaptureWarehouse, WAREHOUSE_DB
+
+# pylint: disable=C0301
+
+PROGRESS_FILE = "progress.jsonl"
+SUMMARY_FILE = "summary.parquet"
+PAIRS_FOLDER = "pairs"
+PARTITION_COLUMNS = ['date', 'ecu_address']
+ANALYSIS_WORKERS = 4  # captures analysed by the LLM at the same time
+
+
+def find_captures(root: str) -> list[str]:
+    """Returns the paths of all pcap/pcapng files below `root`, sorted."""
+    captures = []
+    for folder, _, files in os.walk(root):
+        captures += [os.path.join(folder, name) for name in files if name.lower().endswith(CAPTURE_EXTENSIONS)]
+    return sorted(captures)
+
+
+def load_progress(output: str) -> dict:
+    """Returns the latest progress record of every capture processed by earlier runs, by capture path."""
+    records = {}
+    try:
+        with open(os.path.join(output, PROGRESS_FILE), encoding='utf-8') as stream:
+            for line in stream:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # a line cut short by an interrupted run
+                    continue
+                records[record['path']] = record
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def error_summary(session_log: pd.DataFrame) -> dict:
+    """Counts the problems of a session log.
+
+    Args:
+        session_log (pd.DataFrame): session log, see `utils.combine_request_reply`
+
+    Returns:
+        dict: 'pairs', 'ecus', 'negative' (negative replies), 'nrcs' (negative replies per NRC), 'missing' (requests
+            without a reply) and 'timing_violations'
+    """
+    missing = session_log['reply_sid'].isnull()
+    negative = (session_log['error'] != 'No error') & ~missing
+    return {
+        'pairs': len(session_log),
+        'ecus': int(session_log['ecu_address'].nunique()),
+        'negative': int(negative.sum()),
+        'nrcs': {str(nrc): int(count) for nrc, count in session_log.loc[negative, 'error'].value_counts().sort_index().items()},
+        'missing': int(missing.sum()),
+        'timing_violations': int((session_log['timing'] != 'OK').sum()),
+    }
+
+
+def process_capture(path: str, root: str, output: str, use_cache: bool = False, keep_session_log: bool = False,
+                    warehouse: str | None = None) -> tuple[dict, pd.DataFrame | None]:
+    """Worker: decodes one capture, writes its pairs to the dataset and summarizes its errors.
+
+    Args:
+        path (str): capture file
+        root (str): directory the capture paths are reported relative to
+        output (str): output directory
+        use_cache (bool): look up and store the decoded pairs in the shared pair cache (see `pipeline.cache`)
+        keep_session_log (bool): also return the session log if it contains negative or missing replies
+        warehouse (str | None): capture warehouse database the pairs are appended to
+
+    Returns:
+        tuple: progress record, and the session log if requested (else None)
+    """
+    from utils import pcap_transformation_wrapper  # pylint: disable=C0415
+
+    start = time.perf_counter()
+    stat = os.stat(path)
+    record = {'path': path, 'capture': os.path.relpath(path, root), 'size': stat.st_size, 'mtime': stat.st_mtime}
+    try:
+        capture_id = file_digest(path)
+        session_log = pcap_transformation_wrapper(path, use_cache=use_cache)
+        pairs = session_log.assign(capture_id=capture_id, capture=record['capture'],
+                                   date=session_log['request_timestamp'].dt.strftime('%Y-%m-%d').fillna('unknown'))
+        if len(pairs):
+            # One file per partition and capture, named by the capture path: reprocessing a capture overwrites its files
+            path_key = hashlib.blake2b(record['capture'].encode(), digest_size=10).hexdigest()
+            pairs.to_parquet(os.path.join(output, PAIRS_FOLDER), partition_cols=PARTITION_COLUMNS, index=False,
+                             basename_template=f"{path_key}-{{i}}.parquet", existing_data_behavior='overwrite_or_ignore')
+        if warehouse is not None:
+            CaptureWarehouse(warehouse).add(session_log, record['capture'], source=root, digest=capture_id)
+        record.update(capture_id=capture_id, status='done', **error_summary(session_log))
+    except Exception as e:  # pylint: disable=W0718
+        record.update(status='failed', error=f"{type(e).__name__}: {e}")
+        session_log = None
+    record['seconds'] = round(time.perf_counter() - start, 3)
+
+    problems = record.get('negative', 0) + record.get('missing', 0)
+    return record, session_log if keep_session_log and problems else None
+
+
+def analyze_capture(record: dict, session_log: pd.DataFrame) -> str:
+    """Asks the pcap analyzer agent for a diagnosis of one capture."""
+    from utils import session_store  # pylint: disable=C0415
+    from agents.pcap_analyzer import pcap_analyzer_agent  # pylint: disable=C0415
+
+    thread_id = f"batch:{record['capture']}"
+    session_store.put(thread_id, os.path.basename(record['path']), session_log)
+    try:
+        result = pcap_analyzer_agent.invoke({"messages": [{"role": "user", "content": "Please analyze the uploaded PCAP file."}]},
+                                            config={"configurable": {"thread_id": thread_id}})
+        return result["messages"][-1].content
+    finally:
+        session_store.drop(thread_id)
+
+
+def write_summary(output: str) -> pd.DataFrame:
+    """Consolidates the progress records into `summary.parquet`, one row per capture."""
+    summary = pd.DataFrame(list(load_progress(output).values()))
+    if 'nrcs' in summary.columns:
+        summary['nrcs'] = summary['nrcs'].map(lambda nrcs: json.dumps(nrcs) if isinstance(nrcs, dict) else None)
+    summary.to_parquet(os.path.join(output, SUMMARY_FILE), index=False)
+    return summary
+
+
+def run_batch(root: str, output: str, workers: int | None = None, analyze: bool = False, use_cache: bool = False,
+              warehouse: str | None = None) -> pd.DataFrame:
+    """Processes all captures below `root` that earlier runs have not processed, see the module docstring.
+
+    Args:
+        root (str): directory searched for captures
+        output (str): output directory, created if missing
+        workers (int | None): decoding processes, defaults to the number of CPUs
+        analyze (bool): have the LLM diagnose captures with negative or missing replies
+        use_cache (bool): use the shared pair cache, see `process_capture`
+        warehouse (str | None): capture warehouse database the pairs are also appended to
+
+    Returns:
+        pd.DataFrame: the consolidated summary of all captures processed so far
+    """
+    os.makedirs(output, exist_ok=True)
+    done = load_progress(output)
+    pending = []
+    for path in find_captures(root):
+        previous = done.get(path)
+        stat = os.stat(path)
+        if previous and previous['status'] == 'done' and (previous['size'], previous['mtime']) == (stat.st_size, stat.st_mtime) \
+                and not (analyze and previous.get('negative', 0) + previous.get('missing', 0) and 'analysis' not in previous):
+            continue
+        pending.append(path)
+    print(f"{len(pending)} captures to process, {len(done)} recorded by earlier runs")
+
+    lock = threading.Lock()
+    progress = open(os.path.join(output, PROGRESS_FILE), 'a', encoding='utf-8')  # pylint: disable=R1732
+    finished = 0
+
+    def record_done(record: dict) -> None:
+        nonlocal finished
+        with lock:
+            progress.write(json.dumps(record) + '\n')
+            progress.flush()
+            finished += 1
+            status = record['status'] if record['status'] == 'failed' else f"{record['pairs']} pairs, {record['negative']} negative, {record['missing']} missing"
+            print(f"[{finished}/{len(pending)}] {record['capture']}: {status}")
+
+    def analyzed(record: dict, session_log: pd.DataFrame) -> None:
+        try:
+            record['analysis'] = analyze_capture(record, session_log)
+        except Exception as e:  # pylint: disable=W0718
+            record['analysis_error'] = f"{type(e).__name__}: {e}"
+        record_done(record)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as decoders, ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS) as analysts:
+            futures = [decoders.submit(process_capture, path, root, output, use_cache, analyze, warehouse) for path in pending]
+            for future in as_completed(futures):
+                record, session_log = future.result()
+                if session_log is not None:
+                    analysts.submit(analyzed, record, session_log)
+                else:
+                    record_done(record)
+    finally:
+        progress.close()
+
+    return write_summary(output)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Batch-process a directory tree of captures into a Parquet dataset with per-capture error summaries.")
+    parser.add_argument('root', help="directory searched for pcap/pcapng files")
+    parser.add_argument('--output', default='batch', help="output directory")
+    parser.add_argument('--workers', type=int, default=None, help="decoding processes (default: number of CPUs)")
+    parser.add_argument('--analyze', action='store_true', help="have the LLM diagnose captures with negative or missing replies")
+    parser.add_argument('--use-cache', action='store_true', help="use the shared pair cache of the web app")
+    parser.add_argument('--warehouse', nargs='?', const=WAREHOUSE_DB, default=None, help=f"also append the pairs to the capture warehouse (default database: {WAREHOUSE_DB})")
+    args = parser.parse_args()
+
+    summary = run_batch(args.root, args.output, args.workers, args.analyze, args.use_cache, args.warehouse)
+    if len(summary):
+        failed = int((summary['status'] == 'failed').sum())
+        problems = int(((summary['negative'].fillna(0) + summary['missing'].fillna(0)) > 0).sum())
+        print(f"{len(summary)} captures, {failed} failed, {problems} with negative or missing replies. Summary: {os.path.join(args.output, SUMMARY_FILE)}")
@@ -0,0 +1,139 @@
+"""Content-addressed cache of processed captures.
+
+Captures are identified by a BLAKE2b hash of their bytes plus `DECODER_VERSION`, so a re-uploaded capture (under any
+file name) skips decoding and pairing entirely. The typed request/reply pairs (see `pipeline.matching.PAIR_DTYPES`)
+are stored as Parquet files; SID/NRC descriptions and timing checks are applied after loading, so changes to the code
+database or the P2/P2* budgets never serve stale results (the default P6 deadline is used in pairing, so changing it
+needs a new `DECODER_VERSION`). The least recently used entries are evicted once the
+cache exceeds its size limit.
+"""
+import hashlib
+import os
+import tempfile
+from typing import Callable
+
+import pandas as pd
+
+from .matching import pair_packets
+from .metrics import span
+from .scan import scan_pcap_file
+
+# pylint: disable=C0301
+
+DECODER_VERSION = 5  # bump whenever decoding or pairing changes the pairs of an unchanged capture
+CACHE_FOLDER = "cache"
+CACHE_MAX_BYTES = 1 << 30
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(file_path: str) -> str:
+    """Hashes a file in chunks, without reading it into memory at once.
+
+    Args:
+        file_path (str): string path to the file
+
+    Returns:
+        str: hex digest of the file contents
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PairCache:
+    """Directory of Parquet files, one per processed capture, with size-based LRU eviction.
+
+    Args:
+        folder (str): cache directory, created on first write
+        max_bytes (int): total size above which the least recently used entries are deleted
+        workers (int): processes used to decode large captures on a miss, see `scan_pcap_file`
+    """
+
+    def __init__(self, folder: str = CACHE_FOLDER, max_bytes: int = CACHE_MAX_BYTES, workers: int = 1):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.workers = workers
+
+    def key(self, file_path: str) -> str:
+        """Returns the cache key of a capture: its content hash and the decoder version."""
+        return f"{file_digest(file_path)}-v{DECODER_VERSION}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.parquet")
+
+    def get(self, key: str) -> pd.DataFrame | None:
+        """Loads the pairs stored under `key`, or returns None on a miss. A hit marks the entry as recently used."""
+        path = self._path(key)
+        try:
+            pairs = pd.read_parquet(path)
+            os.utime(path)
+        except (FileNotFoundError, OSError, ValueError):  # missing, or evicted/corrupt while being read
+            return None
+        return pairs
+
+    def put(self, key: str, pairs: pd.DataFrame) -> None:
+        """Stores pairs under `key`, then evicts least recently used entries beyond the size limit."""
+        os.makedirs(self.folder, exist_ok=True)
+        # Write to a temporary file first, so concurrent readers never see a partial entry
+        descriptor, temporary = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        os.close(descriptor)
+        try:
+            pairs.to_parquet(temporary, index=False)
+            os.replace(temporary, self._path(key))
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        self.evict()
+
+    def evict(self) -> None:
+        """Deletes the least recently used entries until the cache fits into `max_bytes`."""
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.parquet'):
+                try:
+                    stat = os.stat(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def pairs(self, file_path: str, progress: Callable[..., None] | None = None) -> pd.DataFrame:
+        """Returns the request/reply pairs of a capture, decoding and pairing it only on a cache miss.
+
+        Args:
+            file_path (str): string path to the pcap/pcapng file
+            progress (Callable | None): called with keyword counts as work completes: `packets` while decoding (see
+                `scan_pcap_file`), `pairs` once paired and `cached` (True on a hit)
+
+        Returns:
+            pd.DataFrame: typed request/reply pairs, see `pipeline.matching.PAIR_DTYPES`
+        """
+        with span("hash"):
+            key = self.key(file_path)
+        with span("cache_lookup"):
+            pairs = self.get(key)
+        if pairs is None:
+            with span("scan") as stage:
+                packets = scan_pcap_file(file_path, progress, self.workers)
+                stage.rows = len(packets)
+            with span("pair") as stage:
+                pairs = pair_packets(packets)
+                stage.rows = len(pairs)
+            with span("cache_store"):
+                self.put(key, pairs)
+        elif progress is not None:
+            progress(cached=True)
+        if progress is not None:
+            progress(pairs=len(pairs))
+        return pairs
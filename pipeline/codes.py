@@ -0,0 +1,82 @@
+"""In-process index of the UDS code descriptions.
+
+The 'sid' and 'nrc' tables of the SQLite code database are loaded once into 256-entry arrays indexed by the code
+byte, so descriptions are attached to a whole session log with a single array take instead of string-keyed merges.
+The database file is checked (modification time and size) on every access and the index reloads itself when the file
+has changed; `invalidate` forces a reload.
+"""
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+# pylint: disable=C0301
+
+UDS_CODES_DB = 'uds/uds_codes.db'
+CODE_TABLES = ('sid', 'nrc')
+
+
+class CodeIndex:
+    """Descriptions of SIDs and NRCs by code byte, loaded lazily from the code database.
+
+    Args:
+        db_path (str): path of the SQLite database with 'sid' and 'nrc' tables of (Code, Description)
+    """
+
+    def __init__(self, db_path: str = UDS_CODES_DB):
+        self.db_path = db_path
+        self._signature = None
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        """Drops the loaded tables, so the next lookup reads the database again."""
+        with self._lock:
+            self._signature = None
+
+    def table(self, name: str) -> np.ndarray:
+        """Returns the descriptions of a code table ('sid' or 'nrc') as a 256-entry object array, None where the
+        code is not in the database. Reloads the tables if the database file changed since they were read."""
+        stat = os.stat(self.db_path)
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if signature != self._signature:
+                self._tables = self._load()
+                self._signature = signature
+            return self._tables[name]
+
+    def _load(self) -> dict[str, np.ndarray]:
+        tables = {}
+        with sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True) as conn:
+            for name in CODE_TABLES:
+                descriptions = np.full(256, None, dtype=object)
+                for code, description in conn.execute(f'SELECT Code, Description FROM {name}'):
+                    try:
+                        value = int(code, 16)
+                    except (TypeError, ValueError):
+                        continue
+                    if 0 <= value < 256 and descriptions[value] is None:  # codes are unique in the database, keep the first otherwise
+                        descriptions[value] = description
+                tables[name] = descriptions
+        conn.close()
+        return tables
+
+    def describe(self, name: str, codes: np.ndarray) -> np.ndarray:
+        """Looks up the descriptions of an array of code bytes (None where unknown)."""
+        return self.table(name)[np.asarray(codes, dtype=np.uint8)]
+
+    def describe_hex(self, name: str, codes: pd.Series) -> np.ndarray:
+        """Looks up the descriptions of hex code strings such as '0x22' (None where unknown or missing)."""
+        table = self.table(name)
+        lookup = {}
+        for code in codes.dropna().unique():
+            try:
+                value = int(code, 16)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= value < 256:
+                lookup[code] = table[value]
+        described = codes.map(lookup)
+        return np.where(described.isnull(), None, described.to_numpy(dtype=object))
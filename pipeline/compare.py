@@ -0,0 +1,133 @@
+"""Comparison of two session logs, e.g. a good and a bad bench capture of the same test sequence.
+
+Both logs are aggregated per service (ECU address and request SID) and per NRC, and the aggregates are joined on
+their (ECU, SID[, NRC]) index, so the cost is one group-by per log regardless of how the pairs interleave. The
+differences reported are:
+
+- new errors: negative replies with an NRC the baseline returned less often (or never) for that service;
+- resolved errors: the reverse;
+- missing replies: services with more requests left without a final reply than in the baseline;
+- latency regressions: services whose p95 latency grew by at least `latency_ratio` and `min_latency_delta_ms`;
+- services requested in only one of the captures.
+"""
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# pylint: disable=C0301
+
+SERVICE_KEY = ['ecu_address', 'request_sid']
+LATENCY_RATIO = 1.5  # p95 latency growth factor reported as a regression
+MIN_LATENCY_DELTA_MS = 5.0  # ignore regressions smaller than this, e.g. 1 ms -> 2 ms
+
+
+class Comparison(NamedTuple):
+    """Differences between a baseline and a candidate session log, one DataFrame per kind (see the module docstring).
+    Each is indexed by ECU address and request SID (and NRC for the error frames) and holds the baseline and
+    candidate values side by side."""
+    new_errors: pd.DataFrame
+    resolved_errors: pd.DataFrame
+    missing_replies: pd.DataFrame
+    latency_regressions: pd.DataFrame
+    new_services: pd.DataFrame
+    missing_services: pd.DataFrame
+
+
+def _per_service(session_log: pd.DataFrame) -> pd.DataFrame:
+    """Requests, negative replies, missing replies and latency percentiles per (ECU, SID)."""
+    missing = session_log['reply_sid'].isnull().to_numpy()
+    frame = pd.DataFrame({
+        'ecu_address': session_log['ecu_address'].to_numpy(),
+        'request_sid': session_log['request_sid'].to_numpy(),
+        'negative': (session_log['error'].to_numpy() != 'No error') & ~missing,
+        'missing': missing,
+        'latency_ms': session_log['latency_ms'].to_numpy(dtype=float) if 'latency_ms' in session_log.columns else np.nan,
+    })
+    grouped = frame.groupby(SERVICE_KEY, sort=True)
+    return pd.DataFrame({
+        'requests': grouped.size(),
+        'negative': grouped['negative'].sum(),
+        'missing': grouped['missing'].sum(),
+        'p50_ms': grouped['latency_ms'].median(),
+        'p95_ms': grouped['latency_ms'].quantile(0.95),
+    })
+
+
+def _per_nrc(session_log: pd.DataFrame) -> pd.Series:
+    """Negative replies per (ECU, SID, NRC)."""
+    negative = (session_log['error'] != 'No error') & session_log['reply_sid'].notnull()
+    return session_log.loc[negative].groupby(SERVICE_KEY + ['error'], sort=True).size().rename('replies')
+
+
+def compare_session_logs(baseline: pd.DataFrame, candidate: pd.DataFrame, latency_ratio: float = LATENCY_RATIO,
+                         min_latency_delta_ms: float = MIN_LATENCY_DELTA_MS) -> Comparison:
+    """Diffs two session logs by ECU, SID and NRC.
+
+    Args:
+        baseline (pd.DataFrame): session log of the reference capture, see `utils.combine_request_reply`
+        candidate (pd.DataFrame): session log of the capture under test
+        latency_ratio (float): minimum growth factor of the p95 latency reported as a regression
+        min_latency_delta_ms (float): minimum growth of the p95 latency in milliseconds reported as a regression
+
+    Returns:
+        Comparison: the differences
+    """
+    services = _per_service(baseline).join(_per_service(candidate), how='outer', lsuffix='_baseline', rsuffix='_candidate')
+    in_baseline = services['requests_baseline'].notnull()
+    in_candidate = services['requests_candidate'].notnull()
+    both = services[in_baseline & in_candidate]
+
+    nrcs = pd.concat([_per_nrc(baseline).rename('baseline'), _per_nrc(candidate).rename('candidate')], axis=1).fillna(0).astype(int)
+    nrcs.index.names = SERVICE_KEY + ['nrc']
+
+    missing = both[['requests_baseline', 'missing_baseline', 'requests_candidate', 'missing_candidate']].astype(int)
+    latency = both[['requests_baseline', 'p50_ms_baseline', 'p95_ms_baseline', 'requests_candidate', 'p50_ms_candidate', 'p95_ms_candidate']]
+    regressed = (latency['p95_ms_candidate'] >= latency['p95_ms_baseline'] * latency_ratio) & (latency['p95_ms_candidate'] - latency['p95_ms_baseline'] >= min_latency_delta_ms)
+
+    return Comparison(
+        new_errors=nrcs[nrcs['candidate'] > nrcs['baseline']],
+        resolved_errors=nrcs[nrcs['candidate'] < nrcs['baseline']],
+        missing_replies=missing[missing['missing_candidate'] > missing['missing_baseline']],
+        latency_regressions=latency[regressed],
+        new_services=services.loc[~in_baseline, ['requests_candidate', 'negative_candidate', 'missing_candidate']].astype(int),
+        missing_services=services.loc[~in_candidate, ['requests_baseline', 'negative_baseline', 'missing_baseline']].astype(int),
+    )
+
+
+def comparison_to_dict(comparison: Comparison) -> dict:
+    """Returns a JSON-serialisable form of a comparison: one list of records per kind of difference."""
+    result = {}
+    for kind, frame in comparison._asdict().items():
+        records = frame.reset_index().astype(object)
+        result[kind] = records.where(records.notnull(), None).to_dict(orient='records')
+    return result
+
+
+def format_comparison(comparison: Comparison, baseline_name: str = 'baseline', candidate_name: str = 'candidate') -> str:
+    """Formats a comparison as text for the LLM, one line per difference.
+
+    Args:
+        comparison (Comparison): result of `compare_session_logs`
+        baseline_name (str): name of the baseline capture
+        candidate_name (str): name of the candidate capture
+
+    Returns:
+        str: the differences, or a note that none were found
+    """
+    lines = [f"Comparison of '{candidate_name}' against baseline '{baseline_name}':"]
+    for (ecu, sid, nrc), row in comparison.new_errors.iterrows():
+        lines.append(f"New error: ECU '{ecu}' SID {sid} NRC {nrc}: {row['candidate']} replies (baseline {row['baseline']})")
+    for (ecu, sid), row in comparison.missing_replies.iterrows():
+        lines.append(f"Missing replies: ECU '{ecu}' SID {sid}: {row['missing_candidate']} of {row['requests_candidate']} requests without reply (baseline {row['missing_baseline']} of {row['requests_baseline']})")
+    for (ecu, sid), row in comparison.latency_regressions.iterrows():
+        lines.append(f"Latency regression: ECU '{ecu}' SID {sid}: p95 {row['p95_ms_candidate']:.1f} ms (baseline {row['p95_ms_baseline']:.1f} ms), median {row['p50_ms_candidate']:.1f} ms (baseline {row['p50_ms_baseline']:.1f} ms)")
+    for (ecu, sid), row in comparison.new_services.iterrows():
+        lines.append(f"Only in {candidate_name}: ECU '{ecu}' SID {sid}: {row['requests_candidate']} requests, {row['negative_candidate']} negative, {row['missing_candidate']} without reply")
+    for (ecu, sid), row in comparison.missing_services.iterrows():
+        lines.append(f"Only in {baseline_name}: ECU '{ecu}' SID {sid}: {row['requests_baseline']} requests")
+    for (ecu, sid, nrc), row in comparison.resolved_errors.iterrows():
+        lines.append(f"Resolved: ECU '{ecu}' SID {sid} NRC {nrc}: {row['candidate']} replies (baseline {row['baseline']})")
+    if len(lines) == 1:
+        lines.append("No differences in errors, missing replies or latency.")
+    return '\n'.join(lines) + '\n'
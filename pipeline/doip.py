@@ -0,0 +1,462 @@
+"""Native decoder for DoIP/UDS traffic stored in pcap and pcapng captures.
+
+Walks the capture record by record (link layer -> IPv4/IPv6 -> TCP/UDP -> DoIP on port 13400) and yields every
+UDS diagnostic message, without spawning tshark. TCP streams are reassembled per flow, so DoIP messages split
+across segments (or several messages in one segment) are handled the same way Wireshark does.
+
+The capture is memory-mapped and parsed in place through byte offsets; packet bytes are only copied when a DoIP
+message has to be reassembled from several TCP segments.
+"""
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from typing import Iterator, NamedTuple
+
+# pylint: disable=C0301
+
+DOIP_PORT = 13400
+DOIP_HEADER_LENGTH = 8
+DOIP_DIAGNOSTIC_MESSAGE = 0x8001  # payload type carrying source address, target address and UDS data
+DOIP_MAX_PAYLOAD_LENGTH = 1 << 24  # anything larger is treated as a corrupt header rather than waiting for more data
+
+UDS_REPLY_FLAG = 0x40  # bit 6 of the SID is set for positive and negative replies
+UDS_NEGATIVE_RESPONSE = 0x7F
+UDS_RESPONSE_PENDING = 0x78  # NRC of an interim negative reply, the final reply follows later
+
+# Link-layer header types, see https://www.tcpdump.org/linktypes.html
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IPV6_EXTENSION_HEADERS = (0, 43, 60)  # hop-by-hop, routing and destination options; fragments (44) are skipped
+
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1_000),  # little-endian, microsecond timestamps
+    b'\xa1\xb2\xc3\xd4': ('>', 1_000),  # big-endian, microsecond timestamps
+    b'\x4d\x3c\xb2\xa1': ('<', 1),  # little-endian, nanosecond timestamps
+    b'\xa1\xb2\x3c\x4d': ('>', 1),  # big-endian, nanosecond timestamps
+}
+PCAPNG_SECTION_HEADER = b'\x0a\x0d\x0d\x0a'
+PCAPNG_INTERFACE_DESCRIPTION = 1
+PCAPNG_OBSOLETE_PACKET = 2
+PCAPNG_SIMPLE_PACKET = 3
+PCAPNG_ENHANCED_PACKET = 6
+
+
+class UdsMessage(NamedTuple):
+    """A single UDS message carried in a DoIP diagnostic message."""
+    number: int  # frame number in the capture (1-based, as in Wireshark)
+    timestamp: int  # capture time in nanoseconds since the epoch
+    source: int  # DoIP source logical address
+    target: int  # DoIP target logical address
+    payload: bytes  # UDS bytes, starting with the SID
+
+
+@contextmanager
+def map_capture(file_path: str):
+    """Memory-maps a capture file read-only. Empty files yield an empty bytes object, since they cannot be mapped.
+
+    Args:
+        file_path (str): string path to the capture file
+
+    Yields:
+        mmap.mmap | bytes: buffer with the file contents
+    """
+    with open(file_path, 'rb') as stream:
+        if os.fstat(stream.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
+
+
+def iter_pcap_records(buffer) -> Iterator[tuple[int, int, int, int, int]]:
+    """Iterates over the records of a pcap or pcapng capture held in a buffer.
+
+    Args:
+        buffer (mmap.mmap | bytes): capture contents, e.g. from `map_capture`
+
+    Yields:
+        tuple: (frame number, link-layer type, timestamp in ns since the epoch, start offset, end offset) of the
+            captured bytes of each packet within the buffer
+    """
+    return RecordReader().records(buffer)
+
+
+class RecordReader:
+    """Incremental reader of pcap and pcapng records.
+
+    The reader remembers the file format, byte order, link types and frame count, so a capture can be read in
+    consecutive pieces (e.g. while it is still being written). `position` is the number of capture bytes consumed
+    so far; each call to `records` expects the capture contents starting at that position, and stops at the first
+    incomplete record.
+    """
+
+    def __init__(self):
+        self.position = 0
+        self.number = 0
+        self._endian = None  # None until the file header has been read
+        self._pcapng = False
+        self._ns_per_tick = 1_000
+        self._linktype = 0
+        self._interfaces = []  # pcapng: (linktype, timestamp resolution, timestamp offset in seconds) per interface id
+
+    def records(self, buffer) -> Iterator[tuple[int, int, int, int, int]]:
+        """Iterates over the complete records in a buffer holding the capture from `position` onward.
+
+        Args:
+            buffer (mmap.mmap | bytes): capture contents from `position` onward
+
+        Yields:
+            tuple: (frame number, link-layer type, timestamp in ns since the epoch, start offset, end offset), with
+                offsets relative to the buffer
+        """
+        base = self.position
+        offset = 0
+
+        if self._endian is None:
+            magic = bytes(buffer[:4])
+            if len(magic) < 4:
+                return
+            if magic == PCAPNG_SECTION_HEADER:
+                self._pcapng = True
+                self._endian = '<'  # replaced by the byte order of the section header below
+            elif magic in PCAP_MAGIC:
+                if len(buffer) < 24:
+                    return
+                self._endian, self._ns_per_tick = PCAP_MAGIC[magic]
+                self._linktype = struct.unpack_from(self._endian + 'I', buffer, 20)[0] & 0x0FFFFFFF  # upper bits carry FCS information
+                offset = 24
+                self.position = base + offset
+            else:
+                raise ValueError(f"Not a pcap or pcapng file (magic bytes {magic.hex()})")
+
+        if self._pcapng:
+            yield from self._pcapng_records(buffer, base, offset)
+        else:
+            yield from self._pcap_records(buffer, base, offset)
+
+    def _pcap_records(self, buffer, base: int, position: int) -> Iterator[tuple[int, int, int, int, int]]:
+        """Iterates over the records of a classic libpcap file."""
+        unpack_record_header = struct.Struct(self._endian + 'IIII').unpack_from
+        ns_per_tick = self._ns_per_tick
+        linktype = self._linktype
+        size = len(buffer)
+
+        while position + 16 <= size:
+            seconds, fraction, captured_length, _ = unpack_record_header(buffer, position)
+            start = position + 16
+            if start + captured_length > size:
+                return  # record not (completely) written yet
+            position = start + captured_length
+            self.number += 1
+            self.position = base + position
+            yield self.number, linktype, seconds * 1_000_000_000 + fraction * ns_per_tick, start, position
+
+    def _pcapng_records(self, buffer, base: int, position: int) -> Iterator[tuple[int, int, int, int, int]]:
+        """Iterates over the packet blocks of a pcapng file."""
+        size = len(buffer)
+
+        while position + 12 <= size:
+            if buffer[position:position + 4] == PCAPNG_SECTION_HEADER:
+                # The byte-order magic of each section decides how the remainder of that section is read
+                self._endian = '<' if buffer[position + 8:position + 12] == b'\x4d\x3c\x2b\x1a' else '>'
+                self._interfaces = []
+            endian = self._endian
+            kind, block_length = struct.unpack_from(endian + 'II', buffer, position)
+            if block_length < 12:
+                raise ValueError(f"Corrupt pcapng block of length {block_length} at offset {base + position}")
+            if position + block_length > size:
+                return  # block not (completely) written yet
+            body = position + 8
+            body_end = position + block_length - 4  # excludes the trailing copy of the block length
+            position += block_length
+            self.position = base + position
+            interfaces = self._interfaces
+
+            if kind == PCAPNG_INTERFACE_DESCRIPTION:
+                interfaces.append(_parse_pcapng_interface(buffer, body, body_end, endian))
+
+            elif kind == PCAPNG_ENHANCED_PACKET and interfaces:
+                interface_id, high, low, captured_length = struct.unpack_from(endian + 'IIII', buffer, body)
+                self.number += 1
+                linktype, resolution, offset = _pcapng_interface(interfaces, interface_id, base + body - 8)
+                yield self.number, linktype, _pcapng_timestamp(high, low, resolution, offset), body + 20, min(body + 20 + captured_length, body_end)
+
+            elif kind == PCAPNG_OBSOLETE_PACKET and interfaces:
+                interface_id, _, high, low, captured_length = struct.unpack_from(endian + 'HHIII', buffer, body)
+                self.number += 1
+                linktype, resolution, offset = _pcapng_interface(interfaces, interface_id, base + body - 8)
+                yield self.number, linktype, _pcapng_timestamp(high, low, resolution, offset), body + 20, min(body + 20 + captured_length, body_end)
+
+            elif kind == PCAPNG_SIMPLE_PACKET and interfaces:
+                self.number += 1  # simple packets carry no timestamp
+                original_length = struct.unpack_from(endian + 'I', buffer, body)[0]
+                yield self.number, interfaces[0][0], 0, body + 4, min(body + 4 + original_length, body_end)
+
+
+def _pcapng_interface(interfaces: list, interface_id: int, offset: int) -> tuple[int, tuple[bool, int], int]:
+    """Returns the interface a packet block refers to, see `_parse_pcapng_interface`."""
+    if interface_id >= len(interfaces):
+        raise ValueError(f"Corrupt pcapng packet block at offset {offset}: interface {interface_id} is not declared ({len(interfaces)} interfaces)")
+    return interfaces[interface_id]
+
+
+def _parse_pcapng_interface(buffer, start: int, end: int, endian: str) -> tuple[int, tuple[bool, int], int]:
+    """Extracts the link-layer type and the if_tsresol/if_tsoffset options of an interface description block."""
+    linktype = struct.unpack_from(endian + 'H', buffer, start)[0]
+    resolution = (False, 6)  # default is microseconds
+    offset = 0
+
+    position = start + 8
+    while position + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', buffer, position)
+        if code == 0:  # opt_endofopt
+            break
+        if code == 9 and length >= 1:  # if_tsresol, negative power of 10 (or of 2 if the MSB is set)
+            value = buffer[position + 4]
+            resolution = (bool(value & 0x80), value & 0x7F)
+        elif code == 14 and length >= 8:  # if_tsoffset, in seconds
+            offset = struct.unpack_from(endian + 'q', buffer, position + 4)[0]
+        position += 4 + (length + 3) // 4 * 4
+
+    return linktype, resolution, offset
+
+
+def _pcapng_timestamp(high: int, low: int, resolution: tuple[bool, int], offset: int) -> int:
+    """Converts a pcapng timestamp into nanoseconds since the epoch."""
+    ticks = (high << 32) | low
+    binary, exponent = resolution
+    if binary:
+        nanoseconds = (ticks * 1_000_000_000) >> exponent
+    elif exponent <= 9:
+        nanoseconds = ticks * 10 ** (9 - exponent)
+    else:
+        nanoseconds = ticks // 10 ** (exponent - 9)
+    return nanoseconds + offset * 1_000_000_000
+
+
+def _network_layer(linktype: int, buffer, start: int, end: int) -> tuple[int, int]:
+    """Strips the link-layer header. Returns (ethertype, offset of the network header), or (0, 0) if unsupported."""
+    if linktype == LINKTYPE_ETHERNET:
+        if end - start < 14:
+            return 0, 0
+        ethertype = struct.unpack_from('>H', buffer, start + 12)[0]
+        offset = start + 14
+        while ethertype in ETHERTYPE_VLAN and end >= offset + 4:
+            ethertype = struct.unpack_from('>H', buffer, offset + 2)[0]
+            offset += 4
+        return ethertype, offset
+
+    if linktype == LINKTYPE_LINUX_SLL:
+        return (struct.unpack_from('>H', buffer, start + 14)[0], start + 16) if end - start >= 16 else (0, 0)
+
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return (struct.unpack_from('>H', buffer, start)[0], start + 20) if end - start >= 20 else (0, 0)
+
+    offset = {LINKTYPE_RAW: 0, LINKTYPE_IPV4: 0, LINKTYPE_IPV6: 0, LINKTYPE_NULL: 4, LINKTYPE_LOOP: 4}.get(linktype)
+    if offset is None or end - start <= offset:
+        return 0, 0
+    version = buffer[start + offset] >> 4  # these link types carry bare IP, so the version nibble tells IPv4 from IPv6
+    return {4: ETHERTYPE_IPV4, 6: ETHERTYPE_IPV6}.get(version, 0), start + offset
+
+
+def _transport_layer(ethertype: int, buffer, offset: int, end: int) -> tuple[int, int, int, int]:
+    """Strips the IP header. Returns (protocol, offset of the address pair, offset of the transport header, end of
+    the IP payload), or protocol 0 if the packet cannot be decoded."""
+    if ethertype == ETHERTYPE_IPV4 and end - offset >= 20:
+        header_length = (buffer[offset] & 0x0F) * 4
+        total_length, fragment, protocol = struct.unpack_from('>H2xH1xB', buffer, offset + 2)
+        if fragment & 0x3FFF:  # fragmented datagrams are not reassembled
+            return 0, 0, 0, 0
+        return protocol, offset + 12, offset + header_length, min(end, offset + total_length) if total_length else end
+
+    if ethertype == ETHERTYPE_IPV6 and end - offset >= 40:
+        payload_length, protocol = struct.unpack_from('>HB', buffer, offset + 4)
+        end = min(end, offset + 40 + payload_length)
+        position = offset + 40
+        while protocol in IPV6_EXTENSION_HEADERS and position + 2 <= end:
+            protocol = buffer[position]
+            position += (buffer[position + 1] + 1) * 8
+        return protocol, offset + 8, position, end
+
+    return 0, 0, 0, 0
+
+
+class _TcpStream:
+    """Reassembly state for one direction of a TCP connection."""
+    __slots__ = ('next_sequence', 'buffer')
+
+    def __init__(self, next_sequence: int):
+        self.next_sequence = next_sequence
+        self.buffer = bytearray()
+
+    def add(self, sequence: int, payload: bytes) -> None:
+        """Appends a segment to the stream, trimming retransmitted bytes and resynchronising after capture gaps."""
+        delta = (sequence - self.next_sequence) & 0xFFFFFFFF
+        if delta >= 0x80000000:  # segment starts before the expected sequence number (retransmission)
+            overlap = 0x100000000 - delta
+            if overlap >= len(payload):
+                return
+            payload = payload[overlap:]
+            sequence = self.next_sequence
+        elif delta:  # bytes are missing from the capture, so whatever is buffered can no longer be completed
+            self.buffer.clear()
+        self.buffer += payload
+        self.next_sequence = (sequence + len(payload)) & 0xFFFFFFFF
+
+
+def _split_doip_messages(data, start: int, end: int) -> tuple[list[tuple[int, int, int]], int]:
+    """Splits data[start:end] into complete DoIP messages.
+
+    Returns:
+        tuple: list of (payload type, payload start, payload end) and the offset up to which data was consumed.
+            An offset of -1 means the data does not start with a valid DoIP header and should be discarded.
+    """
+    messages = []
+    position = start
+    while end - position >= DOIP_HEADER_LENGTH:
+        version, inverse, payload_type, length = struct.unpack_from('>BBHI', data, position)
+        if version ^ inverse != 0xFF or length > DOIP_MAX_PAYLOAD_LENGTH:
+            return messages, -1
+        payload_end = position + DOIP_HEADER_LENGTH + length
+        if payload_end > end:
+            break  # message continues in a later segment
+        messages.append((payload_type, position + DOIP_HEADER_LENGTH, payload_end))
+        position = payload_end
+    return messages, position
+
+
+class DiagnosticDecoder:
+    """Decodes DoIP diagnostic messages (port 13400) from captured packets, keeping the TCP reassembly state of
+    every connection between calls."""
+
+    def __init__(self):
+        self.streams = {}  # (addresses, ports) -> _TcpStream
+        self._unpack_tcp = struct.Struct('>HHIIBB').unpack_from
+        self._unpack_ports = struct.Struct('>HH').unpack_from
+
+    def decode(self, buffer, linktype: int, start: int, end: int) -> list[tuple[int, int, object, int, int]]:
+        """Decodes the DoIP diagnostic messages completed by one captured packet.
+
+        Args:
+            buffer (mmap.mmap | bytes): buffer holding the packet
+            linktype (int): link-layer type of the packet
+            start (int): offset of the captured bytes within the buffer
+            end (int): end offset of the captured bytes within the buffer
+
+        Returns:
+            list: (source address, target address, data, start, end) per message, where data[start:end] is the UDS
+                payload. data is the buffer itself, unless the message was reassembled from several TCP segments.
+        """
+        ethertype, offset = _network_layer(linktype, buffer, start, end)
+        if not ethertype:
+            return []
+        protocol, addresses, offset, end = _transport_layer(ethertype, buffer, offset, end)
+
+        if protocol == IPPROTO_TCP and end - offset >= 20:
+            source_port, target_port, sequence, _, header_length, flags = self._unpack_tcp(buffer, offset)
+            if source_port != DOIP_PORT and target_port != DOIP_PORT:
+                return []
+            key = (buffer[addresses:addresses + (8 if ethertype == ETHERTYPE_IPV4 else 32)], source_port, target_port)
+            return self.decode_segment(key, sequence, flags, buffer, offset + (header_length >> 4) * 4, end)
+
+        if protocol == IPPROTO_UDP and end - offset >= 8:
+            source_port, target_port = self._unpack_ports(buffer, offset)
+            if source_port != DOIP_PORT and target_port != DOIP_PORT:
+                return []
+            messages, _ = _split_doip_messages(buffer, offset + 8, end)
+            return self._diagnostic_messages(buffer, messages)
+
+        return []
+
+    def decode_segment(self, key: tuple, sequence: int, flags: int, buffer, payload_start: int, end: int) -> list[tuple[int, int, object, int, int]]:
+        """Adds one TCP segment of a DoIP connection to its reassembly state and decodes the messages it completes.
+
+        Args:
+            key (tuple): connection direction, (IP addresses, source port, target port)
+            sequence (int): TCP sequence number
+            flags (int): TCP flags
+            buffer (mmap.mmap | bytes): buffer holding the segment
+            payload_start (int): offset of the TCP payload within the buffer
+            end (int): end offset of the TCP payload within the buffer
+
+        Returns:
+            list: (source address, target address, data, start, end) per message, see `decode`
+        """
+        data = buffer
+        if flags & 0x06:  # SYN or RST starts the direction afresh
+            self.streams[key] = _TcpStream((sequence + (flags & 0x02 != 0)) & 0xFFFFFFFF)
+        if payload_start >= end:
+            return []
+
+        tcp_stream = self.streams.get(key)
+        if tcp_stream is None:  # capture started mid-connection
+            tcp_stream = self.streams[key] = _TcpStream(sequence)
+
+        if not tcp_stream.buffer and tcp_stream.next_sequence == sequence:
+            # Fast path: nothing pending, so decode straight from the capture and only keep a remainder
+            tcp_stream.next_sequence = (sequence + end - payload_start) & 0xFFFFFFFF
+            messages, consumed = _split_doip_messages(buffer, payload_start, end)
+            if 0 <= consumed < end:
+                tcp_stream.buffer += buffer[consumed:end]
+        else:
+            tcp_stream.add(sequence, buffer[payload_start:end])
+            messages, consumed = _split_doip_messages(tcp_stream.buffer, 0, len(tcp_stream.buffer))
+            data = bytes(tcp_stream.buffer[:messages[-1][2]]) if messages else b''
+            if consumed < 0:
+                tcp_stream.buffer.clear()
+            else:
+                del tcp_stream.buffer[:consumed]
+
+        return self._diagnostic_messages(data, messages)
+
+    def _diagnostic_messages(self, data, messages: list[tuple[int, int, int]]) -> list[tuple[int, int, object, int, int]]:
+        """Keeps the diagnostic messages and splits off their source and target addresses."""
+        return [(*self._unpack_ports(data, message_start), data, message_start + 4, message_end)
+                for payload_type, message_start, message_end in messages
+                if payload_type == DOIP_DIAGNOSTIC_MESSAGE and message_end - message_start > 4]
+
+
+def iter_diagnostic_messages(buffer) -> Iterator[tuple[int, int, int, int, object, int, int]]:
+    """Decodes every DoIP diagnostic message (port 13400) in a capture, without copying packet bytes.
+
+    Args:
+        buffer (mmap.mmap | bytes): capture contents, e.g. from `map_capture`
+
+    Yields:
+        tuple: (frame number, timestamp in ns, source address, target address, data, start, end), where
+            data[start:end] is the UDS payload. data is the capture buffer itself, unless the message was
+            reassembled from several TCP segments.
+    """
+    decode = DiagnosticDecoder().decode
+
+    for number, linktype, timestamp, start, end in iter_pcap_records(buffer):
+        for source, target, data, message_start, message_end in decode(buffer, linktype, start, end):
+            yield number, timestamp, source, target, data, message_start, message_end
+
+
+def iter_uds_messages(file_path: str) -> Iterator[UdsMessage]:
+    """Decodes every UDS message carried by DoIP (port 13400) in a pcap or pcapng file.
+
+    Args:
+        file_path (str): string path to the capture file
+
+    Yields:
+        UdsMessage: one entry per DoIP diagnostic message, in capture order
+    """
+    with map_capture(file_path) as buffer:
+        for number, timestamp, source, target, data, start, end in iter_diagnostic_messages(buffer):
+            yield UdsMessage(number, timestamp, source, target, bytes(data[start:end]))
@@ -0,0 +1,238 @@
+"""Per-ECU diagnostic state of request/reply pairs: active session, security access and S3 timer.
+
+Every pair is annotated with the state its request was processed in, derived from the earlier pairs of its ECU:
+
+- session: the session entered by the last successful DiagnosticSessionControl (0x10); back to the default session
+  after a successful ECUReset (0x11), or when the ECU received no request for longer than S3 (`TimingParameters.s3`)
+  while in a non-default session (TesterPresent keep-alives are requests like any other);
+- security: the level unlocked by the last successful SecurityAccess sendKey (0x27, even sub-function), locked again
+  by a change of session, an ECU reset or an S3 timeout;
+- idle time: time since the ECU's previous request or reply, or since the latest request to a functional address
+  (`FUNCTIONAL_ADDRESSES`), which restarts the S3 timer of every ECU.
+
+Requests whose positive response was suppressed (bit 7 of the sub-function) and that got no reply count as
+successful. Pairs to functional addresses are not annotated.
+
+Negative replies caused by this state get a deterministic root-cause hint: serviceNotSupportedInActiveSession (0x7F)
+and subFunctionNotSupportedInActiveSession (0x7E) name the session and what put the ECU into it, securityAccessDenied
+(0x33) tells whether security access was never unlocked or what locked it again, and requestSequenceError (0x24) to a
+sendKey whether a matching requestSeed preceded it.
+
+The state is computed in one pass of array operations over the pairs sorted by ECU. Every state change is an event
+(before a request for S3 timeouts, after it for the effect of its reply), and the state of a pair is the value of the
+latest event of its ECU, found with a running maximum of event positions. Only the hints are formatted per row.
+"""
+import numpy as np
+import pandas as pd
+
+from .doip import UDS_REPLY_FLAG
+from .timing import TimingParameters, DEFAULT_TIMING
+
+# pylint: disable=C0301
+
+DIAGNOSTIC_SESSION_CONTROL = 0x10
+ECU_RESET = 0x11
+SECURITY_ACCESS = 0x27
+SUPPRESS_POSITIVE_RESPONSE = 0x80  # bit 7 of the sub-function
+DEFAULT_SESSION = 0x01
+LOCKED = 0  # security level of a locked ECU; unlocked levels are the requestSeed sub-function (0x01, 0x03, ...)
+
+NRC_REQUEST_SEQUENCE_ERROR = 0x24
+NRC_SECURITY_ACCESS_DENIED = 0x33
+NRC_SUB_FUNCTION_NOT_SUPPORTED_IN_ACTIVE_SESSION = 0x7E
+NRC_SERVICE_NOT_SUPPORTED_IN_ACTIVE_SESSION = 0x7F
+
+FUNCTIONAL_ADDRESSES = (0xE400, 0x07DF, 0x0033)  # DoIP functional address, OBD/CAN functional request ID, normal fixed functional target
+
+SESSION_NAMES = {0x01: 'default', 0x02: 'programming', 0x03: 'extended', 0x04: 'safetySystem'}
+
+# Causes of a state: the kind of the latest event
+INITIAL, SESSION_CONTROL, RESET, S3_TIMEOUT, UNLOCK = range(5)
+
+_SESSION_LABELS = np.array([SESSION_NAMES.get(code, f"0x{code:02X}") for code in range(256)], dtype=object)
+_SECURITY_LABELS = np.array(['locked'] + [f"unlocked 0x{level:02X}" for level in range(1, 256)], dtype=object)
+
+
+def diagnostic_state(pairs: pd.DataFrame, timing: TimingParameters = DEFAULT_TIMING) -> pd.DataFrame:
+    """Annotates request/reply pairs with the diagnostic state of their ECU, see the module docstring.
+
+    Args:
+        pairs (pd.DataFrame): typed request/reply pairs in request order, with 'request_subfunction' (see
+            `pipeline.matching.pair_packets`)
+        timing (TimingParameters): S3 timeout of non-default sessions
+
+    Returns:
+        pd.DataFrame: one row per pair, with columns:
+            - session: active session when the request arrived, e.g. 'default', 'extended' or '0x40' (None for
+              functional requests)
+            - security: 'locked' or the unlocked level, e.g. 'unlocked 0x01' (None for functional requests)
+            - idle_ms: time since the ECU's previous request or reply in milliseconds (NaN for its first request)
+            - state_hint: root cause of negative replies that depend on the state, else None
+    """
+    n = len(pairs)
+    ecu = pairs['ecu_address'].to_numpy()
+    order = np.argsort(ecu, kind='stable')  # by ECU, in request order within each ECU
+    ecu = ecu[order]
+    sid = pairs['request_sid'].to_numpy()[order]
+    level = pairs['request_subfunction'].to_numpy()[order].astype(np.int64) & 0x7F
+    suppressed = (pairs['request_subfunction'].to_numpy()[order] & SUPPRESS_POSITIVE_RESPONSE) != 0
+    replied = pairs['replied'].to_numpy()[order]
+    positive = replied & (pairs['reply_sid'].to_numpy()[order] == ((sid.astype(np.int64) + UDS_REPLY_FLAG) & 0xFF))
+    succeeded = positive | (~replied & suppressed)
+    request_time = pairs['request_timestamp'].to_numpy().view(np.int64)[order]
+    reply_time = pairs['reply_timestamp'].to_numpy().view(np.int64)[order]  # NaT is the smallest int64
+
+    functional = np.isin(ecu, FUNCTIONAL_ADDRESSES)
+    first = np.ones(n, dtype=bool)
+    first[1:] = ecu[1:] != ecu[:-1]
+    group_start = np.maximum.accumulate(np.where(first, np.arange(n), 0)) if n else np.zeros(0, dtype=np.int64)
+
+    # S3 timer: restarted by the ECU's previous request, by its reply if that came before this request (a reply matched
+    # to a suppressed request may come later) and by any earlier request to a functional address
+    previous_request, previous_reply = np.roll(request_time, 1), np.roll(reply_time, 1)
+    previous = np.where(first, np.iinfo(np.int64).min, np.where(previous_reply <= request_time, np.maximum(previous_request, previous_reply), previous_request))
+    functional_times = np.sort(request_time[functional])
+    latest_functional = np.searchsorted(functional_times, request_time, side='left') - 1
+    if len(functional_times):
+        previous = np.maximum(previous, np.where(latest_functional >= 0, functional_times[np.maximum(latest_functional, 0)], np.iinfo(np.int64).min))
+    known = previous != np.iinfo(np.int64).min
+    idle = np.where(known, request_time - np.where(known, previous, 0), 0)
+    expired = known & (idle > int(round(timing.s3 * 1_000_000_000)))
+
+    # Session: events before a request (S3 timeout) at even positions, after it (its own effect) at odd positions
+    session_control = (sid == DIAGNOSTIC_SESSION_CONTROL) & succeeded
+    reset = (sid == ECU_RESET) & succeeded
+    values = np.full(2 * n, DEFAULT_SESSION, dtype=np.int64)
+    values[1::2] = np.where(session_control, level, DEFAULT_SESSION)
+    latest = _latest_events(_interleave(expired, session_control | reset), group_start)
+    session_before = np.where(latest[1::2] >= 0, values[np.maximum(latest[1::2], 0)], DEFAULT_SESSION)  # after the pair
+    session_before = np.where(first, DEFAULT_SESSION, np.roll(session_before, 1))  # ... i.e. before the next one
+    s3_timeout = expired & (session_before != DEFAULT_SESSION)  # timeouts in the default session change nothing
+
+    session_event = _latest_events(_interleave(s3_timeout, session_control | reset), group_start)[0::2]
+    session = np.where(session_event >= 0, values[np.maximum(session_event, 0)], DEFAULT_SESSION)
+
+    # Security: locked by S3 timeouts, ECU resets and changes of session, unlocked by a positive sendKey
+    unlock = (sid == SECURITY_ACCESS) & positive & (level % 2 == 0) & (level > 0)
+    relock = reset | (session_control & ((level != session) | (level == DEFAULT_SESSION)))
+    values_security = np.full(2 * n, LOCKED, dtype=np.int64)
+    values_security[1::2] = np.where(unlock, level - 1, LOCKED)
+    events = _interleave(s3_timeout, unlock | relock)
+    latest = _latest_events(events, group_start)
+    security_after = np.where(latest >= 0, values_security[np.maximum(latest, 0)], LOCKED)  # at every event position
+    security_before = np.where(np.arange(2 * n) == 2 * np.repeat(group_start, 2), LOCKED, np.roll(security_after, 1))
+    # A lock only counts when the ECU was unlocked, so hints name the event that actually locked it
+    events &= (security_before != LOCKED) | _interleave(np.zeros(n, dtype=bool), unlock)
+    security_event = _latest_events(events, group_start)[0::2]
+    security = np.where(security_event >= 0, values_security[np.maximum(security_event, 0)], LOCKED)
+    latest_unlock = _latest_events(_interleave(np.zeros(n, dtype=bool), unlock), group_start)[0::2]
+    latest_exchange = _latest_events(_interleave(np.zeros(n, dtype=bool), (sid == SECURITY_ACCESS) & replied), group_start)[0::2]
+
+    error = np.where(replied & ~positive, pairs['error'].to_numpy()[order], 0)
+    hint_rows = np.flatnonzero(~functional & (np.isin(error, (NRC_SERVICE_NOT_SUPPORTED_IN_ACTIVE_SESSION, NRC_SUB_FUNCTION_NOT_SUPPORTED_IN_ACTIVE_SESSION, NRC_SECURITY_ACCESS_DENIED))
+                                              | ((error == NRC_REQUEST_SEQUENCE_ERROR) & (sid == SECURITY_ACCESS) & (level % 2 == 0))))
+    hints = np.full(n, None, dtype=object)
+    context = _HintContext(pairs['request_number'].to_numpy()[order], sid, level, idle, session, session_before, timing)
+    for k in hint_rows.tolist():
+        if error[k] == NRC_SECURITY_ACCESS_DENIED:
+            hints[k] = context.security(k, security[k], security_event[k], latest_unlock[k])
+        elif error[k] == NRC_REQUEST_SEQUENCE_ERROR:
+            hints[k] = context.sequence(k, latest_exchange[k], positive)
+        else:
+            hints[k] = context.session(k, session[k], session_event[k])
+
+    state = pd.DataFrame({
+        'session': np.where(functional, None, _SESSION_LABELS[session]),
+        'security': np.where(functional, None, _SECURITY_LABELS[security]),
+        'idle_ms': np.where(known, idle / 1_000_000, np.nan),
+        'state_hint': hints,
+    })
+    unsorted = np.empty(n, dtype=np.int64)
+    unsorted[order] = np.arange(n)
+    return state.iloc[unsorted].set_index(pairs.index)
+
+
+def _interleave(before: np.ndarray, after: np.ndarray) -> np.ndarray:
+    """Returns the events before and after every pair as one array, before-events at even positions."""
+    events = np.empty(2 * len(before), dtype=bool)
+    events[0::2] = before
+    events[1::2] = after
+    return events
+
+
+def _latest_events(events: np.ndarray, group_start: np.ndarray) -> np.ndarray:
+    """Returns the position of the latest event at or before every position of an interleaved event array (see
+    `_interleave`) within the same ECU, or -1 if there is none."""
+    latest = np.maximum.accumulate(np.where(events, np.arange(len(events)), -1)) if len(events) else np.zeros(0, dtype=np.int64)
+    return np.where(latest >= 2 * np.repeat(group_start, 2), latest, -1)
+
+
+class _HintContext:
+    """Formats the root-cause hints of single pairs, indexed by their position in ECU order. Event positions are
+    those of the interleaved event arrays: even for S3 timeouts before pair position // 2, odd for the effect of that
+    pair."""
+
+    def __init__(self, number: np.ndarray, sid: np.ndarray, level: np.ndarray, idle: np.ndarray, session: np.ndarray,
+                 session_before: np.ndarray, timing: TimingParameters):
+        self.number = number
+        self.sid = sid
+        self.level = level
+        self.idle = idle
+        self.session_at = session
+        self.session_before = session_before
+        self.s3_ms = timing.s3 * 1000
+
+    def _cause(self, event: int) -> tuple[int, int]:
+        """Returns the kind of an event and the position of its pair."""
+        if event < 0:
+            return INITIAL, -1
+        k = event // 2
+        if event % 2 == 0:
+            return S3_TIMEOUT, k
+        if self.sid[k] == DIAGNOSTIC_SESSION_CONTROL:
+            return SESSION_CONTROL, k
+        return (RESET, k) if self.sid[k] == ECU_RESET else (UNLOCK, k)
+
+    def _s3_timeout(self, k: int) -> str:
+        return (f"S3 timeout: no request or TesterPresent for {self.idle[k] / 1_000_000:.0f} ms (S3 = {self.s3_ms:.0f} ms) before #{self.number[k]} "
+                f"ended the {SESSION_NAMES.get(int(self.session_before[k]), f'0x{self.session_before[k]:02X}')} session")
+
+    def session(self, k: int, session: int, event: int) -> str:
+        """Hint for a service or sub-function not supported in the active session."""
+        kind, j = self._cause(event)
+        name = SESSION_NAMES.get(int(session), f"0x{session:02X}")
+        if session != DEFAULT_SESSION:
+            return f"ECU was in the {name} session (DiagnosticSessionControl at #{self.number[j]}), which does not support this request"
+        if kind == S3_TIMEOUT:
+            return f"ECU was back in the default session. {self._s3_timeout(j)}"
+        if kind == RESET:
+            return f"ECU was back in the default session after the ECUReset at #{self.number[j]}"
+        if kind == SESSION_CONTROL:
+            return f"ECU was in the default session since the DiagnosticSessionControl at #{self.number[j]}"
+        return "ECU was in the default session: no DiagnosticSessionControl to another session was sent to it before this request"
+
+    def security(self, k: int, security: int, event: int, unlock: int) -> str:
+        """Hint for a denied security access."""
+        if security != LOCKED:
+            return f"Security access was unlocked at level 0x{security:02X} (sendKey at #{self.number[unlock // 2]}); the request may need another level"
+        if unlock < 0:
+            return "Security access was never unlocked on this ECU before this request"
+        kind, j = self._cause(event)
+        unlocked = f"Security access unlocked at #{self.number[unlock // 2]} was locked again"
+        if kind == S3_TIMEOUT:
+            return f"{unlocked}. {self._s3_timeout(j)}"
+        if kind == RESET:
+            return f"{unlocked} by the ECUReset at #{self.number[j]}"
+        return f"{unlocked} by the change to the {SESSION_NAMES.get(int(self.level[j]), f'0x{self.level[j]:02X}')} session at #{self.number[j]}"
+
+    def sequence(self, k: int, exchange: int, positive: np.ndarray) -> str | None:
+        """Hint for a sendKey rejected as out of sequence."""
+        seed = self.level[k] - 1
+        if exchange < 0:
+            return f"sendKey 0x{self.level[k]:02X} without a preceding requestSeed 0x{seed:02X} on this ECU"
+        j = exchange // 2
+        if not positive[j] or self.level[j] % 2 == 0:
+            return f"sendKey 0x{self.level[k]:02X} without a fresh seed: the last SecurityAccess exchange (#{self.number[j]}) did not end with a granted requestSeed"
+        if self.level[j] != seed:
+            return f"sendKey 0x{self.level[k]:02X} after a requestSeed for another level (0x{self.level[j]:02X} at #{self.number[j]})"
+        return None
@@ -0,0 +1,579 @@
+"""Ingestion of UDS over CAN (ISO 15765-2, ISO-TP) from candump logs and SocketCAN captures.
+
+CAN frames are read into columnar arrays: candump logs (`candump -l`) as character matrices, one per line layout (line
+length, ID width), SocketCAN pcap files with fixed-size records as a single strided NumPy view. CAN FD and RTR lines
+and the `candump -ta` display format fall back to a regular expression per line. Other pcap/pcapng files with SocketCAN (`LINKTYPE_CAN_SOCKETCAN`) or Linux cooked CAN frames are
+read record by record.
+
+`reassemble` rebuilds the ISO-TP messages of all arbitration IDs at once. Single frames are complete messages. Every
+consecutive frame is assigned to the latest first frame of its ID, and a multi-frame message is complete at the
+consecutive frame that brings it to the length announced by its first frame. A message is dropped (as the receiver
+in ISO 15765-2 would) when a consecutive frame arrives with the wrong sequence number (lost, repeated or reordered
+frames), more than `N_CR_TIMEOUT` after the previous frame of its ID, or when a new single or first frame on the same
+ID interrupts it. Flow control frames do not change the state. `IsoTpReassembler` is the same state machine frame by
+frame, used to look up single payloads (see `pipeline.payloads`) and as the reference in `benchmarks.isotp_reassembly`.
+
+`scan_can_log` turns the messages into the typed UDS packet table of `pipeline.scan.scan_pcap_file`, which hands CAN
+captures to it, so pairing, descriptions and the agents work unchanged. Addresses are derived from the arbitration
+IDs: normal fixed addressing (29-bit IDs 0x18DA<target><source> and functional 0x18DB<target><source>) gives the
+source and target address directly. With any other ID the ECU is addressed by its request ID: requests go from the
+tester (`CAN_TESTER_ADDRESS`) to their ID, and replies on a response ID come from the request ID it answers, by default
+the response ID minus `RESPONSE_ID_OFFSET` (0x7E8 answers 0x7E0). Extended and mixed addressing are not supported.
+
+    python -m pipeline.isotp candump-2024-09-18_080000.log --id-pair 714:77E
+"""
+import argparse
+import re
+import struct
+from typing import Callable, Iterator, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from .doip import RecordReader, map_capture, LINKTYPE_LINUX_SLL, LINKTYPE_LINUX_SLL2, PCAP_MAGIC, UDS_NEGATIVE_RESPONSE, UDS_REPLY_FLAG
+from .scan import NO_ERROR, NO_OFFSET
+
+# pylint: disable=C0301
+
+LINKTYPE_CAN_SOCKETCAN = 227
+ETH_P_CAN = 0x000C
+ETH_P_CANFD = 0x000D
+CAN_EFF_FLAG = 0x80000000  # 29-bit identifier
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+CAN_EFF_MASK = 0x1FFFFFFF
+CAN_SFF_MASK = 0x7FF
+
+SINGLE_FRAME, FIRST_FRAME, CONSECUTIVE_FRAME, FLOW_CONTROL = 0, 1, 2, 3
+N_CR_TIMEOUT = 1.0  # seconds a receiver waits for the next consecutive frame
+RESPONSE_ID_OFFSET = 8
+CAN_TESTER_ADDRESS = 0x0000  # tester address of requests and replies that are not in normal fixed addressing
+NORMAL_FIXED_PHYSICAL = 0xDA
+NORMAL_FIXED_FUNCTIONAL = 0xDB
+
+DETECT_BYTES = 64 * 1024  # read to tell CAN captures from DoIP captures
+
+_CANDUMP_LOG = re.compile(rb'^[ \t]*\((\d+)\.(\d+)\)[ \t]+\S+[ \t]+([0-9A-Fa-f]{1,8})#(#[0-9A-Fa-f])?([0-9A-Fa-f]*)[ \t\r]*$', re.M)
+_CANDUMP_DISPLAY = re.compile(rb'^[ \t]*(?:\((\d+)\.(\d+)\)[ \t]+)?\S+[ \t]+([0-9A-Fa-f]{1,8})[ \t]+\[(\d+)\][ \t]+((?:[0-9A-Fa-f]{2}[ \t]?)*)[ \t\r]*$', re.M)
+_HEX_VALUES = np.full(256, 0, dtype=np.uint8)
+_HEX_VALUES[np.frombuffer(b'0123456789', dtype=np.uint8)] = np.arange(10)
+_HEX_VALUES[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+_HEX_VALUES[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16)
+_IS_HEX = np.zeros(256, dtype=bool)
+_IS_HEX[np.frombuffer(b'0123456789ABCDEFabcdef', dtype=np.uint8)] = True
+
+
+class CanFrames(NamedTuple):
+    """Columnar CAN frames in capture order."""
+    number: np.ndarray  # uint32, frame number in the capture (1-based)
+    timestamp: np.ndarray  # int64, ns since the epoch
+    can_id: np.ndarray  # uint32, arbitration ID, with CAN_EFF_FLAG set for 29-bit IDs
+    length: np.ndarray  # uint8, data bytes
+    data: np.ndarray  # uint8 (frames x 8, or x 64 for CAN FD), zero padded
+
+
+class IsoTpMessages(NamedTuple):
+    """Reassembled ISO-TP messages in the order they completed, see `reassemble`."""
+    number: np.ndarray  # uint32, frame that completed the message
+    timestamp: np.ndarray  # int64
+    can_id: np.ndarray  # uint32
+    length: np.ndarray  # uint32, payload length
+    sid: np.ndarray  # uint8, first payload byte
+    error: np.ndarray  # uint8, NRC of negative replies, NO_ERROR otherwise
+    subfunction: np.ndarray  # uint8, second payload byte, 0 if none
+
+
+def _frames_from_columns(timestamp: np.ndarray, can_id: np.ndarray, length: np.ndarray, data: np.ndarray,
+                         number: np.ndarray | None = None) -> CanFrames:
+    number = np.arange(1, len(can_id) + 1) if number is None else number
+    return CanFrames(number.astype(np.uint32), timestamp.astype(np.int64), can_id.astype(np.uint32), length.astype(np.uint8), data)
+
+
+def _hex_matrix(fields: list[bytes], width: int) -> np.ndarray:
+    """Converts hex strings of up to `width` bytes into a zero-padded byte matrix."""
+    if not fields:
+        return np.zeros((0, width), dtype=np.uint8)
+    digits = np.frombuffer(b''.join(field.ljust(2 * width, b'0') for field in fields), dtype=np.uint8)
+    nibbles = _HEX_VALUES[digits].reshape(len(fields), width, 2)
+    return nibbles[:, :, 0] << 4 | nibbles[:, :, 1]
+
+
+def _timestamps(seconds: list[bytes], fractions: list[bytes]) -> np.ndarray:
+    """Converts candump '(seconds.fraction)' timestamps into ns, empty fields into 0."""
+    whole = np.array([int(value or 0) for value in seconds], dtype=np.int64)
+    nanoseconds = np.array([int(value[:9].ljust(9, b'0')) if value else 0 for value in fractions], dtype=np.int64)
+    return whole * 1_000_000_000 + nanoseconds
+
+
+def _digits(matrix: np.ndarray, base: int) -> np.ndarray:
+    """Converts rows of decimal or hex digit characters into int64 values."""
+    values = _HEX_VALUES[matrix].astype(np.int64)
+    return values @ (base ** np.arange(matrix.shape[1] - 1, -1, -1, dtype=np.int64))
+
+
+def _parse_log_lines(text: bytes) -> tuple | None:
+    """Parses a `candump -l` log whose lines fall into a few fixed layouts (same length, timestamp and ID width, as
+    written for one interface and data length) with array operations instead of a regular expression per line.
+
+    Returns:
+        tuple | None: line numbers, timestamps (ns), CAN IDs without flags, extended flags, data lengths and data, or None if a line
+            does not have the layout of a classic data frame (e.g. CAN FD, RTR or malformed lines)
+    """
+    raw = np.frombuffer(text, dtype=np.uint8)
+    ends = np.flatnonzero(raw == ord('\n'))
+    if len(raw) and raw[-1] != ord('\n'):
+        ends = np.append(ends, len(raw))
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    lengths = ends - starts
+    lengths -= (lengths > 0) & (raw[np.maximum(ends - 1, 0)] == ord('\r'))
+    line_number = np.flatnonzero(lengths > 0) + 1
+    starts, lengths = starts[lengths > 0], lengths[lengths > 0]
+    n = len(starts)
+    if not n or lengths.max() > 1024:
+        return None
+
+    columns = []
+    for character in (b')', b'#'):
+        positions = np.flatnonzero(raw == ord(character))
+        line = np.searchsorted(starts, positions, side='right') - 1
+        inside = (line >= 0) & (positions < starts[np.maximum(line, 0)] + lengths[np.maximum(line, 0)])
+        if np.bincount(line[inside], minlength=n).max(initial=0) != 1 or inside.sum() != n:
+            return None
+        columns.append(positions[inside] - starts[line[inside]])
+    keys, layout = np.unique(lengths << 20 | columns[0] << 10 | columns[1], return_inverse=True)
+    layouts = np.stack([keys >> 20, keys >> 10 & 0x3FF, keys & 0x3FF], axis=1)
+
+    timestamp = np.zeros(n, dtype=np.int64)
+    can_id = np.zeros(n, dtype=np.int64)
+    extended = np.zeros(n, dtype=bool)
+    length = np.zeros(n, dtype=np.int64)
+    width = 8 if (layouts[:, 0] - layouts[:, 2] - 1).max() <= 16 else 64
+    data = np.zeros((n, width), dtype=np.uint8)
+    for index, (line_length, paren, hash_mark) in enumerate(layouts.tolist()):
+        if len(layouts) == 1 and starts[-1] == (n - 1) * (line_length + 1):
+            rows = np.arange(n)  # all lines alike, the file reshapes into a matrix
+            matrix = raw[:n * (line_length + 1)].reshape(n, line_length + 1)[:, :line_length]
+        else:
+            rows = np.flatnonzero(layout == index)
+            matrix = raw[starts[rows, None] + np.arange(line_length)]
+        first = matrix[0].tobytes()
+        dot, space = first.find(b'.'), first.rfind(b' ', 0, hash_mark)
+        size = line_length - hash_mark - 1
+        if (first[:1] != b'(' or not 0 < dot < paren or space <= paren + 1 or not 0 < hash_mark - space - 1 <= 8 or size % 2
+                or (matrix[:, [0, dot, paren, paren + 1, space]] != np.frombuffer(b'(.)  ', dtype=np.uint8)).any()):
+            return None
+        decimals = np.concatenate([matrix[:, 1:dot], matrix[:, dot + 1:paren]], axis=1)
+        hexadecimals = np.concatenate([matrix[:, space + 1:hash_mark], matrix[:, hash_mark + 1:]], axis=1)
+        if not (((decimals >= ord('0')) & (decimals <= ord('9'))).all() and _IS_HEX[hexadecimals].all()):
+            return None
+        fraction = paren - dot - 1
+        timestamp[rows] = _digits(matrix[:, 1:dot], 10) * 1_000_000_000 + _digits(matrix[:, dot + 1:dot + 1 + min(fraction, 9)], 10) * 10 ** max(9 - fraction, 0)
+        can_id[rows] = _digits(matrix[:, space + 1:hash_mark], 16)
+        extended[rows] = hash_mark - space - 1 > 3
+        length[rows] = size // 2
+        nibbles = _HEX_VALUES[matrix[:, hash_mark + 1:]].reshape(len(rows), -1, 2)
+        data[rows, :size // 2] = nibbles[:, :, 0] << 4 | nibbles[:, :, 1]
+    return line_number, timestamp, can_id, extended, length, data
+
+
+def read_candump(file_path: str) -> CanFrames:
+    """Reads a candump log (`candump -l`, lines like '(1726646400.000123) can0 7E0#0322F190'), or candump display
+    output ('(1726646400.000123) can0 7E0 [8] 03 22 F1 90 00 00 00 00', timestamps optional). RTR and error frames
+    are skipped.
+
+    Args:
+        file_path (str): string path to the log
+
+    Returns:
+        CanFrames: the data frames of the log, numbered by their line
+    """
+    with open(file_path, 'rb') as stream:
+        text = stream.read()
+
+    columns = _parse_log_lines(text)
+    if columns is not None:
+        number, timestamp, can_id, extended, length, data = columns
+    else:
+        matches = list(_CANDUMP_LOG.finditer(text))
+        if matches:
+            seconds, fractions, ids, fd_flags, payloads = zip(*(match.groups() for match in matches))
+        else:
+            matches = list(_CANDUMP_DISPLAY.finditer(text))
+            if not matches:
+                return _frames_from_columns(np.zeros(0, np.int64), np.zeros(0, np.uint32), np.zeros(0, np.uint8), np.zeros((0, 8), np.uint8))
+            seconds, fractions, ids, _, payloads = zip(*(match.groups() for match in matches))
+            payloads = [payload.replace(b' ', b'').replace(b'\t', b'') for payload in payloads]
+            fd_flags = ()
+
+        can_id = np.array([int(value, 16) for value in ids], dtype=np.int64)
+        extended = np.array([len(value) > 3 for value in ids])
+        length = np.array([len(payload) // 2 for payload in payloads], dtype=np.int64)
+        data = _hex_matrix(list(payloads), 64 if any(fd_flags) or length.max(initial=0) > 8 else 8)
+        timestamp = _timestamps(seconds, fractions)
+        newlines = np.flatnonzero(np.frombuffer(text, dtype=np.uint8) == ord('\n'))
+        number = np.searchsorted(newlines, [match.start() for match in matches]) + 1
+
+    # candump writes 29-bit IDs with eight digits; error frames carry CAN_ERR_FLAG in them
+    keep = can_id <= np.where(extended, CAN_EFF_MASK, CAN_SFF_MASK)
+    can_id = np.where(extended, can_id | CAN_EFF_FLAG, can_id)
+    frames = _frames_from_columns(timestamp, can_id, length, data, number)
+    return frames if keep.all() else CanFrames(*(column[keep] for column in frames))
+
+
+def _socketcan_header(linktype: int, buffer, start: int, end: int) -> tuple[int, str] | None:
+    """Returns the offset of the SocketCAN frame in a record and the byte order of its CAN ID, or None if the record
+    is not a CAN frame."""
+    if linktype == LINKTYPE_CAN_SOCKETCAN:
+        return start, '>'
+    if linktype == LINKTYPE_LINUX_SLL and end - start >= 16 and struct.unpack_from('>H', buffer, start + 14)[0] in (ETH_P_CAN, ETH_P_CANFD):
+        return start + 16, '<'
+    if linktype == LINKTYPE_LINUX_SLL2 and end - start >= 20 and struct.unpack_from('>H', buffer, start)[0] in (ETH_P_CAN, ETH_P_CANFD):
+        return start + 20, '<'
+    return None
+
+
+def _read_fixed_records(buffer) -> CanFrames | None:
+    """Reads a classic pcap file of SocketCAN frames whose records all have the same size as one strided view, or
+    returns None if the file does not have this layout."""
+    header = PCAP_MAGIC.get(bytes(buffer[:4]))
+    if header is None or len(buffer) < 24 + 16 + 8:
+        return None
+    endian, ns_per_tick = header
+    if struct.unpack_from(endian + 'I', buffer, 20)[0] & 0x0FFFFFFF != LINKTYPE_CAN_SOCKETCAN:
+        return None
+    captured = struct.unpack_from(endian + 'I', buffer, 24 + 8)[0]
+    record = 16 + captured
+    if captured < 8 or (len(buffer) - 24) % record:
+        return None
+
+    records = np.frombuffer(buffer, dtype=np.uint8, offset=24).reshape(-1, record)
+    fields = records[:, :16].copy().view(np.dtype(endian + 'u4')).reshape(-1, 4)
+    if (fields[:, 2] != captured).any():
+        return None
+    raw_id = records[:, 16:20].copy().view('>u4').ravel()
+    data_frames = (raw_id & (CAN_RTR_FLAG | CAN_ERR_FLAG)) == 0
+    timestamp = fields[:, 0].astype(np.int64) * 1_000_000_000 + fields[:, 1].astype(np.int64) * ns_per_tick
+    can_id = np.where(raw_id & CAN_EFF_FLAG, raw_id & (CAN_EFF_FLAG | CAN_EFF_MASK), raw_id & CAN_SFF_MASK)
+    width = 64 if captured - 8 > 8 else 8
+    data = np.zeros((len(records), width), dtype=np.uint8)
+    data[:, :min(captured - 8, width)] = records[:, 24:24 + min(captured - 8, width)]
+    frames = CanFrames(np.arange(1, len(records) + 1, dtype=np.uint32), timestamp, can_id.astype(np.uint32),
+                       np.minimum(records[:, 20], captured - 8).astype(np.uint8), data)
+    return frames if data_frames.all() else CanFrames(*(column[data_frames] for column in frames))
+
+
+def read_socketcan_pcap(file_path: str) -> CanFrames:
+    """Reads the CAN data frames of a pcap/pcapng file with SocketCAN or Linux cooked CAN records. Frame numbers
+    count all records, so they match Wireshark's.
+
+    Args:
+        file_path (str): string path to the capture file
+
+    Returns:
+        CanFrames: the data frames of the capture
+    """
+    with map_capture(file_path) as buffer:
+        frames = _read_fixed_records(buffer)
+        if frames is not None:
+            return frames
+
+        numbers, timestamps, ids, lengths, payloads = [], [], [], [], []
+        for number, linktype, timestamp, start, end in RecordReader().records(buffer):
+            header = _socketcan_header(linktype, buffer, start, end)
+            if header is None or end - header[0] < 8:
+                continue
+            offset, endian = header
+            raw_id, length = struct.unpack_from(endian + 'IB', buffer, offset)
+            if raw_id & (CAN_RTR_FLAG | CAN_ERR_FLAG):
+                continue
+            numbers.append(number)
+            timestamps.append(timestamp)
+            ids.append(raw_id & (CAN_EFF_FLAG | CAN_EFF_MASK) if raw_id & CAN_EFF_FLAG else raw_id & CAN_SFF_MASK)
+            payload = bytes(buffer[offset + 8:min(offset + 8 + length, end)])
+            lengths.append(len(payload))
+            payloads.append(payload)
+
+    width = 64 if max(lengths, default=0) > 8 else 8
+    data = np.zeros((len(payloads), width), dtype=np.uint8)
+    for row, payload in enumerate(payloads):
+        data[row, :len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+    return CanFrames(np.array(numbers, dtype=np.uint32), np.array(timestamps, dtype=np.int64), np.array(ids, dtype=np.uint32),
+                     np.array(lengths, dtype=np.uint8), data)
+
+
+def can_capture_kind(file_path: str) -> str | None:
+    """Tells CAN captures from others by their first bytes.
+
+    Returns:
+        str | None: 'pcap' for pcap/pcapng files whose first record is a CAN frame, 'candump' for candump logs, None
+            otherwise (e.g. DoIP captures)
+    """
+    with open(file_path, 'rb') as stream:
+        head = stream.read(DETECT_BYTES)
+    try:
+        for _, linktype, _, start, end in RecordReader().records(head):
+            return 'pcap' if _socketcan_header(linktype, head, start, end) is not None else None
+        return None
+    except (ValueError, struct.error):
+        pass
+    first_line = head.lstrip().split(b'\n', 1)[0] + b'\n'
+    return 'candump' if _CANDUMP_LOG.match(first_line) or _CANDUMP_DISPLAY.match(first_line) else None
+
+
+def read_can_frames(file_path: str) -> CanFrames:
+    """Reads the CAN frames of a candump log or SocketCAN capture, see `can_capture_kind`."""
+    return read_candump(file_path) if can_capture_kind(file_path) == 'candump' else read_socketcan_pcap(file_path)
+
+
+def reassemble(frames: CanFrames, timeout: float = N_CR_TIMEOUT) -> tuple[IsoTpMessages, dict[str, int]]:
+    """Reassembles the ISO-TP messages of all arbitration IDs, see the module docstring.
+
+    Args:
+        frames (CanFrames): CAN frames in capture order
+        timeout (float): seconds after which a multi-frame message waiting for its next consecutive frame is dropped
+
+    Returns:
+        tuple: the complete messages, and counts of 'frames', 'single_frames', 'first_frames', 'consecutive_frames',
+            'flow_control_frames', 'messages', 'wrong_sequence' and 'timeouts' (dropped messages), 'interrupted'
+            (messages cut short by a new single or first frame, or never completed) and 'unexpected_consecutive'
+            (consecutive frames without a message in progress)
+    """
+    data = frames.data
+    length = frames.length.astype(np.int64)
+    first = data[:, 0] if len(data) else np.zeros(0, np.uint8)
+    kind = np.where(length > 0, first >> 4, 0xF)
+    low = (first & 0xF).astype(np.int64)
+
+    # Single frames: length in the low nibble, or in the second byte (CAN FD escape)
+    escaped = (low == 0) & (length > 8)
+    sf_start = np.where(escaped, 2, 1)
+    sf_length = np.where(escaped, data[:, 1] if data.shape[1] > 1 else 0, low)
+    single = (kind == SINGLE_FRAME) & (sf_length > 0) & (sf_length <= length - sf_start)
+
+    # First frames: 12-bit length, or a 32-bit length after a zero (escape)
+    ff_length = (low << 8) | data[:, 1]
+    ff_escaped = (kind == FIRST_FRAME) & (ff_length == 0)
+    ff_start = np.where(ff_escaped, 6, 2)
+    if ff_escaped.any():
+        ff_length = np.where(ff_escaped, data[:, 2:6].astype(np.int64) @ np.array([1 << 24, 1 << 16, 1 << 8, 1], dtype=np.int64), ff_length)
+    first_frame = (kind == FIRST_FRAME) & (length >= ff_start + 1) & (ff_length > length - ff_start)
+
+    # Walk the single, first and consecutive frames of every ID in capture order
+    relevant = np.flatnonzero((kind == SINGLE_FRAME) | (kind == FIRST_FRAME) | (kind == CONSECUTIVE_FRAME))
+    ids = frames.can_id[relevant]
+    order = relevant[np.argsort(ids.astype(np.uint16) if ids.max(initial=0) <= CAN_SFF_MASK else ids, kind='stable')]  # radix sort for 11-bit IDs
+    can_id = frames.can_id[order]
+    n = len(order)
+    new_id = np.ones(n, dtype=bool)
+    new_id[1:] = can_id[1:] != can_id[:-1]
+    starts = new_id | (kind[order] != CONSECUTIVE_FRAME)
+    owner = np.maximum.accumulate(np.where(starts, np.arange(n), 0)) if n else np.zeros(0, np.int64)
+    owner_frame = order[owner]
+    consecutive = ~starts & first_frame[owner_frame]  # consecutive frames of a message in progress
+    unexpected = ~starts & ~first_frame[owner_frame]
+
+    position = np.arange(n) - owner
+    timestamp = frames.timestamp[order]
+    gap = np.zeros(n, dtype=np.int64)
+    gap[1:] = timestamp[1:] - timestamp[:-1]
+    wrong_sequence = consecutive & ((low[order] & 0xF) != (position & 0xF))
+    late = consecutive & (gap > int(timeout * 1_000_000_000))
+    bad = wrong_sequence | late
+    bad_count = np.cumsum(bad)
+    broken = bad_count - bad_count[owner] > 0  # a bad frame at or before this one
+
+    received = np.cumsum(np.where(consecutive, length[order] - 1, 0))
+    received = received - received[owner] + (length - ff_start)[owner_frame]
+    needed = ff_length[owner_frame]
+    completes = consecutive & ~broken & (received >= needed) & (received - (length[order] - 1) < needed)
+    done = np.flatnonzero(completes)
+
+    # Messages in the order they completed: single frames at their frame, multi-frame messages at their last frame
+    message_frame = np.concatenate([np.flatnonzero(single), order[done]])
+    first_index = np.concatenate([np.flatnonzero(single), order[owner[done]]])
+    payload_start = np.concatenate([sf_start[single], ff_start[order[owner[done]]]])
+    payload_length = np.concatenate([sf_length[single], needed[done]])
+    arrival = np.argsort(message_frame, kind='stable')
+    message_frame, first_index, payload_start, payload_length = message_frame[arrival], first_index[arrival], payload_start[arrival], payload_length[arrival]
+
+    sid = data[first_index, payload_start] if len(first_index) else np.zeros(0, np.uint8)
+    nrc_column = np.minimum(payload_start + 2, data.shape[1] - 1)
+    error = np.where((sid == UDS_NEGATIVE_RESPONSE) & (payload_length > 2), data[first_index, nrc_column] if len(first_index) else 0, NO_ERROR).astype(np.uint8)
+    subfunction = np.where(payload_length > 1, data[first_index, payload_start + 1] if len(first_index) else 0, 0).astype(np.uint8)
+
+    messages = IsoTpMessages(frames.number[message_frame], frames.timestamp[message_frame], frames.can_id[message_frame],
+                             payload_length.astype(np.uint32), sid.astype(np.uint8), error, subfunction)
+
+    # A message is dropped at its first bad frame; messages still open when the next single/first frame (or the end)
+    # comes were interrupted
+    first_bad = bad & (bad_count - bad_count[owner] == 1)
+    completed_or_dropped = np.zeros(n, dtype=bool)
+    completed_or_dropped[owner[done]] = True
+    completed_or_dropped[owner[first_bad]] = True
+    stats = {
+        'frames': len(length),
+        'single_frames': int((kind == SINGLE_FRAME).sum()),
+        'first_frames': int((kind == FIRST_FRAME).sum()),
+        'consecutive_frames': int((kind == CONSECUTIVE_FRAME).sum()),
+        'flow_control_frames': int((kind == FLOW_CONTROL).sum()),
+        'messages': len(message_frame),
+        'wrong_sequence': int((first_bad & wrong_sequence).sum()),
+        'timeouts': int((first_bad & ~wrong_sequence).sum()),
+        'interrupted': int((starts & first_frame[order] & ~completed_or_dropped).sum()),
+        'unexpected_consecutive': int(unexpected.sum()),
+    }
+    return messages, stats
+
+
+class IsoTpReassembler:
+    """Frame-by-frame ISO-TP receiver for all arbitration IDs, with the same rules as `reassemble`.
+
+    Args:
+        timeout (float): seconds after which a multi-frame message waiting for its next consecutive frame is dropped
+    """
+
+    def __init__(self, timeout: float = N_CR_TIMEOUT):
+        self.timeout = int(timeout * 1_000_000_000)
+        self._open = {}  # can id -> [announced length, next sequence number, timestamp of the last frame, bytearray]
+
+    def add(self, timestamp: int, can_id: int, data: bytes) -> bytes | None:
+        """Adds one CAN frame and returns the payload of the message it completes, if any."""
+        if not data:
+            return None
+        kind, low = data[0] >> 4, data[0] & 0xF
+
+        if kind == SINGLE_FRAME:
+            self._open.pop(can_id, None)
+            start, size = (2, data[1]) if low == 0 and len(data) > 8 else (1, low)
+            return bytes(data[start:start + size]) if 0 < size <= len(data) - start else None
+
+        if kind == FIRST_FRAME:
+            self._open.pop(can_id, None)
+            size = (low << 8) | data[1] if len(data) > 1 else 0
+            start = 2
+            if size == 0 and len(data) >= 6:
+                size, start = int.from_bytes(data[2:6], 'big'), 6
+            if len(data) >= start + 1 and size > len(data) - start:
+                self._open[can_id] = [size, 1, timestamp, bytearray(data[start:])]
+            return None
+
+        if kind == CONSECUTIVE_FRAME:
+            message = self._open.get(can_id)
+            if message is None:
+                return None
+            size, sequence, last, buffer = message
+            if low != sequence or timestamp - last > self.timeout:
+                del self._open[can_id]
+                return None
+            buffer += data[1:]
+            if len(buffer) >= size:
+                del self._open[can_id]
+                return bytes(buffer[:size])
+            message[1], message[2] = (sequence + 1) & 0xF, timestamp
+        return None
+
+
+def can_addresses(can_id: np.ndarray, sid: np.ndarray, id_pairs: dict[int, int] | None = None,
+                  response_offset: int = RESPONSE_ID_OFFSET) -> tuple[np.ndarray, np.ndarray]:
+    """Derives UDS source and target addresses from arbitration IDs, see the module docstring.
+
+    Args:
+        can_id (np.ndarray): arbitration IDs, with CAN_EFF_FLAG set for 29-bit IDs
+        sid (np.ndarray): first payload byte of the messages, which tells requests from replies
+        id_pairs (dict | None): request ID -> response ID of ECUs whose IDs do not follow `response_offset`
+        response_offset (int): response ID minus request ID of all other ECUs
+
+    Returns:
+        tuple: source and target addresses (uint16)
+    """
+    can_id = can_id.astype(np.int64)
+    reply = (sid & UDS_REPLY_FLAG) != 0
+    bare_id = can_id & CAN_EFF_MASK
+    fixed = (can_id & CAN_EFF_FLAG != 0) & np.isin((bare_id >> 16) & 0xFF, (NORMAL_FIXED_PHYSICAL, NORMAL_FIXED_FUNCTIONAL))
+
+    request_id = bare_id - response_offset
+    for request, response in (id_pairs or {}).items():
+        request_id = np.where(bare_id == response, request, request_id)
+    ecu = np.where(reply, request_id, bare_id) & 0xFFFF
+
+    source = np.where(fixed, bare_id & 0xFF, np.where(reply, ecu, CAN_TESTER_ADDRESS))
+    target = np.where(fixed, (bare_id >> 8) & 0xFF, np.where(reply, CAN_TESTER_ADDRESS, ecu))
+    return source.astype(np.uint16), target.astype(np.uint16)
+
+
+def scan_can_log(file_path: str, progress: Callable[..., None] | None = None, timeout: float = N_CR_TIMEOUT,
+                 id_pairs: dict[int, int] | None = None, response_offset: int = RESPONSE_ID_OFFSET) -> pd.DataFrame:
+    """Scans a candump log or SocketCAN capture into the typed UDS packet table of `pipeline.scan.scan_pcap_file`.
+
+    Args:
+        file_path (str): string path to the log or capture
+        progress (Callable | None): called as `progress(packets=n)` once the messages are reassembled
+        timeout (float): see `reassemble`
+        id_pairs (dict | None): see `can_addresses`
+        response_offset (int): see `can_addresses`
+
+    Returns:
+        pd.DataFrame: one row per UDS message, with the columns and dtypes of `pipeline.scan.UDS_PACKET_DTYPES`.
+            Payloads are not stored contiguously in the capture, so their offset is `NO_OFFSET`.
+    """
+    messages, _ = reassemble(read_can_frames(file_path), timeout)
+    source, target = can_addresses(messages.can_id, messages.sid, id_pairs, response_offset)
+    if progress is not None:
+        progress(packets=len(messages.sid))
+
+    return pd.DataFrame({
+        'number': messages.number,
+        'timestamp': messages.timestamp.view('datetime64[ns]'),
+        'source': source,
+        'target': target,
+        'request': (messages.sid & UDS_REPLY_FLAG) == 0,
+        'sid': messages.sid,
+        'error': messages.error,
+        'subfunction': messages.subfunction,
+        'payload_offset': np.full(len(messages.sid), NO_OFFSET, dtype=np.int64),
+        'payload_length': messages.length,
+    }, copy=False)
+
+
+def iter_isotp_messages(file_path: str, timeout: float = N_CR_TIMEOUT) -> Iterator[tuple[int, int, int, int, bytes]]:
+    """Reassembles the UDS messages of a candump log or SocketCAN capture one by one, with their payloads and the
+    default addresses of `can_addresses`.
+
+    Yields:
+        tuple: (frame number, timestamp in ns, source address, target address, payload), in capture order
+    """
+    frames = read_can_frames(file_path)
+    reassembler = IsoTpReassembler(timeout)
+    addresses = {}  # (can id, SID byte is a reply) -> (source, target)
+    for number, timestamp, can_id, length, data in zip(*(column.tolist() for column in frames[:4]), frames.data):
+        payload = reassembler.add(timestamp, can_id, data[:length].tobytes())
+        if payload:
+            key = (can_id, payload[0] & UDS_REPLY_FLAG)
+            if key not in addresses:
+                source, target = can_addresses(np.array([can_id], dtype=np.uint32), np.array([payload[0]], dtype=np.uint8))
+                addresses[key] = int(source[0]), int(target[0])
+            yield number, timestamp, *addresses[key], payload
+
+
+def _parse_id_pair(text: str) -> tuple[int, int]:
+    request, response = text.split(':')
+    return int(request, 16), int(response, 16)
+
+
+if __name__ == '__main__':
+
+    from utils import describe_request_reply, convert_session_log_to_str  # pylint: disable=C0415
+    from pipeline.matching import pair_packets  # pylint: disable=C0415
+
+    parser = argparse.ArgumentParser(description="Reassemble the UDS messages of a candump log or SocketCAN capture and print its session log.")
+    parser.add_argument('path', help="candump log, or pcap/pcapng file of SocketCAN frames")
+    parser.add_argument('--timeout', type=float, default=N_CR_TIMEOUT, help="seconds between consecutive frames after which a message is dropped")
+    parser.add_argument('--id-pair', type=_parse_id_pair, action='append', default=[], metavar='REQUEST:RESPONSE',
+                        help=f"hex request and response IDs of an ECU (default: response ID = request ID + {RESPONSE_ID_OFFSET:#x})")
+    args = parser.parse_args()
+
+    frames = read_can_frames(args.path)
+    messages, stats = reassemble(frames, args.timeout)
+    print(', '.join(f"{name.replace('_', ' ')}: {count:,}" for name, count in stats.items()))
+    packets = scan_can_log(args.path, timeout=args.timeout, id_pairs=dict(args.id_pair))
+    print(convert_session_log_to_str(describe_request_reply(pair_packets(packets))))
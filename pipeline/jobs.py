@@ -0,0 +1,164 @@
+"""Background jobs with progress reporting.
+
+`JobQueue` runs submitted functions on a bounded pool of worker threads, so long-running work such as decoding and
+analysing an uploaded capture does not block the HTTP request that started it. Each job records its status, the
+current stage and arbitrary progress counters, which the web app exposes at `/jobs/<id>`. `AsyncJobQueue` is the
+counterpart for the ASGI app (see `asgi.py`), running coroutines as tasks on its event loop.
+"""
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable
+
+# pylint: disable=C0301
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue already holds its maximum number of unfinished jobs."""
+
+
+class Job:
+    """State of one background job. Updated by the worker, read by status requests."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.stage = None
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.updated = self.created
+        self._lock = threading.Lock()
+
+    def update(self, stage: str | None = None, **progress) -> None:
+        """Records the current stage and/or progress counters, e.g. `job.update(stage='decoding', packets=1000)`."""
+        with self._lock:
+            if stage is not None:
+                self.stage = stage
+            self.progress.update(progress)
+            self.updated = time.time()
+
+    def set_status(self, status: str, result: object = None, error: str | None = None) -> None:
+        """Sets the status, and the result or error message once the job has finished."""
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.updated = time.time()
+
+    def to_dict(self) -> dict:
+        """Returns a JSON-serialisable snapshot of the job."""
+        with self._lock:
+            return {
+                'id': self.id,
+                'status': self.status,
+                'stage': self.stage,
+                'progress': dict(self.progress),
+                'result': self.result,
+                'error': self.error,
+                'elapsed': round((self.updated if self.status in (DONE, FAILED) else time.time()) - self.created, 3),
+            }
+
+
+class _JobRegistry:
+    """Jobs by id, with the limit on unfinished jobs and the retention of finished ones shared by both queues."""
+
+    def __init__(self, max_unfinished: int, retain: int):
+        self.max_unfinished = max_unfinished
+        self.retain = retain
+        self._jobs = {}  # insertion ordered, oldest first
+        self._lock = threading.Lock()
+
+    def _register(self) -> Job:
+        """Creates a queued job, or raises `QueueFull`."""
+        job = Job()
+        with self._lock:
+            if sum(queued.status in (QUEUED, RUNNING) for queued in self._jobs.values()) >= self.max_unfinished:
+                raise QueueFull("Too many jobs in progress, try again later.")
+            self._jobs[job.id] = job
+            self._prune()
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """Returns the job with the given id, or None if it is unknown or no longer retained."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        """Forgets the oldest finished jobs beyond `retain`."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in (DONE, FAILED)]
+        for job_id in finished[:max(len(finished) - self.retain, 0)]:
+            del self._jobs[job_id]
+
+
+class JobQueue(_JobRegistry):
+    """Bounded pool of worker threads running jobs in submission order.
+
+    Args:
+        workers (int): number of jobs that run concurrently
+        max_unfinished (int): number of queued or running jobs above which `submit` raises `QueueFull`
+        retain (int): number of finished jobs kept for status requests
+    """
+
+    def __init__(self, workers: int = 2, max_unfinished: int = 16, retain: int = 256):
+        super().__init__(max_unfinished, retain)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+    def submit(self, function: Callable[..., object], *args, **kwargs) -> Job:
+        """Queues `function(job, *args, **kwargs)`. Its return value becomes the job result and any exception marks the
+        job as failed.
+
+        Returns:
+            Job: the queued job
+        """
+        job = self._register()
+        self._executor.submit(self._run, job, function, args, kwargs)
+        return job
+
+    def _run(self, job: Job, function: Callable[..., object], args: tuple, kwargs: dict) -> None:
+        job.set_status(RUNNING)
+        try:
+            job.set_status(DONE, result=function(job, *args, **kwargs))
+        except Exception as e:  # pylint: disable=W0718
+            job.set_status(FAILED, error=str(e))
+
+
+class AsyncJobQueue(_JobRegistry):
+    """Jobs run as tasks on the running event loop, at most `workers` at a time in submission order.
+
+    Args:
+        workers (int): number of jobs that run concurrently
+        max_unfinished (int): number of queued or running jobs above which `submit` raises `QueueFull`
+        retain (int): number of finished jobs kept for status requests
+    """
+
+    def __init__(self, workers: int = 2, max_unfinished: int = 16, retain: int = 256):
+        super().__init__(max_unfinished, retain)
+        self._slots = asyncio.Semaphore(workers)
+        self._tasks = set()  # running tasks, referenced until done so they are not garbage collected
+
+    def submit(self, function: Callable[..., Awaitable[object]], *args, **kwargs) -> Job:
+        """Schedules `await function(job, *args, **kwargs)`. Must be called from the event loop. Its return value
+        becomes the job result and any exception marks the job as failed.
+
+        Returns:
+            Job: the queued job
+        """
+        job = self._register()
+        task = asyncio.get_running_loop().create_task(self._run(job, function, args, kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: Job, function: Callable[..., Awaitable[object]], args: tuple, kwargs: dict) -> None:
+        async with self._slots:
+            job.set_status(RUNNING)
+            try:
+                job.set_status(DONE, result=await function(job, *args, **kwargs))
+            except Exception as e:  # pylint: disable=W0718
+                job.set_status(FAILED, error=str(e))
@@ -0,0 +1,209 @@
+"""Shared on-disk cache of chat model responses.
+
+`LLMResponseCache` is a LangChain cache (see `langchain_core.caches.BaseCache`) passed to every chat model created
+by `utils.instantiate_llm`, so the supervisor and all agents reuse responses to prompts they have answered before,
+across sessions and restarts.
+
+Keys are a hash of the normalized prompt, the model configuration and the current cache scope:
+
+- the prompt is reduced to what the model actually sees (message type, name, content with whitespace collapsed,
+  tool call names and arguments); message ids, tool call ids and response metadata, which differ on every run, are
+  dropped;
+- the scope (see `cache_scope`) is set by the web app to the digest of the session log the agents work on, so an
+  answer is never reused for a different capture.
+
+Entries expire after `ttl` seconds, and the least recently used entries are deleted once the database holds more than
+`max_bytes` of responses. `stats` reports hits, misses, expirations and evictions.
+"""
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from langchain_core._api.beta_decorator import suppress_langchain_beta_warning
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+# pylint: disable=C0301
+
+LLM_CACHE_DB = "cache/llm_cache.sqlite"
+LLM_CACHE_TTL = 7 * 24 * 3600
+LLM_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_scope = contextvars.ContextVar("llm_cache_scope", default="")
+
+
+@contextmanager
+def cache_scope(scope: str) -> Iterator[None]:
+    """Adds `scope` (e.g. the digest of the loaded session log) to the keys of all cache lookups made inside the
+    block, including those of graph nodes and tools running in worker threads."""
+    token = _scope.set(scope)
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def _normalize_content(content: Any) -> Any:
+    if isinstance(content, str):
+        return " ".join(content.split())
+    if isinstance(content, list):
+        return [_normalize_content(part) for part in content]
+    if isinstance(content, dict):
+        return {key: _normalize_content(value) for key, value in content.items()}
+    return content
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Reduces a serialized list of messages (as passed to `BaseCache.lookup` by chat models) to a canonical string
+    of the parts that determine the model's response.
+
+    Args:
+        prompt (str): prompt serialized by `langchain_core.load.dumps`
+
+    Returns:
+        str: canonical JSON of the messages
+    """
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return " ".join(prompt.split())
+    if not isinstance(messages, list):
+        return " ".join(prompt.split())
+
+    normalized = []
+    for message in messages:
+        fields = message.get("kwargs", {}) if isinstance(message, dict) else {}
+        normalized.append({
+            "type": fields.get("type"),
+            "name": fields.get("name"),
+            "content": _normalize_content(fields.get("content")),
+            "tool_calls": [(call.get("name"), call.get("args")) for call in fields.get("tool_calls", [])],
+        })
+    return json.dumps(normalized, sort_keys=True, default=str)
+
+
+class LLMResponseCache(BaseCache):
+    """SQLite-backed response cache with expiry, LRU eviction by size and hit/miss counters.
+
+    Args:
+        db_path (str): database file, created with its folder on first use
+        ttl (float): seconds after which an entry is no longer served
+        max_bytes (int): total size of the stored responses above which the least recently used entries are deleted
+    """
+
+    def __init__(self, db_path: str = LLM_CACHE_DB, ttl: float = LLM_CACHE_TTL, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._bytes = None  # total size of the stored responses, read from the database on first use
+        self._counts = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "stored": 0}
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.db_path):
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._conn.executescript(
+                """
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+                """
+            )
+            self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        return self._conn
+
+    @staticmethod
+    def key(prompt: str, llm_string: str, scope: str = "") -> str:
+        """Returns the cache key of a prompt for a model configuration within a scope."""
+        digest = hashlib.blake2b(digest_size=20)
+        for part in (normalize_prompt(prompt), llm_string, scope):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> list | None:
+        key = self.key(prompt, llm_string, _scope.get())
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value, size, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._counts["misses"] += 1
+                return None
+            value, size, created = row
+            if now - created > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._bytes -= size
+                self._counts["expired"] += 1
+                self._counts["misses"] += 1
+                return None
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._counts["hits"] += 1
+
+        with suppress_langchain_beta_warning():
+            generations = loads(value)
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            if message is not None:
+                message.id = None  # each reuse is a new message, see `langgraph.graph.message.add_messages`
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: list) -> None:
+        key = self.key(prompt, llm_string, _scope.get())
+        value = dumps(return_val)
+        size = len(value)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            previous = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)", (key, value, size, now, now))
+            self._bytes += size - (previous[0] if previous else 0)
+            self._counts["stored"] += 1
+            if self._bytes > self.max_bytes:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Deletes expired entries, then the least recently used ones until the cache fits into `max_bytes`."""
+        expired = conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)).rowcount
+        self._counts["expired"] += expired
+        self._bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        doomed = []
+        excess = self._bytes - self.max_bytes
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self._bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._counts["evicted"] += len(doomed)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._connection().execute("DELETE FROM responses")
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Returns the hit, miss, expiry, eviction and store counts since start, the hit rate and the stored size."""
+        with self._lock:
+            counts = dict(self._counts)
+            lookups = counts["hits"] + counts["misses"]
+            counts["hit_rate"] = round(counts["hits"] / lookups, 4) if lookups else None
+            counts["bytes"] = self._bytes
+            return counts
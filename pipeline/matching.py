@@ -0,0 +1,331 @@
+"""Vectorized request/reply pairing of UDS packets.
+
+Each request is paired with the first later reply from its ECU whose SID is the positive response (request SID +
+0x40) or a negative response (0x7F), and every reply is used at most once, processing requests in packet order. A
+reply that comes after the P6 deadline of a request is not paired with it: the request is left unanswered, like the
+streaming `pipeline.streaming.IncrementalMatcher` closes it as a timeout, and the reply stays free for later requests.
+
+Replies are sorted once on a composite (ECU, SID, packet number) key, so the first candidate of every request is
+found with two `np.searchsorted` calls. When no reply is claimed by more than one request, these candidates are
+exactly the greedy pairing. Otherwise only the requests of the affected ECUs, from their first contested request
+onward, are re-paired sequentially with a "next unused reply" skip list, which gives the same result as processing
+every request in order.
+
+Negative replies with NRC 0x78 (requestCorrectlyReceived-ResponsePending) are not final: they are attributed to the
+latest request to their ECU that is still waiting for its final reply, counted in `pending_responses`, and restart
+its deadline.
+"""
+import numpy as np
+import pandas as pd
+
+from .doip import UDS_NEGATIVE_RESPONSE, UDS_REPLY_FLAG, UDS_RESPONSE_PENDING
+from .scan import NO_OFFSET
+from .timing import DEFAULT_TIMING
+
+# pylint: disable=C0301
+
+NO_REPLY = -1
+
+PAIR_DTYPES = {
+    'request_number': np.uint32,  # packet number of the request
+    'request_timestamp': 'datetime64[ns]',
+    'ecu_address': np.uint16,  # target of the request, i.e. source of the reply
+    'request_sid': np.uint8,
+    'replied': np.bool_,  # False if no reply was found (timeout)
+    'reply_number': np.uint32,  # 0 if not replied
+    'reply_timestamp': 'datetime64[ns]',  # NaT if not replied
+    'reply_sid': np.uint8,  # 0 if not replied
+    'error': np.uint8,  # NRC of negative replies, 0 otherwise
+    'pending_responses': np.uint16,  # number of 0x78 response pending replies before the final reply
+    'first_response_timestamp': 'datetime64[ns]',  # first reply of any kind (pending or final), NaT if none
+    'max_pending_interval': 'timedelta64[ns]',  # longest wait after a response pending reply, NaT if none
+}
+
+# Payload locations of the request and the final reply, and the sub-function of the request (see
+# `pipeline.scan.UDS_PACKET_DTYPES`), added by `pair_packets` after the columns of `PAIR_DTYPES`
+PAYLOAD_DTYPES = {
+    'request_offset': np.int64,
+    'request_length': np.uint32,
+    'reply_offset': np.int64,  # NO_OFFSET if not replied
+    'reply_length': np.uint32,  # 0 if not replied
+    'request_subfunction': np.uint8,  # second payload byte of the request, only if the packets have 'subfunction'
+}
+
+
+def pair_packets(packets: pd.DataFrame, timeout: float | None = DEFAULT_TIMING.p6) -> pd.DataFrame:
+    """Pairs the requests and replies of a typed packet table (see `pipeline.scan.scan_pcap_file`).
+
+    Args:
+        packets (pd.DataFrame): typed UDS packets, sorted by packet number
+        timeout (float | None): P6 deadline in seconds after the request, or after its latest response pending reply;
+            later replies are not paired with the request. None pairs regardless of time.
+
+    Returns:
+        pd.DataFrame: one row per request in packet order, with the columns of `PAIR_DTYPES` and `PAYLOAD_DTYPES`
+            (payloads are located by `NO_OFFSET` if the packets have no payload columns)
+    """
+    number = packets['number'].to_numpy()
+    timestamp = packets['timestamp'].to_numpy()
+    source = packets['source'].to_numpy()
+    target = packets['target'].to_numpy()
+    sid = packets['sid'].to_numpy()
+    error = packets['error'].to_numpy()
+    request = packets['request'].to_numpy()
+    if 'payload_offset' in packets:
+        offset = packets['payload_offset'].to_numpy()
+        length = packets['payload_length'].to_numpy()
+    else:
+        offset = np.full(len(packets), NO_OFFSET, dtype=np.int64)
+        length = np.zeros(len(packets), dtype=np.uint32)
+
+    pending = (sid == UDS_NEGATIVE_RESPONSE) & (error == UDS_RESPONSE_PENDING) & ~request
+    final = np.flatnonzero(~pending)
+    pending = np.flatnonzero(pending)
+    owner = _pending_owners(number, source, pending, np.flatnonzero(request), target)
+    deadline = _deadlines(timestamp, pending, owner, np.flatnonzero(request), timeout)
+    request_positions, reply_positions = match_request_reply(number[final], source[final], target[final], sid[final], request[final],
+                                                             timestamp[final], deadline)
+    request_positions = final[request_positions]
+    replied = reply_positions != NO_REPLY
+    replies = np.where(replied, final[np.where(replied, reply_positions, 0)], 0)
+
+    reply_timestamp = np.where(replied, timestamp[replies], np.datetime64('NaT', 'ns'))
+    pending_responses, first_pending, max_pending_interval = _pending_chains(
+        number, timestamp, pending, owner, np.where(replied, number[replies], np.iinfo(np.int64).max), deadline, reply_timestamp)
+
+    pairs = pd.DataFrame({
+        'request_number': number[request_positions],
+        'request_timestamp': timestamp[request_positions],
+        'ecu_address': target[request_positions],
+        'request_sid': sid[request_positions],
+        'replied': replied,
+        'reply_number': np.where(replied, number[replies], 0).astype(np.uint32),
+        'reply_timestamp': reply_timestamp,
+        'reply_sid': np.where(replied, sid[replies], 0).astype(np.uint8),
+        'error': np.where(replied, error[replies], 0).astype(np.uint8),
+        'pending_responses': pending_responses,
+        'first_response_timestamp': np.where(pending_responses > 0, first_pending, reply_timestamp),
+        'max_pending_interval': max_pending_interval,
+        'request_offset': offset[request_positions],
+        'request_length': length[request_positions],
+        'reply_offset': np.where(replied, offset[replies], NO_OFFSET),
+        'reply_length': np.where(replied, length[replies], 0).astype(np.uint32),
+    })
+    if 'subfunction' in packets:  # not in the string representation, see `pipeline.scan.parse_uds_packets`
+        pairs['request_subfunction'] = packets['subfunction'].to_numpy()[request_positions]
+    return pairs
+
+
+def _pending_owners(number: np.ndarray, source: np.ndarray, pending: np.ndarray, request_positions: np.ndarray,
+                    target: np.ndarray) -> np.ndarray:
+    """Returns, per response pending reply, the index (into `request_positions`) of the latest earlier request to
+    its ECU, or -1 if there is none."""
+    if not len(pending) or not len(request_positions):
+        return np.full(len(pending), -1, dtype=np.int64)
+
+    # Requests sorted by (ECU, packet number): the owner of a pending reply is the last request key below its own
+    ecu = target[request_positions].astype(np.int64)
+    request_keys = (ecu << 32) | number[request_positions].astype(np.int64)
+    order = np.argsort(request_keys, kind='stable')
+    pending_keys = (source[pending].astype(np.int64) << 32) | number[pending].astype(np.int64)
+    position = np.searchsorted(request_keys[order], pending_keys, side='right') - 1
+    owner = order[np.maximum(position, 0)]
+    return np.where((position >= 0) & (ecu[owner] == source[pending]), owner, -1)
+
+
+def _deadlines(timestamp: np.ndarray, pending: np.ndarray, owner: np.ndarray, request_positions: np.ndarray,
+               timeout: float | None) -> np.ndarray:
+    """Returns the P6 deadline of every request in ns: `timeout` after the request or after the last of its response
+    pending replies that came within the deadline of the previous one (the streaming matcher closes the request at
+    the first one that did not). Without a timeout, no request has a deadline."""
+    no_deadline = np.iinfo(np.int64).max
+    if timeout is None:
+        return np.full(len(request_positions), no_deadline, dtype=np.int64)
+    timeout = int(round(timeout * 1_000_000_000))
+    start = timestamp[request_positions].view(np.int64).copy()
+
+    owned = owner >= 0
+    if owned.any():
+        chain = np.flatnonzero(owned)
+        chain = chain[np.argsort(owner[chain], kind='stable')]  # by owner, in packet order within a chain
+        chain_owner = owner[chain]
+        restart = timestamp[pending[chain]].view(np.int64)
+        first = np.ones(len(chain), dtype=bool)
+        first[1:] = chain_owner[1:] != chain_owner[:-1]
+        previous = np.where(first, start[chain_owner], np.roll(restart, 1))
+        late = restart - previous > timeout
+        # A restart only counts if neither it nor an earlier restart of its chain came after the deadline
+        late_so_far = np.cumsum(late)
+        late_before_chain = np.maximum.accumulate(np.where(first, late_so_far - late, 0))
+        valid = late_so_far == late_before_chain
+        np.maximum.at(start, chain_owner[valid], restart[valid])
+
+    return start + timeout
+
+
+def _pending_chains(number: np.ndarray, timestamp: np.ndarray, pending: np.ndarray, owner: np.ndarray,
+                    reply_number: np.ndarray, deadline: np.ndarray,
+                    reply_timestamp: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Attributes response pending replies to their owner (see `_pending_owners`), if that request has not had its
+    final reply yet and its deadline has not passed.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: per request, the number of pending replies, the timestamp of the
+            first one and the longest interval between a pending reply and the next reply (NaT where undefined)
+    """
+    n = len(reply_number)
+    not_a_time = np.iinfo(np.int64).min
+    count = np.zeros(n, dtype=np.uint16)
+    first = np.full(n, not_a_time, dtype=np.int64)
+    longest = np.full(n, not_a_time, dtype=np.int64)
+    if not len(pending) or not n:
+        return count, first.view('datetime64[ns]'), longest.view('timedelta64[ns]')
+
+    owned = owner >= 0
+    owned[owned] = (reply_number[owner[owned]] > number[pending[owned]]) & (timestamp[pending[owned]].view(np.int64) <= deadline[owner[owned]])
+    owner = owner[owned]
+    pending_timestamp = timestamp[pending[owned]].view(np.int64)
+    if not len(owner):
+        return count, first.view('datetime64[ns]'), longest.view('timedelta64[ns]')
+
+    count[:] = np.bincount(owner, minlength=n)
+    first[np.unique(owner)] = np.iinfo(np.int64).max
+    np.minimum.at(first, owner, pending_timestamp)
+
+    # Interval from each pending reply to the next reply of its request: a later pending reply, or the final one
+    chain = np.argsort(owner, kind='stable')
+    owner = owner[chain]
+    pending_timestamp = pending_timestamp[chain]
+    following = np.append(pending_timestamp[1:], not_a_time)
+    last_of_chain = np.append(owner[1:] != owner[:-1], True)
+    following[last_of_chain] = reply_timestamp.view(np.int64)[owner[last_of_chain]]
+    has_following = following != not_a_time
+    np.maximum.at(longest, owner[has_following], following[has_following] - pending_timestamp[has_following])
+
+    return count, first.view('datetime64[ns]'), longest.view('timedelta64[ns]')
+
+
+def match_request_reply(number: np.ndarray, source: np.ndarray, target: np.ndarray, sid: np.ndarray,
+                        request: np.ndarray, timestamp: np.ndarray | None = None,
+                        deadline: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Pairs UDS requests with their replies.
+
+    Args:
+        number (np.ndarray): packet numbers, sorted ascending
+        source (np.ndarray): DoIP source addresses
+        target (np.ndarray): DoIP target addresses
+        sid (np.ndarray): raw SID bytes (0x7F for negative replies)
+        request (np.ndarray): True for requests, False for replies
+        timestamp (np.ndarray | None): capture timestamps (datetime64[ns]), only needed with `deadline`
+        deadline (np.ndarray | None): per request in packet order, the latest timestamp (in ns) of a reply it can be
+            paired with (see `_deadlines`). None pairs regardless of time.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: positions of the requests (in packet order) and, for each of them, the
+            position of the matched reply or NO_REPLY
+    """
+    number = np.asarray(number, dtype=np.int64)
+    sid = np.asarray(sid, dtype=np.int64)
+    request = np.asarray(request, dtype=bool)
+    request_positions = np.flatnonzero(request)
+    reply_positions = np.flatnonzero(~request)
+
+    # Replies sorted by (ECU, SID, packet number); the upper 32 bits of a key identify the (ECU, SID) group
+    keys = (np.asarray(source, dtype=np.int64)[reply_positions] << 40) | (sid[reply_positions] << 32) | number[reply_positions]
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    reply_positions = reply_positions[order]
+
+    ecu = np.asarray(target, dtype=np.int64)[request_positions] << 40
+    after = number[request_positions]
+    positive_group = ecu | (((sid[request_positions] + UDS_REPLY_FLAG) & 0xFF) << 32)
+    negative_group = ecu | (UDS_NEGATIVE_RESPONSE << 32)
+    positive = np.searchsorted(keys, positive_group | after, side='right')  # first reply of the group after the request
+    negative = np.searchsorted(keys, negative_group | after, side='right')
+
+    candidate = _earliest(keys, reply_positions, positive, positive_group, negative, negative_group)
+    reply_time = None
+    if deadline is not None:
+        # Later unused replies of the groups come later still, so a request whose first candidate is late has none
+        reply_time = np.asarray(timestamp).view(np.int64)[reply_positions]
+        found = np.flatnonzero(candidate != NO_REPLY)
+        candidate[found[reply_time[candidate[found]] > deadline[found]]] = NO_REPLY
+
+    contested = _contested(candidate)
+    if contested.any():
+        _rematch(keys, reply_positions, positive, positive_group, negative, negative_group, candidate,
+                 _tail(ecu, contested), reply_time, deadline)
+
+    matched = np.full(len(request_positions), NO_REPLY, dtype=np.int64)
+    found = candidate != NO_REPLY
+    matched[found] = reply_positions[candidate[found]]
+    return request_positions, matched
+
+
+def _earliest(keys: np.ndarray, reply_positions: np.ndarray, positive: np.ndarray, positive_group: np.ndarray,
+              negative: np.ndarray, negative_group: np.ndarray) -> np.ndarray:
+    """Returns, per request, the index (into `keys`) of the earlier of its positive and negative candidates."""
+    last = max(len(keys) - 1, 0)
+    groups = keys >> 32 if len(keys) else np.zeros(1, dtype=np.int64)
+    positions = reply_positions if len(keys) else np.zeros(1, dtype=np.int64)
+
+    has_positive = (positive < len(keys)) & (groups[np.minimum(positive, last)] == positive_group >> 32)
+    has_negative = (negative < len(keys)) & (groups[np.minimum(negative, last)] == negative_group >> 32)
+    positive_first = has_positive & (~has_negative | (positions[np.minimum(positive, last)] < positions[np.minimum(negative, last)]))
+
+    return np.where(positive_first, positive, np.where(has_negative, negative, NO_REPLY))
+
+
+def _contested(candidate: np.ndarray) -> np.ndarray:
+    """Flags requests whose candidate reply was already claimed by an earlier request."""
+    order = np.lexsort((np.arange(len(candidate)), candidate))
+    claimed = candidate[order]
+    repeated = np.zeros(len(candidate), dtype=bool)
+    repeated[order[1:]] = (claimed[1:] == claimed[:-1]) & (claimed[1:] != NO_REPLY)
+    return repeated
+
+
+def _tail(ecu: np.ndarray, contested: np.ndarray) -> np.ndarray:
+    """Flags every request of an ECU from that ECU's first contested request onward."""
+    groups, group_of_request = np.unique(ecu, return_inverse=True)
+    first = np.full(len(groups), len(ecu), dtype=np.int64)
+    np.minimum.at(first, group_of_request[contested], np.flatnonzero(contested))
+    return np.arange(len(ecu)) >= first[group_of_request]
+
+
+def _rematch(keys: np.ndarray, reply_positions: np.ndarray, positive: np.ndarray, positive_group: np.ndarray,
+             negative: np.ndarray, negative_group: np.ndarray, candidate: np.ndarray, tail: np.ndarray,
+             reply_time: np.ndarray | None = None, deadline: np.ndarray | None = None) -> None:
+    """Re-pairs the tail requests one by one, in packet order, skipping replies that are already used and replies
+    after the request's deadline. Updates `candidate` in place."""
+    following = list(range(len(keys) + 1))  # skip list: following[i] leads to the first unused reply at or after i
+    for used in candidate[~tail & (candidate != NO_REPLY)].tolist():
+        following[used] = used + 1
+
+    def next_unused(i: int) -> int:
+        root = i
+        while following[root] != root:
+            root = following[root]
+        while following[i] != root:  # path compression
+            following[i], i = root, following[i]
+        return root
+
+    groups = (keys >> 32).tolist()
+    groups.append(-1)  # sentinel for "past the last reply"
+    positions = reply_positions.tolist()
+    if deadline is not None:
+        times, deadlines = reply_time.tolist(), deadline.tolist()
+
+    for i in np.flatnonzero(tail).tolist():
+        best = NO_REPLY
+        j = next_unused(int(positive[i]))
+        if groups[j] == int(positive_group[i]) >> 32:
+            best = j
+        j = next_unused(int(negative[i]))
+        if groups[j] == int(negative_group[i]) >> 32 and (best == NO_REPLY or positions[j] < positions[best]):
+            best = j
+        if best != NO_REPLY and deadline is not None and times[best] > deadlines[i]:
+            best = NO_REPLY
+        if best != NO_REPLY:
+            following[best] = best + 1
+        candidate[i] = best
@@ -0,0 +1,295 @@
+"""Timing spans and Prometheus metrics of the capture pipeline and the agent graph.
+
+`span` measures one stage of processing a capture (hashing, decoding, pairing, description merges, exports) and
+records its wall time and the rows it produced. `GraphMetricsHandler`, passed to graph runs as a LangChain callback
+(see `MetricsRegistry.callbacks`), records the wall time of every node of the top-level graph (supervisor and
+workers), and the LLM calls, token counts and tool calls of the agents running inside them. `MetricsRegistry.render`
+returns everything in the Prometheus text format, served by the web app at `/metrics`.
+
+Spans finished inside a `collecting` block are also collected per request or job, e.g. for a `Server-Timing` header
+(see `format_server_timing`). Spans of work done in other processes are returned by `collect_call` and added with
+`replay`.
+
+Recording is off until `enable` is called; until then `span` returns a shared no-op object and `callbacks` an empty list,
+so instrumented code pays for one attribute lookup per stage.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# pylint: disable=C0301
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# name: (type, help, label names)
+METRICS = {
+    "uds_stage_duration_seconds": ("histogram", "Wall time of capture processing stages.", ("stage",)),
+    "uds_stage_rows_total": ("counter", "Rows (UDS messages or request/reply pairs) produced by capture processing stages.", ("stage",)),
+    "uds_graph_node_duration_seconds": ("histogram", "Wall time of graph node runs (supervisor and workers).", ("node",)),
+    "uds_llm_calls_total": ("counter", "Chat model calls, by the graph node they were made in.", ("node",)),
+    "uds_llm_tokens_total": ("counter", "Tokens reported by chat model responses (cached responses included), by graph node and token type.", ("node", "type")),
+    "uds_tool_calls_total": ("counter", "Agent tool calls, by graph node and tool.", ("node", "tool")),
+}
+SPAN_METRICS = {"stage": "uds_stage_duration_seconds", "node": "uds_graph_node_duration_seconds"}
+
+_collection = contextvars.ContextVar("metrics_collection", default=None)
+
+
+class Span:
+    """Context manager timing one stage. Set `rows` inside the block to record the rows the stage produced."""
+    __slots__ = ("registry", "kind", "name", "rows", "start")
+
+    def __init__(self, registry: "MetricsRegistry", kind: str, name: str):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.rows = None
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.registry.record(self.kind, self.name, time.perf_counter() - self.start, self.rows)
+
+
+class _NoSpan:
+    """Span used while recording is off; accepts `rows` and records nothing."""
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class MetricsRegistry:
+    """Histograms and counters of spans and graph runs, see the module docstring.
+
+    Args:
+        enabled (bool): record spans and graph runs
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._histograms = {}  # (metric, labels) -> [bucket counts..., sum, count]
+        self._counters = {}  # (metric, labels) -> value
+        self._lock = threading.Lock()
+        self._handler = GraphMetricsHandler(self)
+
+    def enable(self, enabled: bool = True) -> None:
+        """Turns recording on or off."""
+        self.enabled = enabled
+
+    def span(self, name: str, kind: str = "stage") -> Span | _NoSpan:
+        """Returns a context manager timing one stage (`kind` 'stage') or graph node (`kind` 'node')."""
+        if not self.enabled:
+            return _NO_SPAN
+        return Span(self, kind, name)
+
+    def callbacks(self) -> list[BaseCallbackHandler]:
+        """Returns the callbacks to pass in the config of a graph run, empty while recording is off."""
+        return [self._handler] if self.enabled else []
+
+    def record(self, kind: str, name: str, seconds: float, rows: int | None = None) -> None:
+        """Records a finished span, and adds it to the current collection (see `collecting`)."""
+        self.observe(SPAN_METRICS[kind], (name,), seconds)
+        if rows is not None:
+            self.increment("uds_stage_rows_total", (name,), rows)
+        collection = _collection.get()
+        if collection is not None:
+            collection.append((kind, name, seconds, rows))
+
+    def observe(self, metric: str, labels: tuple, value: float) -> None:
+        """Adds a value to a histogram."""
+        with self._lock:
+            histogram = self._histograms.get((metric, labels))
+            if histogram is None:
+                histogram = self._histograms[(metric, labels)] = [0] * (len(DURATION_BUCKETS) + 2)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def increment(self, metric: str, labels: tuple, value: float = 1) -> None:
+        """Adds a value to a counter."""
+        with self._lock:
+            self._counters[(metric, labels)] = self._counters.get((metric, labels), 0) + value
+
+    def render(self, counters: dict[str, float] | None = None, gauges: dict[str, float] | None = None) -> str:
+        """Returns all metrics in the Prometheus text exposition format.
+
+        Args:
+            counters (dict | None): further unlabelled counters to include, by metric name
+            gauges (dict | None): further unlabelled gauges to include, by metric name
+
+        Returns:
+            str: the metrics page
+        """
+        with self._lock:
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+            values = dict(self._counters)
+
+        lines = []
+        for metric, (metric_type, description, label_names) in METRICS.items():
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {metric_type}"]
+            if metric_type == "histogram":
+                for (name, labels), histogram in sorted(histograms.items()):
+                    if name != metric:
+                        continue
+                    label_text = _labels(label_names, labels)
+                    for bound, count in zip(DURATION_BUCKETS, histogram):
+                        lines.append(f'{metric}_bucket{{{label_text},le="{bound}"}} {count}')
+                    lines.append(f'{metric}_bucket{{{label_text},le="+Inf"}} {histogram[-1]}')
+                    lines.append(f"{metric}_sum{{{label_text}}} {histogram[-2]:.6f}")
+                    lines.append(f"{metric}_count{{{label_text}}} {histogram[-1]}")
+            else:
+                lines += [f"{metric}{{{_labels(label_names, labels)}}} {value}" for (name, labels), value in sorted(values.items()) if name == metric]
+        for metric_type, extra in (("counter", counters or {}), ("gauge", gauges or {})):
+            for metric, value in extra.items():
+                lines += [f"# TYPE {metric} {metric_type}", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    """Formats label pairs, escaping backslashes, quotes and line breaks in the values."""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+class GraphMetricsHandler(BaseCallbackHandler):
+    """LangChain callback handler recording node runs of the top-level graph, and the chat model calls, token counts
+    and tool calls made inside them. Nested runs (the agents' own graphs) are attributed to the top-level node they
+    run in, through the checkpoint namespace LangGraph puts into the run metadata."""
+    run_inline = True  # cheap enough to run in the caller, also for async graph runs
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._runs = {}  # run id -> (node, start time) of running top-level nodes, or node of running chat models
+
+    @staticmethod
+    def _node(metadata: dict | None) -> str:
+        metadata = metadata or {}
+        return metadata.get("langgraph_checkpoint_ns", "").split(":")[0] or metadata.get("langgraph_node") or "none"
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs) -> None:
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node")
+        if node is not None and kwargs.get("name") == node and not node.startswith("__") and "|" not in metadata.get("langgraph_checkpoint_ns", "|"):
+            self._runs[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            self.registry.record("node", run[0], time.perf_counter() - run[1])
+
+    def on_chain_error(self, error, *, run_id, **kwargs) -> None:
+        self.on_chain_end(None, run_id=run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs) -> None:
+        self._runs[run_id] = self._node(metadata)
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        node = self._runs.pop(run_id, "none")
+        prompt = completion = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt += usage.get("input_tokens", 0)
+                    completion += usage.get("output_tokens", 0)
+        if not prompt and not completion:
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        self.registry.increment("uds_llm_calls_total", (node,))
+        self.registry.increment("uds_llm_tokens_total", (node, "prompt"), prompt)
+        self.registry.increment("uds_llm_tokens_total", (node, "completion"), completion)
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        self._runs.pop(run_id, None)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, metadata=None, **kwargs) -> None:
+        tool = kwargs.get("name") or (serialized or {}).get("name", "unknown")
+        self.registry.increment("uds_tool_calls_total", (self._node(metadata), tool))
+
+
+registry = MetricsRegistry()  # shared by the pipeline, the agents and the web app
+enable = registry.enable
+span = registry.span
+callbacks = registry.callbacks
+
+
+@contextmanager
+def collecting() -> Iterator[list[tuple]]:
+    """Collects the spans finished inside the block, including those of graph nodes and tools running in worker
+    threads or tasks started from it.
+
+    Yields:
+        list: (kind, name, seconds, rows) per finished span, filled as spans finish
+    """
+    spans = []
+    token = _collection.set(spans)
+    try:
+        yield spans
+    finally:
+        _collection.reset(token)
+
+
+def start_collection() -> list[tuple]:
+    """Starts collecting spans in the current context until the next call, for frameworks whose request hooks cannot
+    wrap the request in `collecting` (see `app.py`).
+
+    Returns:
+        list: the collected spans, see `collecting`
+    """
+    spans = []
+    _collection.set(spans)
+    return spans
+
+
+def collect_call(function: Callable, *args, enabled: bool = True) -> tuple[Any, list[tuple]]:
+    """Calls `function` and returns its result with the spans it recorded, for work run in another process (e.g.
+    decoding in a process pool); pass the spans to `replay` in the calling process.
+
+    Args:
+        function (Callable): function to call with `args`
+        enabled (bool): record spans in this process, as in the calling process
+
+    Returns:
+        tuple: result of the call and its spans, see `collecting`
+    """
+    registry.enable(enabled)
+    with collecting() as spans:
+        result = function(*args)
+    return result, spans
+
+
+def replay(spans: list[tuple]) -> None:
+    """Records spans returned by `collect_call` in this process's registry and current collection."""
+    for kind, name, seconds, rows in spans:
+        registry.record(kind, name, seconds, rows)
+
+
+def timings_ms(spans: list[tuple]) -> dict[str, float]:
+    """Sums collected spans by name, in milliseconds and in the order they first finished."""
+    timings = {}
+    for _, name, seconds, _ in spans:
+        timings[name] = timings.get(name, 0.0) + seconds * 1000
+    return {name: round(milliseconds, 3) for name, milliseconds in timings.items()}
+
+
+def format_server_timing(spans: list[tuple]) -> str:
+    """Formats collected spans as the value of a `Server-Timing` response header, e.g. 'scan;dur=12.5, pair;dur=3.1'."""
+    return ", ".join(f"{name};dur={milliseconds}" for name, milliseconds in timings_ms(spans).items())
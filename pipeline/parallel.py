@@ -0,0 +1,190 @@
+"""Parallel decoding of large captures.
+
+The capture is split into record-aligned byte ranges. The ranges are decoded in a process pool, each worker starting
+with empty TCP reassembly state, and the per-range UDS packet arrays are merged in packet-number order.
+
+A worker that starts in the middle of a TCP connection assumes its first segment begins a DoIP message. Where that
+assumption does not hold (a message straddles the range boundary), the connection's first segments are decoded again
+in the parent from the true state at the end of the previous range, until the state matches the one the worker
+reached. From then on both decode identically, so the result is the same as `scan_pcap_file` on a single core.
+"""
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from .doip import RecordReader, DiagnosticDecoder, map_capture, _TcpStream, UDS_NEGATIVE_RESPONSE
+from .scan import UdsPacketArrays, NO_ERROR, NO_OFFSET
+
+# pylint: disable=C0301
+
+CHUNK_BYTES = 32 * 1024 * 1024
+HEAD_SEGMENTS = 64  # segments per connection and range kept for re-decoding the start of the connection
+
+
+class _ChunkDecoder(DiagnosticDecoder):
+    """Diagnostic decoder that keeps the first segments of every TCP connection it sees, together with the
+    reassembly state after each of them."""
+
+    def __init__(self, base: int = 0):
+        super().__init__()
+        self.base = base  # file offset of the decoded buffer
+        self.number = 0
+        self.timestamp = 0
+        self.heads = {}  # key -> [(number, timestamp, sequence, flags, payload, file offset of the payload, state after the segment)]
+        self.truncated = set()  # keys with more segments than kept in `heads`
+
+    def decode_segment(self, key: tuple, sequence: int, flags: int, buffer, payload_start: int, end: int) -> list[tuple[int, int, object, int, int]]:
+        messages = super().decode_segment(key, sequence, flags, buffer, payload_start, end)
+        if payload_start < end or flags & 0x06:  # the segment changed the reassembly state
+            head = self.heads.setdefault(key, [])
+            if len(head) < HEAD_SEGMENTS:
+                head.append((self.number, self.timestamp, sequence, flags, bytes(buffer[payload_start:end]), self.base + payload_start, _stream_state(self.streams.get(key))))
+            else:
+                self.truncated.add(key)
+        return messages
+
+
+def _stream_state(tcp_stream: _TcpStream | None) -> tuple[int, bytes] | None:
+    """Returns a comparable copy of a TCP reassembly state."""
+    return None if tcp_stream is None else (tcp_stream.next_sequence, bytes(tcp_stream.buffer))
+
+
+def _restore_stream(state: tuple[int, bytes]) -> _TcpStream:
+    tcp_stream = _TcpStream(state[0])
+    tcp_stream.buffer += state[1]
+    return tcp_stream
+
+
+def _append_messages(packets: UdsPacketArrays, number: int, timestamp: int, messages: list[tuple[int, int, object, int, int]], buffer, base: int) -> None:
+    """Appends decoded messages; payloads found in `buffer` are located by their offset in the file, `base` being the
+    file offset of the buffer."""
+    for source, target, data, start, end in messages:
+        sid = data[start]
+        error = data[start + 2] if sid == UDS_NEGATIVE_RESPONSE and end - start > 2 else NO_ERROR
+        packets.append(number, timestamp, source, target, sid, error, data[start + 1] if end - start > 1 else 0, base + start if data is buffer else NO_OFFSET, end - start)
+
+
+def _decode_chunk(file_path: str, reader: RecordReader, end: int, streams: dict | None = None) -> dict:
+    """Decodes the records between `reader.position` and `end` (runs in a worker process).
+
+    Args:
+        file_path (str): string path to the capture file
+        reader (RecordReader): reader positioned at the first record of the range
+        end (int): end offset of the range
+        streams (dict | None): TCP reassembly states to start from, empty if None
+
+    Returns:
+        dict: 'packets' (typed DataFrame), 'heads' and 'truncated' (see `_ChunkDecoder`) and 'streams', the
+            reassembly states at the end of the range
+    """
+    with open(file_path, 'rb') as stream:
+        stream.seek(reader.position)
+        chunk = stream.read(end - reader.position)
+
+    decoder = _ChunkDecoder(reader.position)
+    decoder.streams = {key: _restore_stream(state) for key, state in (streams or {}).items()}
+    packets = UdsPacketArrays()
+    for number, linktype, timestamp, start, stop in reader.records(chunk):
+        decoder.number, decoder.timestamp = number, timestamp
+        _append_messages(packets, number, timestamp, decoder.decode(chunk, linktype, start, stop), chunk, decoder.base)
+
+    return {
+        'packets': packets.to_frame(),
+        'heads': decoder.heads,
+        'truncated': decoder.truncated,
+        'streams': {key: _stream_state(tcp_stream) for key, tcp_stream in decoder.streams.items()},
+    }
+
+
+def _plan_chunks(file_path: str, chunk_bytes: int):
+    """Walks the record headers and yields (reader positioned at the start of a range, end offset of the range)."""
+    with map_capture(file_path) as buffer:
+        reader = RecordReader()
+        start = copy.deepcopy(reader)
+        for _ in reader.records(buffer):
+            if reader.position - start.position >= chunk_bytes:
+                yield start, reader.position
+                start = copy.deepcopy(reader)
+        if reader.position > start.position:
+            yield start, reader.position
+
+
+def _merge(file_path: str, chunks: list[tuple[RecordReader, int]], results: list[dict]) -> pd.DataFrame:
+    """Corrects the connections that straddle range boundaries and concatenates the ranges in packet order."""
+    streams = {}  # true reassembly state at the start of the current range
+    frames = []
+
+    for (reader, end), result in zip(chunks, results):
+        replaced = []
+        replayed = UdsPacketArrays(64)
+
+        for key, head in result['heads'].items():
+            prior = streams.get(key)
+            _, _, sequence, flags, _, _, _ = head[0]
+            if prior is None or flags & 0x06 or (not prior[1] and prior[0] == sequence):
+                continue  # the worker started from the same state as a serial decode would have
+
+            decoder = DiagnosticDecoder()
+            decoder.streams[key] = _restore_stream(prior)
+            converged = False
+            for number, timestamp, sequence, flags, payload, payload_offset, state in head:
+                replaced.append(number)
+                _append_messages(replayed, number, timestamp, decoder.decode_segment(key, sequence, flags, payload, 0, len(payload)), payload, payload_offset)
+                if _stream_state(decoder.streams.get(key)) == state:
+                    converged = True
+                    break
+
+            if not converged:
+                if key in result['truncated']:
+                    # No common state within the kept segments, so decode the whole range again from the true state
+                    result = _decode_chunk(file_path, copy.deepcopy(reader), end, streams)
+                    replaced, replayed = [], UdsPacketArrays(64)
+                    break
+                result['streams'][key] = _stream_state(decoder.streams.get(key))
+
+        frame = result['packets']
+        if replaced:
+            frame = pd.concat([frame[~np.isin(frame['number'].to_numpy(), replaced)], replayed.to_frame()])
+        frames.append(frame)
+        streams.update(result['streams'])
+
+    if not frames:
+        return UdsPacketArrays(1).to_frame()
+    packets = pd.concat(frames, ignore_index=True)
+    return packets.iloc[np.argsort(packets['number'].to_numpy(), kind='stable')].reset_index(drop=True)
+
+
+def scan_pcap_file_parallel(file_path: str, workers: int | None = None, chunk_bytes: int = CHUNK_BYTES,
+                            progress: Callable[..., None] | None = None) -> pd.DataFrame:
+    """Scans a pcap/pcapng file like `pipeline.scan.scan_pcap_file`, decoding record-aligned ranges of it in parallel.
+
+    Args:
+        file_path (str): string path to the capture file
+        workers (int | None): number of worker processes, defaults to the number of CPUs
+        chunk_bytes (int): approximate size of the ranges decoded by one worker task
+        progress (Callable | None): called as `progress(packets=n)` whenever a range has been decoded
+
+    Returns:
+        pd.DataFrame: typed UDS packets, identical to the output of `scan_pcap_file`
+    """
+    chunks = []
+    futures = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        # Ranges are submitted while the record headers are still being walked
+        for reader, end in _plan_chunks(file_path, chunk_bytes):
+            chunks.append((reader, end))
+            futures.append(executor.submit(_decode_chunk, file_path, reader, end))
+
+        results = []
+        decoded = 0
+        for future in futures:
+            results.append(future.result())
+            decoded += len(results[-1]['packets'])
+            if progress is not None:
+                progress(packets=decoded)
+
+    return _merge(file_path, chunks, results)
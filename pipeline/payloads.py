@@ -0,0 +1,526 @@
+"""On-demand decoding of full UDS payloads.
+
+The scan keeps only the SID and NRC of every UDS message, plus the file offset and length of its payload (see
+`pipeline.scan.UDS_PACKET_DTYPES`), which pairing carries over to the request and final reply of every pair.
+`PayloadIndex` uses these locations to read the payloads of selected session log rows from the capture file and
+decodes them with the decoder registered for their service: sub-functions, data identifiers, routine identifiers,
+DTC records, security access levels and so on. Nothing is decoded for rows nobody looks at.
+
+Payloads that were reassembled from several TCP segments, and all payloads of CAN captures (see `pipeline.isotp`),
+are not stored contiguously in the capture (`pipeline.scan.NO_OFFSET`); they are found by decoding the capture again up to their frame, once per lookup. Decoded
+payloads are memoized by content, and the details of every row by row number. Further services are decoded by
+adding a decoder with `register`.
+"""
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Iterable
+
+import numpy as np
+import pandas as pd
+
+from .doip import map_capture, iter_diagnostic_messages, UDS_NEGATIVE_RESPONSE, UDS_REPLY_FLAG
+from .isotp import can_capture_kind, iter_isotp_messages
+from .scan import NO_OFFSET
+
+# pylint: disable=C0301
+
+MAX_DATA_BYTES = 64  # data records longer than this are shortened in the details
+MAX_DETAIL_ROWS = 10_000  # rows whose details a `PayloadIndex` keeps
+DECODED_PAYLOADS = 65_536  # distinct payloads whose decoding is memoized
+
+DECODERS = {}  # service (request SID) -> (name, decoder)
+
+DATA_IDENTIFIERS = {
+    0xF180: "bootSoftwareIdentification",
+    0xF181: "applicationSoftwareIdentification",
+    0xF182: "applicationDataIdentification",
+    0xF183: "bootSoftwareFingerprint",
+    0xF184: "applicationSoftwareFingerprint",
+    0xF185: "applicationDataFingerprint",
+    0xF186: "activeDiagnosticSession",
+    0xF187: "manufacturerSparePartNumber",
+    0xF188: "manufacturerECUSoftwareNumber",
+    0xF189: "manufacturerECUSoftwareVersionNumber",
+    0xF18A: "systemSupplierIdentifier",
+    0xF18B: "ECUManufacturingDate",
+    0xF18C: "ECUSerialNumber",
+    0xF18D: "supportedFunctionalUnits",
+    0xF190: "VIN",
+    0xF191: "manufacturerECUHardwareNumber",
+    0xF192: "systemSupplierECUHardwareNumber",
+    0xF193: "systemSupplierECUHardwareVersionNumber",
+    0xF194: "systemSupplierECUSoftwareNumber",
+    0xF195: "systemSupplierECUSoftwareVersionNumber",
+    0xF197: "systemNameOrEngineType",
+    0xF198: "repairShopCodeOrTesterSerialNumber",
+    0xF199: "programmingDate",
+    0xF19D: "ECUInstallationDate",
+    0xF19E: "ODXFile",
+}
+
+ROUTINE_IDENTIFIERS = {
+    0xE200: "executeSPL",
+    0xFF00: "eraseMemory",
+    0xFF01: "checkProgrammingDependencies",
+    0xFF02: "eraseMirrorMemoryDTCs",
+}
+
+SESSIONS = {0x01: "defaultSession", 0x02: "programmingSession", 0x03: "extendedDiagnosticSession", 0x04: "safetySystemDiagnosticSession"}
+RESET_TYPES = {0x01: "hardReset", 0x02: "keyOffOnReset", 0x03: "softReset", 0x04: "enableRapidPowerShutDown", 0x05: "disableRapidPowerShutDown"}
+COMMUNICATION_CONTROL_TYPES = {0x00: "enableRxAndTx", 0x01: "enableRxAndDisableTx", 0x02: "disableRxAndEnableTx", 0x03: "disableRxAndTx"}
+DTC_SETTING_TYPES = {0x01: "on", 0x02: "off"}
+ROUTINE_CONTROL_TYPES = {0x01: "startRoutine", 0x02: "stopRoutine", 0x03: "requestRoutineResults"}
+
+DTC_REPORT_TYPES = {
+    0x01: "reportNumberOfDTCByStatusMask",
+    0x02: "reportDTCByStatusMask",
+    0x03: "reportDTCSnapshotIdentification",
+    0x04: "reportDTCSnapshotRecordByDTCNumber",
+    0x05: "reportDTCStoredDataByRecordNumber",
+    0x06: "reportDTCExtDataRecordByDTCNumber",
+    0x07: "reportNumberOfDTCBySeverityMaskRecord",
+    0x08: "reportDTCBySeverityMaskRecord",
+    0x09: "reportSeverityInformationOfDTC",
+    0x0A: "reportSupportedDTC",
+    0x0B: "reportFirstTestFailedDTC",
+    0x0C: "reportFirstConfirmedDTC",
+    0x0D: "reportMostRecentTestFailedDTC",
+    0x0E: "reportMostRecentConfirmedDTC",
+    0x14: "reportDTCFaultDetectionCounter",
+    0x15: "reportDTCWithPermanentStatus",
+}
+DTC_COUNT_REPORTS = {0x01, 0x07}  # replies with a DTC count
+DTC_LIST_REPORTS = {0x02, 0x0A, 0x0B, 0x0C, 0x0D, 0x0E, 0x15}  # replies with a list of DTC and status records
+DTC_STATUS_MASK_REQUESTS = {0x01, 0x02}
+DTC_RECORD_REQUESTS = {0x04, 0x06}  # requests for the records of one DTC
+
+DTC_STATUS_BITS = ("testFailed", "testFailedThisOperationCycle", "pendingDTC", "confirmedDTC", "testNotCompletedSinceLastClear",
+                   "testFailedSinceLastClear", "testNotCompletedThisOperationCycle", "warningIndicatorRequested")
+
+
+def register(sid: int, name: str) -> Callable:
+    """Registers a decoder for the requests and positive replies of a service.
+
+    The decoder is called as `decoder(payload, reply)` with the complete UDS payload (SID byte included) and returns
+    a dict of JSON-serialisable fields. It may raise `IndexError` or `ValueError` on payloads that are too short.
+
+    Args:
+        sid (int): request SID of the service
+        name (str): service name, reported as 'service'
+    """
+    def decorator(decoder: Callable[[bytes, bool], dict]) -> Callable[[bytes, bool], dict]:
+        DECODERS[sid] = (name, decoder)
+        return decoder
+    return decorator
+
+
+def decode_payload(payload: bytes) -> dict:
+    """Decodes a UDS payload with the decoder registered for its service.
+
+    Args:
+        payload (bytes): UDS payload, starting with the SID
+
+    Returns:
+        dict: 'service' (name, or the request SID for services without a decoder), 'reply' (True for replies) and the
+            fields of the decoder; 'data' holds the undecoded bytes of unknown or malformed payloads
+    """
+    return dict(_decode_payload(bytes(payload)))
+
+
+@lru_cache(maxsize=DECODED_PAYLOADS)
+def _decode_payload(payload: bytes) -> dict:
+    """Memoized `decode_payload`. The returned dict is shared and must not be modified."""
+    if not payload:
+        return {"service": None, "reply": False}
+    sid = payload[0]
+
+    if sid == UDS_NEGATIVE_RESPONSE:
+        details = {"service": "negativeResponse", "reply": True}
+        if len(payload) > 1:
+            details["request_sid"] = hex_byte(payload[1])
+            if payload[1] in DECODERS:
+                details["request_service"] = DECODERS[payload[1]][0]
+        if len(payload) > 2:
+            details["nrc"] = hex_byte(payload[2])
+        return details
+
+    reply = bool(sid & UDS_REPLY_FLAG)
+    service = sid - UDS_REPLY_FLAG if reply else sid
+    if service not in DECODERS:
+        details = {"service": hex_byte(service), "reply": reply}
+        if len(payload) > 1:
+            details["data"] = format_data(payload[1:])
+        return details
+
+    name, decoder = DECODERS[service]
+    try:
+        return {"service": name, "reply": reply, **decoder(payload, reply)}
+    except (IndexError, ValueError):
+        return {"service": name, "reply": reply, "malformed": True, "data": format_data(payload[1:])}
+
+
+def format_details(details: dict | None) -> str:
+    """Formats decoded payload details in one line, e.g. 'ReadDataByIdentifier reply: did=0xF190 (VIN), ascii=...'."""
+    if details is None:
+        return ""
+    fields = ", ".join(f"{name}={'; '.join(map(str, value)) if isinstance(value, list) else value}"
+                       for name, value in details.items() if name not in ("service", "reply"))
+    text = f"{details['service']}{' reply' if details['reply'] and details['service'] != 'negativeResponse' else ''}"
+    return f"{text}: {fields}" if fields else text
+
+
+def hex_byte(value: int) -> str:
+    """Formats a byte as '0x7F'."""
+    return f"0x{value:02X}"
+
+
+def format_data(data: bytes) -> str:
+    """Formats a data record as hex, shortened to `MAX_DATA_BYTES`, with its length if shortened."""
+    text = data[:MAX_DATA_BYTES].hex(" ").upper()
+    return f"{text} ... ({len(data)} bytes)" if len(data) > MAX_DATA_BYTES else text
+
+
+def _named(value: int, names: dict, width: int = 2) -> str:
+    """Formats a code with its name, e.g. '0xF190 (VIN)'."""
+    text = f"0x{value:0{width}X}"
+    return f"{text} ({names[value]})" if value in names else text
+
+
+def _sub_function(payload: bytes, names: dict) -> dict:
+    """Decodes the sub-function byte, with the suppressPosRspMsgIndicationBit if it is set."""
+    details = {"sub_function": _named(payload[1] & 0x7F, names)}
+    if payload[1] & 0x80:
+        details["suppress_positive_response"] = True
+    return details
+
+
+def _data_record(data: bytes) -> dict:
+    """Decodes a data record as hex, and as text if it is printable ASCII (e.g. VIN or part numbers)."""
+    details = {"data": format_data(data)}
+    if data and all(0x20 <= byte < 0x7F for byte in data.rstrip(b"\x00 ")):
+        details["ascii"] = data.rstrip(b"\x00 ").decode("ascii")
+    return details
+
+
+def format_dtc(record: bytes) -> str:
+    """Formats a 3-byte DTC in the SAE J2012 notation with failure type, e.g. 'P0A1B-12'."""
+    return f"{'PCBU'[record[0] >> 6]}{(record[0] >> 4) & 0x3}{record[0] & 0xF:X}{record[1]:02X}-{record[2]:02X}"
+
+
+def format_dtc_status(status: int) -> str:
+    """Formats a DTC status byte with the names of its set bits."""
+    bits = [name for bit, name in enumerate(DTC_STATUS_BITS) if status & (1 << bit)]
+    return f"0x{status:02X} ({', '.join(bits)})" if bits else f"0x{status:02X}"
+
+
+@register(0x10, "DiagnosticSessionControl")
+def diagnostic_session_control(payload: bytes, reply: bool) -> dict:
+    details = _sub_function(payload, SESSIONS)
+    if reply and len(payload) >= 6:
+        details["p2_server_max_ms"] = int.from_bytes(payload[2:4], "big")
+        details["p2_star_server_max_ms"] = int.from_bytes(payload[4:6], "big") * 10
+    return details
+
+
+@register(0x11, "ECUReset")
+def ecu_reset(payload: bytes, reply: bool) -> dict:
+    details = _sub_function(payload, RESET_TYPES)
+    if reply and len(payload) > 2:
+        details["power_down_time_s"] = payload[2]
+    return details
+
+
+@register(0x14, "ClearDiagnosticInformation")
+def clear_diagnostic_information(payload: bytes, reply: bool) -> dict:
+    if reply:
+        return {}
+    if len(payload) < 4:
+        raise ValueError("group of DTC too short")
+    group = int.from_bytes(payload[1:4], "big")
+    return {"group_of_dtc": "all groups" if group == 0xFFFFFF else f"0x{group:06X}"}
+
+
+@register(0x19, "ReadDTCInformation")
+def read_dtc_information(payload: bytes, reply: bool) -> dict:
+    report = payload[1]
+    details = {"sub_function": _named(report, DTC_REPORT_TYPES)}
+    if not reply:
+        if report in DTC_STATUS_MASK_REQUESTS:
+            details["status_mask"] = format_dtc_status(payload[2])
+        elif report in DTC_RECORD_REQUESTS:
+            details["dtc"] = format_dtc(payload[2:5])
+            details["record_number"] = hex_byte(payload[5])
+        return details
+
+    if report in DTC_COUNT_REPORTS:
+        details["status_availability_mask"] = format_dtc_status(payload[2])
+        details["dtc_count"] = int.from_bytes(payload[4:6], "big")
+    elif report in DTC_LIST_REPORTS:
+        details["status_availability_mask"] = format_dtc_status(payload[2])
+        records = payload[3:]
+        details["dtc_count"] = len(records) // 4
+        details["dtcs"] = [f"{format_dtc(records[i:i + 3])} {format_dtc_status(records[i + 3])}" for i in range(0, len(records) - 3, 4)]
+    elif report in DTC_RECORD_REQUESTS:
+        details["dtc"] = format_dtc(payload[2:5])
+        details["status"] = format_dtc_status(payload[5])
+        if len(payload) > 6:
+            details["records"] = format_data(payload[6:])
+    elif len(payload) > 2:
+        details["data"] = format_data(payload[2:])
+    return details
+
+
+@register(0x22, "ReadDataByIdentifier")
+def read_data_by_identifier(payload: bytes, reply: bool) -> dict:
+    if len(payload) < 3:
+        raise ValueError("data identifier too short")
+    if not reply:
+        return {"dids": [_named(int.from_bytes(payload[i:i + 2], "big"), DATA_IDENTIFIERS, 4) for i in range(1, len(payload) - 1, 2)]}
+    # Data records have no length field, so replies to several identifiers are decoded as one record of the first
+    return {"did": _named(int.from_bytes(payload[1:3], "big"), DATA_IDENTIFIERS, 4), **_data_record(payload[3:])}
+
+
+@register(0x27, "SecurityAccess")
+def security_access(payload: bytes, reply: bool) -> dict:
+    sub_function = payload[1] & 0x7F
+    seed = sub_function % 2 == 1  # odd sub-functions request a seed, even ones send the key of the level below
+    details = {"sub_function": f"{hex_byte(sub_function)} ({'requestSeed' if seed else 'sendKey'})", "level": (sub_function + 1) // 2}
+    if payload[1] & 0x80:
+        details["suppress_positive_response"] = True
+    record = payload[2:]
+    if reply and seed:
+        details["seed"] = format_data(record)
+        if record and not any(record):
+            details["unlocked"] = True  # an all-zero seed means the level is already unlocked
+    elif not reply and record:
+        details["data" if seed else "key"] = format_data(record)
+    return details
+
+
+@register(0x28, "CommunicationControl")
+def communication_control(payload: bytes, reply: bool) -> dict:
+    details = _sub_function(payload, COMMUNICATION_CONTROL_TYPES)
+    if not reply and len(payload) > 2:
+        details["communication_type"] = hex_byte(payload[2])
+    return details
+
+
+@register(0x2E, "WriteDataByIdentifier")
+def write_data_by_identifier(payload: bytes, reply: bool) -> dict:
+    if len(payload) < 3:
+        raise ValueError("data identifier too short")
+    details = {"did": _named(int.from_bytes(payload[1:3], "big"), DATA_IDENTIFIERS, 4)}
+    if not reply:
+        details.update(_data_record(payload[3:]))
+    return details
+
+
+@register(0x31, "RoutineControl")
+def routine_control(payload: bytes, reply: bool) -> dict:
+    if len(payload) < 4:
+        raise ValueError("routine identifier too short")
+    details = _sub_function(payload, ROUTINE_CONTROL_TYPES)
+    details["routine"] = _named(int.from_bytes(payload[2:4], "big"), ROUTINE_IDENTIFIERS, 4)
+    if len(payload) > 4:
+        details["status_record" if reply else "option_record"] = format_data(payload[4:])
+    return details
+
+
+@register(0x34, "RequestDownload")
+def request_download(payload: bytes, reply: bool) -> dict:
+    if reply:
+        length_size = payload[1] >> 4
+        return {"max_block_length": int.from_bytes(payload[2:2 + length_size], "big")}
+    size_length, address_length = payload[2] >> 4, payload[2] & 0xF
+    if len(payload) < 3 + address_length + size_length:
+        raise ValueError("memory address or size too short")
+    return {
+        "data_format": hex_byte(payload[1]),
+        "memory_address": f"0x{int.from_bytes(payload[3:3 + address_length], 'big'):0{2 * address_length}X}",
+        "memory_size": int.from_bytes(payload[3 + address_length:3 + address_length + size_length], "big"),
+    }
+
+
+@register(0x36, "TransferData")
+def transfer_data(payload: bytes, reply: bool) -> dict:
+    details = {"block_sequence_counter": payload[1]}
+    if not reply:
+        details["data_length"] = len(payload) - 2
+    return details
+
+
+@register(0x3E, "TesterPresent")
+def tester_present(payload: bytes, reply: bool) -> dict:
+    return _sub_function(payload, {0x00: "zeroSubFunction"})
+
+
+@register(0x85, "ControlDTCSetting")
+def control_dtc_setting(payload: bytes, reply: bool) -> dict:
+    return _sub_function(payload, DTC_SETTING_TYPES)
+
+
+def read_payloads(file_path: str, locations: Iterable[tuple[int, int]]) -> list[bytes | None]:
+    """Reads payloads from a capture file by (file offset, length); locations with `NO_OFFSET` give None."""
+    payloads = []
+    with open(file_path, "rb") as stream:
+        for offset, length in locations:
+            if offset == NO_OFFSET:
+                payloads.append(None)
+                continue
+            stream.seek(offset)
+            payloads.append(stream.read(length))
+    return payloads
+
+
+def find_payloads(file_path: str, keys: set[tuple[int, int, int]]) -> dict[tuple[int, int, int], bytes]:
+    """Finds payloads by decoding the capture again, e.g. those reassembled from several TCP segments or, in CAN
+    captures, from ISO-TP frames.
+
+    Args:
+        file_path (str): string path to the capture file
+        keys (set): (frame number, ECU address, SID byte) of the wanted messages; the ECU address is the target of a
+            request and the source of a reply
+
+    Returns:
+        dict: payload by key, for the keys found; decoding stops after the last wanted frame
+    """
+    found = {}
+    last = max((number for number, _, _ in keys), default=0)
+    if can_capture_kind(file_path) is not None:
+        for number, _, source, target, payload in iter_isotp_messages(file_path):
+            if number > last:
+                break
+            key = (number, source if payload[0] & UDS_REPLY_FLAG else target, payload[0])
+            if key in keys and key not in found:
+                found[key] = payload
+        return found
+
+    with map_capture(file_path) as buffer:
+        for number, _, source, target, data, start, end in iter_diagnostic_messages(buffer):
+            if number > last:
+                break
+            key = (number, source if data[start] & UDS_REPLY_FLAG else target, data[start])
+            if key in keys and key not in found:
+                found[key] = bytes(data[start:end])
+    return found
+
+
+class PayloadIndex:
+    """Payload locations of the request and final reply of every row of a session log, and their decoded details.
+
+    Rows are positions in the session log, which has one row per pair in the order of `pairs`. The capture file must
+    stay in place; a file that changed since the index was built is not read.
+
+    Args:
+        file_path (str): string path to the capture file
+        pairs (pd.DataFrame): typed request/reply pairs of the capture (see `pipeline.matching.pair_packets`); pairs
+            without the columns of `pipeline.matching.PAYLOAD_DTYPES` are located by decoding the capture again
+    """
+
+    def __init__(self, file_path: str, pairs: pd.DataFrame):
+        self.file_path = file_path
+        self._signature = _file_signature(file_path)
+        n = len(pairs)
+        self.ecu = pairs["ecu_address"].to_numpy()
+        self.request_number = pairs["request_number"].to_numpy()
+        self.request_sid = pairs["request_sid"].to_numpy()
+        self.reply_number = pairs["reply_number"].to_numpy()
+        self.reply_sid = pairs["reply_sid"].to_numpy()
+        self.replied = pairs["replied"].to_numpy()
+        located = "request_offset" in pairs
+        self.request_offset = pairs["request_offset"].to_numpy() if located else np.full(n, NO_OFFSET, dtype=np.int64)
+        self.request_length = pairs["request_length"].to_numpy() if located else np.zeros(n, dtype=np.uint32)
+        self.reply_offset = pairs["reply_offset"].to_numpy() if located else np.full(n, NO_OFFSET, dtype=np.int64)
+        self.reply_length = pairs["reply_length"].to_numpy() if located else np.zeros(n, dtype=np.uint32)
+        self._details = OrderedDict()  # row -> details, least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ecu)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_details"] = OrderedDict()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def payloads(self, rows: Iterable[int]) -> list[tuple[bytes | None, bytes | None]]:
+        """Reads the request and reply payloads of session log rows.
+
+        Args:
+            rows (Iterable[int]): row numbers
+
+        Returns:
+            list: (request payload, reply payload) per row, None for the reply of requests without one
+
+        Raises:
+            OSError: the capture file is missing, or changed since the index was built
+        """
+        rows = [row for row in rows if 0 <= row < len(self)]
+        if _file_signature(self.file_path) != self._signature:
+            raise OSError(f"Capture {self.file_path} changed since it was decoded")
+
+        locations = []
+        for row in rows:
+            locations.append((self.request_offset[row], self.request_length[row]))
+            locations.append((self.reply_offset[row], self.reply_length[row]) if self.replied[row] else (NO_OFFSET, 0))
+        payloads = read_payloads(self.file_path, locations)
+
+        missing = {}  # position in `payloads` -> key for `find_payloads`
+        for i, row in enumerate(rows):
+            if payloads[2 * i] is None:
+                missing[2 * i] = (int(self.request_number[row]), int(self.ecu[row]), int(self.request_sid[row]))
+            if payloads[2 * i + 1] is None and self.replied[row]:
+                missing[2 * i + 1] = (int(self.reply_number[row]), int(self.ecu[row]), int(self.reply_sid[row]))
+        if missing:
+            found = find_payloads(self.file_path, set(missing.values()))
+            for position, key in missing.items():
+                payloads[position] = found.get(key)
+
+        return list(zip(payloads[0::2], payloads[1::2]))
+
+    def details(self, rows: Iterable[int]) -> list[dict]:
+        """Decodes the request and reply payloads of session log rows, see `decode_payload`. Details are memoized.
+
+        Args:
+            rows (Iterable[int]): row numbers; rows outside the session log are skipped
+
+        Returns:
+            list: 'row', 'request' and 'reply' (decoded details, None if there is no reply or the payload was not
+                found) per row. The dicts are shared with the memo and must not be modified.
+
+        Raises:
+            OSError: the capture file is missing, or changed since the index was built
+        """
+        rows = [int(row) for row in rows if 0 <= row < len(self)]
+        with self._lock:
+            known = {row: self._details[row] for row in rows if row in self._details}
+            for row in known:
+                self._details.move_to_end(row)
+
+        missing = [row for row in rows if row not in known]
+        if missing:
+            for row, (request, reply) in zip(missing, self.payloads(missing)):
+                known[row] = {
+                    "row": row,
+                    "request": None if request is None else decode_payload(request),
+                    "reply": None if reply is None else decode_payload(reply),
+                }
+            with self._lock:
+                for row in missing:
+                    self._details[row] = known[row]
+                while len(self._details) > MAX_DETAIL_ROWS:
+                    self._details.popitem(last=False)
+
+        return [known[row] for row in rows]
+
+
+def _file_signature(file_path: str) -> tuple[int, int]:
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
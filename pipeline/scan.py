@@ -0,0 +1,239 @@
+"""Columnar scan of DoIP/UDS captures.
+
+`scan_pcap_file` memory-maps the capture and writes the fields of every UDS message straight into preallocated
+NumPy arrays, so no per-packet Python dicts or hex strings are built and peak memory grows with the number of UDS
+messages rather than with the size of the capture.
+
+Only the SID, NRC and sub-function byte of a message are decoded. Its payload is located by file offset and length
+instead, so `pipeline.payloads` can read and decode the full payload of selected rows later, without slowing the scan
+down.
+
+Capture times are UTC in the typed tables (packets and pairs) and local time in everything shown to people: the string
+representation of `format_uds_packets` and the session log (see `utils.describe_request_reply`), like the
+`sniff_time` of the original pyshark decoder. `to_local_time` and `to_utc_time` convert between the two.
+"""
+import os
+from datetime import datetime
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from .doip import map_capture, iter_diagnostic_messages, UDS_NEGATIVE_RESPONSE, UDS_REPLY_FLAG
+
+# pylint: disable=C0301
+
+NO_ERROR = 0  # 0x00 is not a valid NRC, so it marks rows without a negative response code
+NO_OFFSET = -1  # payload not stored contiguously in the capture, see `pipeline.payloads`
+
+UDS_PACKET_DTYPES = {
+    'number': np.uint32,  # frame number in the capture
+    'timestamp': 'datetime64[ns]',  # capture time (UTC)
+    'source': np.uint16,  # DoIP source address
+    'target': np.uint16,  # DoIP target address
+    'request': np.bool_,  # True if request, False if reply
+    'sid': np.uint8,  # raw SID byte, i.e. 0x7F for negative replies
+    'error': np.uint8,  # NRC of negative replies, NO_ERROR otherwise
+    'subfunction': np.uint8,  # second payload byte (sub-function of requests, echoed by positive replies), 0 if none
+    'payload_offset': np.int64,  # file offset of the UDS payload, NO_OFFSET if it was reassembled from several TCP segments
+    'payload_length': np.uint32,  # length of the UDS payload in bytes
+}
+
+UTC_OFFSET_STEP = 900  # seconds; time zones change their UTC offset on quarter-hour boundaries only
+PROGRESS_INTERVAL = 65536  # UDS messages between progress reports
+PARALLEL_MIN_BYTES = 256 * 1024 * 1024  # smaller captures decode faster than a process pool starts
+
+HEX_BYTES = np.array([f"0x{code:02X}" for code in range(256)], dtype=object)
+
+
+class UdsPacketArrays:
+    """Growable set of typed column arrays for decoded UDS messages. Capacity doubles when full, so appending is
+    amortised O(1) and no per-row Python objects are retained."""
+
+    def __init__(self, capacity: int = 4096):
+        self.size = 0
+        self.number = np.empty(capacity, dtype=np.uint32)
+        self.timestamp = np.empty(capacity, dtype=np.int64)
+        self.source = np.empty(capacity, dtype=np.uint16)
+        self.target = np.empty(capacity, dtype=np.uint16)
+        self.sid = np.empty(capacity, dtype=np.uint8)
+        self.error = np.empty(capacity, dtype=np.uint8)
+        self.subfunction = np.empty(capacity, dtype=np.uint8)
+        self.offset = np.empty(capacity, dtype=np.int64)
+        self.length = np.empty(capacity, dtype=np.uint32)
+
+    def _grow(self) -> None:
+        """Doubles the capacity of every column array."""
+        for name in ('number', 'timestamp', 'source', 'target', 'sid', 'error', 'subfunction', 'offset', 'length'):
+            column = getattr(self, name)
+            grown = np.empty(2 * len(column), dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def append(self, number: int, timestamp: int, source: int, target: int, sid: int, error: int, subfunction: int, offset: int, length: int) -> None:
+        """Appends one UDS message, with its second payload byte and the file offset (or `NO_OFFSET`) and length of its
+        payload."""
+        if self.size == len(self.number):
+            self._grow()
+        i = self.size
+        self.number[i] = number
+        self.timestamp[i] = timestamp
+        self.source[i] = source
+        self.target[i] = target
+        self.sid[i] = sid
+        self.error[i] = error
+        self.subfunction[i] = subfunction
+        self.offset[i] = offset
+        self.length[i] = length
+        self.size = i + 1
+
+    def to_frame(self) -> pd.DataFrame:
+        """Returns the collected messages as a typed DataFrame (see `UDS_PACKET_DTYPES`)."""
+        n = self.size
+        sid = self.sid[:n]
+        return pd.DataFrame({
+            'number': self.number[:n],
+            'timestamp': self.timestamp[:n].view('datetime64[ns]'),
+            'source': self.source[:n],
+            'target': self.target[:n],
+            'request': (sid & UDS_REPLY_FLAG) == 0,  # bit 6 of the SID is set for both positive and negative replies
+            'sid': sid,
+            'error': self.error[:n],
+            'subfunction': self.subfunction[:n],
+            'payload_offset': self.offset[:n],
+            'payload_length': self.length[:n],
+        }, copy=False)
+
+
+def scan_pcap_file(file_path: str, progress: Callable[..., None] | None = None, workers: int = 1) -> pd.DataFrame:
+    """Scans a pcap/pcapng file into a typed, columnar DataFrame of UDS packets. CAN captures (candump logs and
+    SocketCAN pcap files) are handed to `pipeline.isotp.scan_can_log`.
+
+    Args:
+        file_path (str): string path to the capture file
+        progress (Callable | None): called as `progress(packets=n)` every `PROGRESS_INTERVAL` messages and at the end
+        workers (int): number of processes decoding captures of at least `PARALLEL_MIN_BYTES` in parallel, see
+            `pipeline.parallel.scan_pcap_file_parallel`. Defaults to 1 (serial).
+
+    Returns:
+        pd.DataFrame: one row per UDS message in capture order, with the columns and dtypes of `UDS_PACKET_DTYPES`
+    """
+    from .isotp import can_capture_kind, scan_can_log  # imports this module
+    if can_capture_kind(file_path) is not None:
+        return scan_can_log(file_path, progress=progress)
+
+    if workers > 1 and os.path.getsize(file_path) >= PARALLEL_MIN_BYTES:
+        from .parallel import scan_pcap_file_parallel  # imports this module
+        return scan_pcap_file_parallel(file_path, workers, progress=progress)
+
+    packets = UdsPacketArrays()
+    append = packets.append
+
+    with map_capture(file_path) as buffer:
+        for number, timestamp, source, target, data, start, end in iter_diagnostic_messages(buffer):
+            sid = data[start]
+            error = data[start + 2] if sid == UDS_NEGATIVE_RESPONSE and end - start > 2 else NO_ERROR
+            append(number, timestamp, source, target, sid, error, data[start + 1] if end - start > 1 else 0, start if data is buffer else NO_OFFSET, end - start)
+            if progress is not None and not packets.size % PROGRESS_INTERVAL:
+                progress(packets=packets.size)
+
+    if progress is not None:
+        progress(packets=packets.size)
+
+    return packets.to_frame()
+
+
+def format_uds_packets(packets: pd.DataFrame) -> pd.DataFrame:
+    """Converts a typed scan (see `scan_pcap_file`) into the string representation used by the CSV export and the
+    original pyshark decoder: hex codes such as '0x62', addresses such as '0x0e80' and local-time timestamps.
+
+    Args:
+        packets (pd.DataFrame): typed UDS packets
+
+    Returns:
+        pd.DataFrame: DataFrame with the same columns, formatted as strings ('error' is None where no NRC is present)
+    """
+    sid = packets['sid'].to_numpy()
+    error = packets['error'].to_numpy()
+
+    return pd.DataFrame({
+        'number': packets['number'].to_numpy().astype(np.int64),
+        'timestamp': _format_local_timestamps(packets['timestamp'].to_numpy().view(np.int64)),
+        'source': format_addresses(packets['source'].to_numpy()),
+        'target': format_addresses(packets['target'].to_numpy()),
+        'request': packets['request'].to_numpy(),
+        'sid': HEX_BYTES[sid],
+        'error': np.where(error == NO_ERROR, None, HEX_BYTES[error]),
+    })
+
+
+def parse_uds_packets(packets: pd.DataFrame) -> pd.DataFrame:
+    """Converts UDS packets in the string representation (see `format_uds_packets`) back into the typed columns of
+    `scan_pcap_file`, sorted by packet number. Typed input is only sorted. Only the distinct hex strings are parsed.
+
+    Args:
+        packets (pd.DataFrame): UDS packets, typed or formatted as strings
+
+    Returns:
+        pd.DataFrame: typed UDS packets with the columns of `UDS_PACKET_DTYPES` except 'subfunction', which the
+            string representation does not have (string timestamps are local times and converted to UTC, NaT if
+            unparseable)
+    """
+    packets = packets.sort_values(by='number', kind='stable').reset_index(drop=True)
+    if packets['sid'].dtype != object:
+        return packets
+
+    return pd.DataFrame({
+        'number': packets['number'].astype(np.int64).to_numpy().astype(np.uint32),
+        'timestamp': to_utc_time(pd.to_datetime(packets['timestamp'], errors='coerce').to_numpy(dtype='datetime64[ns]')),
+        'source': _parse_hex(packets['source']).astype(np.uint16),
+        'target': _parse_hex(packets['target']).astype(np.uint16),
+        'request': packets['request'].to_numpy(dtype=bool),
+        'sid': _parse_hex(packets['sid']).astype(np.uint8),
+        'error': _parse_hex(packets['error']).astype(np.uint8),
+        'payload_offset': np.full(len(packets), NO_OFFSET, dtype=np.int64),  # not part of the string representation
+        'payload_length': np.zeros(len(packets), dtype=np.uint32),
+    })
+
+
+def _parse_hex(values: pd.Series) -> np.ndarray:
+    """Parses hex strings such as '0x7F' into integers; missing values become 0."""
+    codes = {value: int(value, 16) for value in values.dropna().unique()}
+    return values.map(codes).fillna(0).to_numpy(dtype=np.int64)
+
+
+def format_addresses(addresses: np.ndarray) -> np.ndarray:
+    """Formats DoIP addresses as '0x0e80'. Only the distinct addresses are formatted in Python."""
+    unique, inverse = np.unique(addresses, return_inverse=True)
+    return np.array([f"0x{address:04x}" for address in unique], dtype=object)[inverse]
+
+
+def to_local_time(timestamps: np.ndarray) -> np.ndarray:
+    """Converts UTC timestamps (datetime64[ns]) into the local time of this process, as naive datetime64[ns]. NaT is
+    kept. The UTC offset is looked up once per quarter hour of the capture, so daylight-saving changes within a
+    capture are honoured."""
+    utc = np.asarray(timestamps, dtype='datetime64[ns]').view(np.int64)
+    return np.where(np.isnat(timestamps), utc, utc + _utc_offsets(utc)).view('datetime64[ns]')
+
+
+def to_utc_time(timestamps: np.ndarray) -> np.ndarray:
+    """Converts naive local timestamps (datetime64[ns], see `to_local_time`) back into UTC. NaT is kept; a local time
+    that occurs twice when the clocks go back is taken as the earlier one."""
+    local = np.asarray(timestamps, dtype='datetime64[ns]').view(np.int64)
+    guess = local - _utc_offsets(local)  # offset of the local time read as UTC, off by up to a day's change
+    return np.where(np.isnat(timestamps), local, local - _utc_offsets(guess)).view('datetime64[ns]')
+
+
+def _utc_offsets(utc: np.ndarray) -> np.ndarray:
+    """Returns the UTC offset of the local time zone at ns-since-epoch timestamps, in ns. NaT gets 0."""
+    valid = utc != np.iinfo(np.int64).min
+    steps = np.where(valid, utc, 0) // (UTC_OFFSET_STEP * 1_000_000_000)
+    unique, inverse = np.unique(steps, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(int(step) * UTC_OFFSET_STEP).astimezone().utcoffset().total_seconds() for step in unique], dtype=np.int64)
+    return np.where(valid, offsets[inverse.reshape(-1)] * 1_000_000_000, 0)
+
+
+def _format_local_timestamps(timestamps: np.ndarray) -> np.ndarray:
+    """Formats ns-since-epoch timestamps in local time as 'YYYY-MM-DD HH:MM:SS.ffffff', see `to_local_time`."""
+    local = (to_local_time(timestamps.view('datetime64[ns]')).view(np.int64) // 1000).astype('datetime64[us]')
+    return np.char.replace(np.datetime_as_string(local, unit='us'), 'T', ' ').astype(object)
@@ -0,0 +1,179 @@
+"""In-process store of the parsed session logs of each chat session.
+
+The web app puts the typed session log of an upload into a `SessionStore` once, and the agent tools read it from
+there instead of re-reading and re-parsing a CSV file on every call. Stored frames are frozen: their column arrays are
+marked read-only, and `get` hands out shallow copies, so a tool can add columns or reorder rows of its view but any
+in-place write to the shared data raises `ValueError`. Each session log can be stored with the `PayloadIndex` of its
+capture (see `pipeline.payloads`), for decoding the full payloads of selected rows.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .payloads import PayloadIndex, format_details
+
+# pylint: disable=C0301
+
+MAX_SESSIONS = 64
+MAX_CAPTURES_PER_SESSION = 4
+
+
+def freeze(frame: pd.DataFrame) -> pd.DataFrame:
+    """Returns a copy of `frame` whose column arrays are read-only.
+
+    Args:
+        frame (pd.DataFrame): DataFrame with NumPy-backed columns
+
+    Returns:
+        pd.DataFrame: read-only DataFrame with the same columns and a default index
+    """
+    columns = {}
+    for name in frame.columns:
+        values = frame[name].to_numpy(copy=True)
+        values.flags.writeable = False
+        columns[name] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+class SessionStore:
+    """Session logs by chat session and capture name, least recently used sessions evicted first.
+
+    Args:
+        max_sessions (int): sessions kept in memory
+        max_captures (int): captures kept per session, the oldest upload is dropped first
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, max_captures: int = MAX_CAPTURES_PER_SESSION):
+        self.max_sessions = max_sessions
+        self.max_captures = max_captures
+        self._sessions = OrderedDict()  # session id -> OrderedDict(capture name -> frozen frame), oldest first
+        self._digests = {}  # id of a frozen frame -> content digest
+        self._payloads = {}  # id of a frozen frame -> PayloadIndex of its capture
+        self._lock = threading.Lock()
+
+    def _forget(self, frame: pd.DataFrame) -> None:
+        self._digests.pop(id(frame), None)
+        self._payloads.pop(id(frame), None)
+
+    def put(self, session_id: str, capture: str, session_log: pd.DataFrame, payloads: PayloadIndex | None = None) -> None:
+        """Stores the session log of a capture, and optionally its payload index, which becomes the active capture of
+        the session."""
+        frozen = freeze(session_log)
+        digest = hashlib.blake2b(pd.util.hash_pandas_object(frozen, index=False).to_numpy().tobytes(), digest_size=16).hexdigest()
+        with self._lock:
+            self._digests[id(frozen)] = digest
+            if payloads is not None:
+                self._payloads[id(frozen)] = payloads
+            captures = self._sessions.setdefault(session_id, OrderedDict())
+            if capture in captures:
+                self._forget(captures.pop(capture))
+            captures[capture] = frozen
+            while len(captures) > self.max_captures:
+                self._forget(captures.popitem(last=False)[1])
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                for dropped in self._sessions.popitem(last=False)[1].values():
+                    self._forget(dropped)
+
+    def get(self, session_id: str, capture: str | None = None) -> pd.DataFrame | None:
+        """Returns a read-only view of the session log of a capture, by default the most recently uploaded one, or
+        None if the session has no such capture."""
+        with self._lock:
+            captures = self._sessions.get(session_id)
+            if not captures:
+                return None
+            self._sessions.move_to_end(session_id)
+            frame = captures.get(capture) if capture is not None else next(reversed(captures.values()))
+        return None if frame is None else frame.copy(deep=False)
+
+    def payloads(self, session_id: str, capture: str | None = None) -> PayloadIndex | None:
+        """Returns the payload index of a capture, by default the active one, or None if none was stored with it."""
+        with self._lock:
+            captures = self._sessions.get(session_id)
+            if not captures:
+                return None
+            frame = captures.get(capture) if capture is not None else next(reversed(captures.values()))
+            return None if frame is None else self._payloads.get(id(frame))
+
+    def captures(self, session_id: str) -> list[str]:
+        """Returns the names of the stored captures of a session, the active one last."""
+        with self._lock:
+            return list(self._sessions.get(session_id, ()))
+
+    def digest(self, session_id: str) -> str | None:
+        """Returns a content hash of the active session log of a session, or None if it has none."""
+        with self._lock:
+            captures = self._sessions.get(session_id)
+            return self._digests.get(id(next(reversed(captures.values())))) if captures else None
+
+    def drop(self, session_id: str) -> None:
+        """Forgets all captures of a session."""
+        with self._lock:
+            for dropped in self._sessions.pop(session_id, {}).values():
+                self._forget(dropped)
+
+
+def filter_session_log(session_log: pd.DataFrame, ecu: str | None = None, sid: str | None = None, error: str | None = None) -> pd.DataFrame:
+    """Selects the pairs of a session log matching all given filters (case-insensitive).
+
+    Args:
+        session_log (pd.DataFrame): session log, see `utils.combine_request_reply`
+        ecu (str | None): ECU address, e.g. '0x0E80'
+        sid (str | None): request or reply SID, e.g. '0x22'
+        error (str | None): error column value, e.g. '0x31' or 'p6 parameter timout', or '*' for any error
+
+    Returns:
+        pd.DataFrame: matching rows, with their row numbers in the full log as index
+    """
+    mask = np.ones(len(session_log), bool)
+    if ecu:
+        mask &= session_log['ecu_address'].astype(str).str.lower().to_numpy() == ecu.strip().lower()
+    if sid:
+        sid = sid.strip().lower()
+        mask &= (session_log['request_sid'].astype(str).str.lower().to_numpy() == sid) | (session_log['reply_sid'].astype(str).str.lower().to_numpy() == sid)
+    if error == '*':
+        mask &= session_log['error'].to_numpy() != 'No error'
+    elif error:
+        mask &= session_log['error'].astype(str).str.lower().to_numpy() == error.strip().lower()
+    return session_log[mask]
+
+
+def session_log_window(session_log: pd.DataFrame, offset: int = 0, limit: int = 100, payloads: PayloadIndex | None = None, **filters) -> dict:
+    """Returns a window of rows of a (filtered) session log in a JSON-serialisable form, for paginated rendering.
+
+    Args:
+        session_log (pd.DataFrame): session log, see `utils.combine_request_reply`
+        offset (int): index of the first row within the filtered rows
+        limit (int): maximum number of rows
+        payloads (PayloadIndex | None): payload index of the capture; if given, the decoded request and reply payloads
+            of the window are added as 'request_details' and 'reply_details' (see `pipeline.payloads.format_details`)
+        **filters: `ecu`, `sid` and `error` filters, see `filter_session_log`
+
+    Returns:
+        dict: 'total' (number of filtered rows), 'offset', 'columns' (including 'row', the row number in the full log)
+            and 'rows' (lists of values; timestamps as strings, missing values as None)
+
+    Raises:
+        OSError: `payloads` is given and its capture file is missing or changed
+    """
+    selected = filter_session_log(session_log, **filters)
+    window = selected.iloc[offset:offset + limit]
+    columns = {'row': window.index.to_numpy()}
+    for name in window.columns:
+        column = window[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            column = column.dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+        columns[name] = column.astype(object).where(column.notnull(), None).to_numpy()
+    if payloads is not None:
+        details = payloads.details(columns['row'])
+        columns['request_details'] = np.array([format_details(row['request']) or None for row in details], dtype=object)
+        columns['reply_details'] = np.array([format_details(row['reply']) or None for row in details], dtype=object)
+    return {
+        'total': len(selected),
+        'offset': offset,
+        'columns': list(columns),
+        'rows': [list(row) for row in zip(*(values.tolist() for values in columns.values()))],
+    }
@@ -0,0 +1,299 @@
+"""Incremental ingestion of live DoIP/UDS captures.
+
+`StreamingSession` follows a capture that is still being written (a single growing pcap/pcapng file, or the
+newest file of a ring-buffer directory as written by `dumpcap -b`), decodes only the bytes appended since the last
+poll and pairs requests with replies in place, per ECU. Each poll returns the pairs completed since the previous
+one; requests without a reply are reported as timeouts as soon as their deadline has passed.
+
+Pairing follows `pipeline.matching`: a positive reply goes to the oldest open request of its ECU with the matching
+SID, a negative reply (0x7F) to the oldest open request of its ECU, and response pending replies (NRC 0x78) restart
+the deadline of the latest request to their ECU. Without a deadline this gives the same pairs as the batch matcher;
+with one, a reply arriving after its request has timed out is no longer paired with it.
+
+    python -m pipeline.streaming /path/to/capture.pcap --session-log uploads/live.csv --timeout 5
+"""
+import argparse
+import os
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from .doip import RecordReader, DiagnosticDecoder, UDS_NEGATIVE_RESPONSE, UDS_REPLY_FLAG, UDS_RESPONSE_PENDING
+from .matching import PAIR_DTYPES
+from .timing import DEFAULT_TIMING
+
+# pylint: disable=C0301
+
+DEFAULT_TIMEOUT = DEFAULT_TIMING.p6  # seconds
+CAPTURE_EXTENSIONS = ('.pcap', '.pcapng')
+READ_CHUNK_SIZE = 64 * 1024 * 1024
+NOT_A_TIME = np.iinfo(np.int64).min  # NaT as int64
+
+
+class CaptureFollower:
+    """Reads UDS messages from a capture file as it grows, or from the files of a ring-buffer directory in name
+    order (dumpcap numbers its ring-buffer files, so name order is write order). Frame numbers continue across
+    files."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._reader = RecordReader()
+        self._decoder = DiagnosticDecoder()
+        self._number_offset = 0
+
+    def _files(self) -> list[str]:
+        """Lists the capture files to follow, oldest first."""
+        if not os.path.isdir(self.path):
+            return [self.path]
+        return sorted(os.path.join(self.path, f) for f in os.listdir(self.path) if f.lower().endswith(CAPTURE_EXTENSIONS))
+
+    def _switch_to(self, file_path: str) -> None:
+        """Starts reading a new file, with fresh format state and frame numbers continuing the previous file."""
+        self._number_offset += self._reader.number
+        self._file = file_path
+        self._reader = RecordReader()
+        self._decoder = DiagnosticDecoder()
+
+    def read(self) -> list[tuple[int, int, int, int, int, int]]:
+        """Reads the UDS messages appended since the previous call.
+
+        Returns:
+            list: (frame number, timestamp in ns, source, target, SID, NRC or 0) per message, in capture order
+        """
+        messages = []
+        files = self._files()
+        if self._file is None and files:
+            self._file = files[0]
+
+        while self._file is not None:
+            messages += self._read_file()
+            newer = [f for f in files if f > self._file] if self._file in files else files
+            if not newer:
+                break
+            # A newer ring-buffer file exists, so the current one is complete and has just been read to the end
+            self._switch_to(newer[0])
+
+        return messages
+
+    def _read_file(self) -> list[tuple[int, int, int, int, int, int]]:
+        """Decodes the complete records appended to the current file since the last read."""
+        messages = []
+        try:
+            size = os.path.getsize(self._file)
+        except FileNotFoundError:  # ring-buffer file already rotated away
+            return messages
+        if size < self._reader.position:  # file was truncated or replaced, start over
+            self._switch_to(self._file)
+
+        with open(self._file, 'rb') as stream:
+            while self._reader.position < size:
+                stream.seek(self._reader.position)
+                chunk = stream.read(min(READ_CHUNK_SIZE, size - self._reader.position))
+                position = self._reader.position
+
+                for number, linktype, timestamp, start, end in self._reader.records(chunk):
+                    for source, target, data, message_start, message_end in self._decoder.decode(chunk, linktype, start, end):
+                        sid = data[message_start]
+                        error = data[message_start + 2] if sid == UDS_NEGATIVE_RESPONSE and message_end - message_start > 2 else 0
+                        messages.append((self._number_offset + number, timestamp, source, target, sid, error))
+
+                if self._reader.position == position:
+                    break  # only an incomplete record is left
+
+        return messages
+
+
+class _OpenRequest:
+    """A request waiting for its final reply."""
+
+    __slots__ = ('number', 'timestamp', 'ecu', 'sid', 'is_open', 'last_response', 'pending_responses',
+                 'first_response', 'max_pending_interval')
+
+    def __init__(self, number: int, timestamp: int, ecu: int, sid: int):
+        self.number = number
+        self.timestamp = timestamp
+        self.ecu = ecu
+        self.sid = sid
+        self.is_open = True
+        self.last_response = timestamp  # the deadline runs from the request or its latest response pending reply
+        self.pending_responses = 0
+        self.first_response = NOT_A_TIME
+        self.max_pending_interval = NOT_A_TIME
+
+    def pending(self, timestamp: int) -> None:
+        """Records a response pending reply."""
+        self._responded(timestamp)
+        self.pending_responses += 1
+        self.last_response = timestamp
+
+    def close(self, number: int = 0, timestamp: int = NOT_A_TIME, sid: int = 0, error: int = 0) -> tuple:
+        """Closes the request with its final reply (a timeout if no timestamp) and returns the pair tuple."""
+        self.is_open = False
+        replied = timestamp != NOT_A_TIME
+        if replied:
+            self._responded(timestamp)
+        return (self.number, self.timestamp, self.ecu, self.sid, replied, number, timestamp, sid, error,
+                self.pending_responses, self.first_response if replied or self.pending_responses else NOT_A_TIME,
+                self.max_pending_interval)
+
+    def _responded(self, timestamp: int) -> None:
+        if self.first_response == NOT_A_TIME:
+            self.first_response = timestamp
+        if self.pending_responses:
+            self.max_pending_interval = max(self.max_pending_interval, timestamp - self.last_response)
+
+
+class IncrementalMatcher:
+    """Request/reply pairing state, updated in place one UDS message at a time.
+
+    Open requests are kept in arrival order per ECU (for negative replies) and per (ECU, SID) (for positive
+    replies), and in deadline order for timeouts; a response pending reply (NRC 0x78) restarts the deadline of the
+    latest request to its ECU. Entries are closed lazily, so every message costs amortised O(1).
+    """
+
+    def __init__(self, timeout: float | None = DEFAULT_TIMEOUT):
+        self.timeout = None if timeout is None else int(timeout * 1_000_000_000)
+        self.clock = 0  # latest capture timestamp seen, in ns
+        self._deadlines = deque()  # (start of the deadline, request) in time order, stale when the deadline restarted
+        self._by_ecu = {}
+        self._by_sid = {}
+        self._latest = {}  # latest request per ECU, owner of its response pending replies
+
+    def add(self, number: int, timestamp: int, source: int, target: int, sid: int, error: int) -> list[tuple]:
+        """Adds one UDS message and returns the pairs it completes (including requests whose deadline it passes).
+
+        Returns:
+            list: pairs as tuples in the column order of `pipeline.matching.PAIR_DTYPES`
+        """
+        completed = self.expire(timestamp)
+        self.clock = max(self.clock, timestamp)
+
+        if not sid & UDS_REPLY_FLAG:  # request
+            entry = _OpenRequest(number, timestamp, target, sid)
+            self._deadlines.append((timestamp, entry))
+            self._by_ecu.setdefault(target, deque()).append(entry)
+            self._by_sid.setdefault((target, sid), deque()).append(entry)
+            self._latest[target] = entry
+            return completed
+
+        if sid == UDS_NEGATIVE_RESPONSE and error == UDS_RESPONSE_PENDING:
+            entry = self._latest.get(source)
+            if entry is not None and entry.is_open:
+                entry.pending(timestamp)
+                self._deadlines.append((timestamp, entry))
+            return completed
+
+        if sid == UDS_NEGATIVE_RESPONSE:
+            candidates = self._by_ecu.get(source)
+        else:
+            candidates = self._by_sid.get((source, sid - UDS_REPLY_FLAG))
+
+        while candidates and not candidates[0].is_open:
+            candidates.popleft()
+        if candidates:
+            completed.append(candidates.popleft().close(number, timestamp, sid, error))
+
+        return completed
+
+    def expire(self, now: int) -> list[tuple]:
+        """Closes the open requests whose deadline has passed at capture time `now` (in ns) as timeouts."""
+        if self.timeout is None:
+            return []
+        return self._close_open(now - self.timeout)
+
+    def flush(self) -> list[tuple]:
+        """Closes every open request as a timeout, e.g. at the end of a capture."""
+        return self._close_open(None)
+
+    def _close_open(self, started_before: int | None) -> list[tuple]:
+        """Closes open requests whose deadline started before the given capture time (all if None) as timeouts."""
+        timeouts = []
+        while self._deadlines and (started_before is None or self._deadlines[0][0] < started_before):
+            started, entry = self._deadlines.popleft()
+            if entry.is_open and started == entry.last_response:
+                timeouts.append(entry.close())
+        if started_before is None:
+            timeouts.sort()  # deadlines restarted by pending replies are not in request order
+        return timeouts
+
+
+class StreamingSession:
+    """Follows a live capture and pairs its UDS requests and replies incrementally.
+
+    Args:
+        path (str): growing capture file, or ring-buffer directory
+        timeout (float | None): seconds after which an unanswered request is reported as a timeout (P6 deadline).
+            None waits until `close`, like batch processing does.
+    """
+
+    def __init__(self, path: str, timeout: float | None = DEFAULT_TIMEOUT):
+        self.follower = CaptureFollower(path)
+        self.matcher = IncrementalMatcher(timeout)
+        self._last_packet = time.monotonic()
+
+    def poll(self) -> pd.DataFrame:
+        """Decodes new packets and returns the pairs completed since the previous poll.
+
+        When no new packets arrive, the capture clock is advanced by the wall time elapsed since the last packet,
+        so requests still time out while the capture is idle.
+
+        Returns:
+            pd.DataFrame: newly completed pairs, with the columns of `pipeline.matching.PAIR_DTYPES`
+        """
+        pairs = []
+        messages = self.follower.read()
+        for message in messages:
+            pairs += self.matcher.add(*message)
+
+        now = time.monotonic()
+        if messages:
+            self._last_packet = now
+        elif self.matcher.clock:
+            pairs += self.matcher.expire(self.matcher.clock + int((now - self._last_packet) * 1_000_000_000))
+
+        return pairs_to_frame(pairs)
+
+    def close(self) -> pd.DataFrame:
+        """Reads whatever is left and reports all requests still open as timeouts."""
+        pairs = [pair for message in self.follower.read() for pair in self.matcher.add(*message)]
+        return pairs_to_frame(pairs + self.matcher.flush())
+
+
+def pairs_to_frame(pairs: list[tuple]) -> pd.DataFrame:
+    """Converts pair tuples (see `IncrementalMatcher.add`) into a typed DataFrame."""
+    columns = zip(*pairs) if pairs else [()] * len(PAIR_DTYPES)
+    return pd.DataFrame({
+        name: np.array(values, dtype=np.int64).view(dtype) if str(dtype).endswith('[ns]') else np.array(values, dtype=dtype)
+        for (name, dtype), values in zip(PAIR_DTYPES.items(), columns)
+    })
+
+
+if __name__ == '__main__':
+
+    from utils import describe_request_reply  # pylint: disable=C0415
+
+    parser = argparse.ArgumentParser(description="Follow a live DoIP capture and append completed request/reply pairs to a session log.")
+    parser.add_argument('path', help="growing pcap/pcapng file, or ring-buffer directory")
+    parser.add_argument('--session-log', default=os.path.join('uploads', 'live.csv'), help="CSV file the pairs are appended to")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help="seconds before an unanswered request is reported as a timeout")
+    parser.add_argument('--interval', type=float, default=1.0, help="seconds between polls")
+    args = parser.parse_args()
+
+    session = StreamingSession(args.path, args.timeout)
+
+    def append(pairs: pd.DataFrame) -> None:
+        """Appends newly completed pairs to the session log."""
+        if len(pairs):
+            describe_request_reply(pairs, DEFAULT_TIMING._replace(p6=args.timeout)).to_csv(args.session_log, mode='a', index=False,
+                                                 header=not os.path.exists(args.session_log))
+            print(f"{len(pairs)} new pairs ({(~pairs['replied']).sum()} timeouts)")
+
+    try:
+        while True:
+            append(session.poll())
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        append(session.close())
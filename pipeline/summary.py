@@ -0,0 +1,291 @@
+"""Token-budgeted summaries of session logs for the LLM.
+
+A session log (see `utils.combine_request_reply`) has one row per request/reply pair, which for long sessions is far
+more than fits into a prompt. `summarize_session_log` produces a deterministic digest instead:
+
+- aggregates per ECU and per NRC (negative response code), those with the most problems first and at most
+  `MAX_AGGREGATE_LINES` of each (the rest are counted in a "... N more" line);
+- a timeline in which runs of identical, unremarkable pairs are collapsed into one line
+  (e.g. "#12-423 ECU '0x0E80': SID 0x3E (TesterPresent) -> SID 0x7E (...) x412 // No error // ... // timing OK");
+- every problem pair (negative reply, timeout or timing violation) verbatim, with `context` pairs before and after.
+
+Lines are kept in priority order (aggregates, problems, their context, latency percentiles, collapsed runs) until the
+token budget is used up; the per-ECU and per-NRC lines take at most half of it, and omitted timeline ranges are
+marked. The summary never exceeds the budget (as estimated by `estimate_tokens`). Every timeline line starts with the row numbers of its
+pairs, which `format_session_log_rows` prints in full for drill-down.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from .codes import CodeIndex
+from .timing import format_latency_summary
+
+# pylint: disable=C0301
+
+DEFAULT_TOKEN_BUDGET = 4000
+DEFAULT_CONTEXT = 2  # pairs shown before and after each problem pair
+CHARS_PER_TOKEN = 4  # rough estimate for English text and hex codes with GPT tokenizers
+RUN_KEY = ['ecu_address', 'request_sid', 'reply_sid', 'error', 'timing', 'session', 'security']
+MAX_AGGREGATE_LINES = 10  # ECUs and NRCs listed in the aggregates, each
+MAX_NRC_ECUS = 5  # ECUs listed per NRC
+
+# Priorities of the summary parts, lower is kept first
+_AGGREGATES, _PROBLEMS, _CONTEXT, _LATENCY, _RUNS = range(5)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of LLM tokens of a text from its length."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def format_pair_lines(session_log: pd.DataFrame) -> list[str]:
+    """Formats every request/reply pair of a session log as one line of text.
+
+    Args:
+        session_log (pd.DataFrame): session log, see `utils.combine_request_reply`. Logs written before timing analysis
+            or session tracking were added (no 'latency_ms' or 'session' column) are formatted without them.
+
+    Returns:
+        list[str]: one line per pair, without line breaks
+    """
+    lines = [
+        f"ECU '{ecu}': SID {request_sid} ({request_description}) -> SID {reply_sid} ({reply_description}) // {error}"
+        for ecu, request_sid, request_description, reply_sid, reply_description, error in zip(
+            session_log['ecu_address'], session_log['request_sid'], session_log['request_description'],
+            session_log['reply_sid'], session_log['reply_description'], session_log['error'])
+    ]
+    if 'latency_ms' in session_log.columns:
+        lines = [
+            f"{line} // {'no reply' if pd.isnull(latency) else f'{latency:.1f} ms'}, {pending} pending, timing {timing}"
+            for line, latency, pending, timing in zip(lines, session_log['latency_ms'], session_log['pending_responses'], session_log['timing'])
+        ]
+    if 'session' in session_log.columns:
+        lines = [
+            line if session is None else f"{line} // {session} session, {security}" + (f" // cause: {hint}" if hint else '')
+            for line, session, security, hint in zip(lines, session_log['session'], session_log['security'], session_log['state_hint'])
+        ]
+    return lines
+
+
+def format_session_log(session_log: pd.DataFrame) -> str:
+    """Formats a whole session log as text: one line per pair, followed by the latency percentiles.
+
+    Args:
+        session_log (pd.DataFrame): session log, see `utils.combine_request_reply`
+
+    Returns:
+        str: string representation of the session log
+    """
+    text = ''.join(f"{line}\n" for line in format_pair_lines(session_log))
+    if 'latency_ms' in session_log.columns and len(session_log):
+        text += "\n" + format_latency_summary(session_log)
+    return text
+
+
+def format_session_log_rows(session_log: pd.DataFrame, start: int = 0, stop: int | None = None, ecu: str | None = None) -> str:
+    """Formats a range of rows of a session log in full, each line prefixed with its row number. This is the
+    drill-down into the row ranges referenced by `summarize_session_log`.
+
+    Args:
+        session_log (pd.DataFrame): session log, see `utils.combine_request_reply`
+        start (int): first row number
+        stop (int | None): row number after the last row, defaults to the end of the log
+        ecu (str | None): only rows of this ECU address (e.g. '0x0E80')
+
+    Returns:
+        str: one line per pair
+    """
+    rows = session_log.reset_index(drop=True).iloc[start:stop]
+    if ecu is not None:
+        rows = rows[rows['ecu_address'].astype(str).str.lower() == ecu.lower()]
+    return ''.join(f"#{number} {line}\n" for number, line in zip(rows.index, format_pair_lines(rows)))
+
+
+def _problems(session_log: pd.DataFrame) -> np.ndarray:
+    """Marks the pairs with a negative reply, no reply or an exceeded timing budget."""
+    problems = session_log['error'].to_numpy() != 'No error'
+    if 'timing' in session_log.columns:
+        problems |= session_log['timing'].to_numpy() != 'OK'
+    return problems
+
+
+def _aggregate_lines(session_log: pd.DataFrame, problems: np.ndarray, codes: CodeIndex | None) -> tuple[list[str], list[tuple[str, list[str], str]]]:
+    """Overview lines, and the per-ECU and per-NRC sections as (title, lines with the most problems first, what a
+    line counts)."""
+    error = session_log['error']
+    timeouts = session_log['reply_sid'].isnull().to_numpy()
+    negative = (error != 'No error').to_numpy() & ~timeouts
+    violations = (session_log['timing'] != 'OK').to_numpy() if 'timing' in session_log.columns else np.zeros(len(session_log), bool)
+
+    start, end = pd.to_datetime(session_log['request_timestamp']).agg(['min', 'max'])
+    lines = [
+        f"Session summary: {len(session_log)} request/reply pairs (rows #0-{len(session_log) - 1}), "
+        f"{session_log['ecu_address'].nunique()} ECUs, {start} to {end} ({(end - start).total_seconds():.3f} s)",
+        f"{int(problems.sum())} problem pairs: {int(negative.sum())} negative replies, {int(timeouts.sum())} without reply, {int(violations.sum())} timing violations",
+    ]
+
+    frame = pd.DataFrame({'ecu': session_log['ecu_address'].to_numpy(), 'problems': problems, 'negative': negative, 'timeouts': timeouts, 'violations': violations})
+    if 'latency_ms' in session_log.columns:
+        frame['latency'] = session_log['latency_ms'].to_numpy()
+    per_ecu = sorted(frame.groupby('ecu', sort=True), key=lambda item: (-int(item[1]['problems'].sum()), -len(item[1])))
+    ecu_lines = []
+    for ecu, group in per_ecu:
+        line = f"ECU '{ecu}': {len(group)} requests, {int(group['negative'].sum())} negative, {int(group['timeouts'].sum())} without reply, {int(group['violations'].sum())} timing violations"
+        if 'latency' in group and group['latency'].notnull().any():
+            line += f", median latency {group['latency'].median():.1f} ms"
+        ecu_lines.append(line)
+    sections = [("Per ECU:", ecu_lines, 'ECUs')]
+
+    nrcs = session_log.loc[negative, ['error', 'ecu_address']]
+    if len(nrcs):
+        descriptions = {}
+        if codes is not None:
+            unique = pd.Series(nrcs['error'].unique())
+            descriptions = dict(zip(unique, codes.describe_hex('nrc', unique)))
+        nrc_lines = []
+        for nrc, group in sorted(nrcs.groupby('error', sort=True), key=lambda item: -len(item[1])):
+            counts = group['ecu_address'].value_counts(sort=False).sort_index().sort_values(ascending=False, kind='stable')
+            ecus = ', '.join(f"'{ecu}' x{count}" for ecu, count in counts.iloc[:MAX_NRC_ECUS].items())
+            if len(counts) > MAX_NRC_ECUS:
+                ecus += f" and {len(counts) - MAX_NRC_ECUS} more"
+            description = f" ({descriptions[nrc]})" if descriptions.get(nrc) else ""
+            nrc_lines.append(f"NRC {nrc}{description}: {len(group)} replies, ECU {ecus}")
+        sections.append(("Per NRC:", nrc_lines, 'NRCs'))
+
+    return lines, sections
+
+
+def _fit_sections(sections: list[tuple[str, list[str], str]], budget: int) -> list[str]:
+    """Lines of the aggregate sections within `budget` tokens: per section its title, up to `MAX_AGGREGATE_LINES`
+    lines that fit, and a "... N more" line for the others. Sections whose title does not fit are left out."""
+    lines = []
+    for title, section, noun in sections:
+        more = f"... {len(section)} more {noun}"  # longest possible "more" line, reserved up front
+        cost = estimate_tokens("\n") + estimate_tokens(title + '\n') + estimate_tokens(more + '\n')
+        if cost > budget:
+            continue
+        budget -= cost
+        lines += ["", title]
+        shown = 0
+        for line in section[:MAX_AGGREGATE_LINES]:
+            if estimate_tokens(line + '\n') > budget:
+                break
+            lines.append(line)
+            budget -= estimate_tokens(line + '\n')
+            shown += 1
+        if shown < len(section):
+            lines.append(f"... {len(section) - shown} more {noun if len(section) - shown > 1 else noun[:-1]}")
+        else:
+            budget += estimate_tokens(more + '\n')
+    return lines
+
+
+def _timeline(session_log: pd.DataFrame, problems: np.ndarray, lines: list[str], context: int) -> list[tuple[int, int, int, str]]:
+    """Timeline entries (first row, last row, priority, text). Problem pairs and their context are kept verbatim,
+    runs of other identical pairs are collapsed."""
+    n = len(session_log)
+    near = np.zeros(n, bool)  # within `context` rows of a problem
+    for offset in range(-context, context + 1):
+        near[max(offset, 0):n + min(offset, 0)] |= problems[max(-offset, 0):n - max(offset, 0)]
+
+    key = session_log.reindex(columns=RUN_KEY).astype(str).to_numpy()
+    # A run continues while the row equals the previous one and neither is kept verbatim
+    same = np.zeros(n, bool)
+    if n > 1:
+        same[1:] = (key[1:] == key[:-1]).all(axis=1) & ~near[1:] & ~near[:-1]
+    starts = np.flatnonzero(~same)
+    stops = np.append(starts[1:], n)
+    latency = session_log['latency_ms'].to_numpy(dtype=float) if 'latency_ms' in session_log.columns else None
+
+    entries = []
+    for first, stop in zip(starts, stops):
+        last = stop - 1
+        if first == last:
+            priority = _PROBLEMS if problems[first] else _CONTEXT if near[first] else _RUNS
+            marker = '! ' if problems[first] else ''
+            entries.append((first, last, priority, f"{marker}#{first} {lines[first]}"))
+            continue
+        row = session_log.iloc[first]
+        text = f"#{first}-{last} ECU '{row['ecu_address']}': SID {row['request_sid']} ({row['request_description']}) -> SID {row['reply_sid']} ({row['reply_description']}) x{stop - first} // {row['error']}"
+        if latency is not None:
+            run = latency[first:stop]
+            if not np.isnan(run).all():
+                text += f" // latency median {np.nanmedian(run):.1f} ms ({np.nanmin(run):.1f}-{np.nanmax(run):.1f})"
+            text += f" // timing {row['timing']}"
+        entries.append((first, last, _RUNS, text))
+    return entries
+
+
+def summarize_session_log(session_log: pd.DataFrame, token_budget: int = DEFAULT_TOKEN_BUDGET, context: int = DEFAULT_CONTEXT,
+                          codes: CodeIndex | None = None) -> str:
+    """Summarizes a session log into at most (roughly) `token_budget` tokens, see the module docstring. Logs whose
+    full text (see `format_session_log`) fits into the budget are returned in full.
+
+    Args:
+        session_log (pd.DataFrame): session log, see `utils.combine_request_reply`
+        token_budget (int): approximate maximum number of tokens of the summary, see `estimate_tokens`
+        context (int): pairs shown verbatim before and after each problem pair
+        codes (CodeIndex | None): index used to describe the NRCs in the aggregates, NRCs are listed by code if None
+
+    Returns:
+        str: the summary
+    """
+    session_log = session_log.reset_index(drop=True)
+    if session_log.empty:
+        return "Session summary: no request/reply pairs.\n"
+    full = format_session_log(session_log)
+    if estimate_tokens(full) <= token_budget:
+        return full
+
+    problems = _problems(session_log)
+    aggregates, sections = _aggregate_lines(session_log, problems, codes)
+    entries = _timeline(session_log, problems, format_pair_lines(session_log), context)
+    latency = format_latency_summary(session_log).rstrip('\n').split('\n') if 'latency_ms' in session_log.columns else []
+
+    # Every line also pays for one omission marker, so the markers added below always fit
+    marker_tokens = estimate_tokens("... #0000000-0000000 omitted (0000000 pairs)\n")
+    header = "\nTimeline (row numbers #first-last, '!' marks problems):"
+    footer = "Omitted rows can be read in full with a drill-down request."
+    budget = token_budget - sum(estimate_tokens(line + '\n') for line in aggregates + [header, footer]) - marker_tokens
+    section_lines = _fit_sections(sections, budget // 2)
+    aggregates += section_lines
+    budget -= sum(estimate_tokens(line + '\n') for line in section_lines)
+    keep_latency = False
+    kept = set()
+    for priority in (_PROBLEMS, _CONTEXT, _LATENCY, _RUNS):
+        if priority == _LATENCY:
+            cost = sum(estimate_tokens(line + '\n') for line in latency) + 1
+            if latency and cost <= budget:
+                keep_latency, budget = True, budget - cost
+            continue
+        for index, (_, _, entry_priority, text) in enumerate(entries):
+            if entry_priority == priority:
+                cost = estimate_tokens(text + '\n') + marker_tokens
+                if cost > budget:
+                    break
+                kept.add(index)
+                budget -= cost
+
+    summary = aggregates + [header]
+    omitted_from = None
+    for index, (first, last, _, text) in enumerate(entries):
+        if index in kept:
+            if omitted_from is not None:
+                summary.append(f"... #{omitted_from}-{first - 1} omitted ({first - omitted_from} pairs)")
+                omitted_from = None
+            summary.append(text)
+        elif omitted_from is None:
+            omitted_from = first
+    if omitted_from is not None:
+        summary.append(f"... #{omitted_from}-{len(session_log) - 1} omitted ({len(session_log) - omitted_from} pairs)")
+    if len(kept) < len(entries):
+        summary.append(footer)
+    if keep_latency:
+        summary += [""] + latency
+
+    # Only the overview lines can exceed a very small budget; drop lines from the end until the summary fits
+    while summary and estimate_tokens(''.join(f"{line}\n" for line in summary)) > token_budget:
+        summary.pop()
+    return ''.join(f"{line}\n" for line in summary)
@@ -0,0 +1,109 @@
+"""Response timing of UDS request/reply pairs.
+
+Latency is measured from the request to its final reply. The pairs are checked against the UDS application timing
+parameters (ISO 14229-2):
+
+- P2: time from the request to the first reply of any kind (final or response pending)
+- P2*: time from a response pending reply (NRC 0x78) to the next reply
+- P6: how long the tester waits for any reply before giving up; requests without a final reply always exceed it
+
+S3 (how long a server stays in a non-default session without requests) is not a response time; it is used by the
+per-ECU session tracking of `pipeline.ecu_state`.
+"""
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# pylint: disable=C0301
+
+PERCENTILES = (50, 90, 99)
+
+
+class TimingParameters(NamedTuple):
+    """Timing budgets in seconds. The defaults are the usual server limits (P2 = 50 ms, P2* = 5 s, S3 = 5 s) and
+    the tester timeout the streaming ingestion uses."""
+    p2: float = 0.050
+    p2_star: float = 5.0
+    p6: float = 5.0
+    s3: float = 5.0  # a non-default session ends after this long without a request, see `pipeline.ecu_state`
+
+
+DEFAULT_TIMING = TimingParameters()
+
+# Labels indexed by a bit mask of exceeded budgets: 1 = P2, 2 = P2*, 4 = P6
+_VIOLATION_LABELS = np.array(['OK'] + [' + '.join(name for bit, name in ((1, 'P2'), (2, 'P2*'), (4, 'P6')) if mask & bit) + ' exceeded' for mask in range(1, 8)], dtype=object)
+
+
+def response_timing(pairs: pd.DataFrame, parameters: TimingParameters = DEFAULT_TIMING) -> pd.DataFrame:
+    """Computes the latency of every request/reply pair and flags exceeded timing budgets.
+
+    Args:
+        pairs (pd.DataFrame): typed request/reply pairs, see `pipeline.matching.PAIR_DTYPES`
+        parameters (TimingParameters): timing budgets to check against
+
+    Returns:
+        pd.DataFrame: one row per pair, with columns:
+            - latency_ms: time from request to final reply in milliseconds (NaN if no reply)
+            - pending_responses: number of response pending replies before the final reply
+            - timing: exceeded budgets, e.g. 'P2 exceeded' or 'P2 + P6 exceeded', or 'OK'
+    """
+    request = pairs['request_timestamp'].to_numpy()
+    latency = pairs['reply_timestamp'].to_numpy() - request
+    first_response = pairs['first_response_timestamp'].to_numpy() - request
+    pending_interval = pairs['max_pending_interval'].to_numpy()
+
+    # Comparisons with NaT are False, so missing replies or pending chains never count as exceeded here
+    p2 = first_response > _seconds(parameters.p2)
+    p2_star = pending_interval > _seconds(parameters.p2_star)
+    p6 = ~pairs['replied'].to_numpy() | (first_response > _seconds(parameters.p6)) | (pending_interval > _seconds(parameters.p6))
+
+    return pd.DataFrame({
+        'latency_ms': latency / np.timedelta64(1, 'ms'),
+        'pending_responses': pairs['pending_responses'].to_numpy(),
+        'timing': _VIOLATION_LABELS[p2 * 1 + p2_star * 2 + p6 * 4],
+    }, index=pairs.index)
+
+
+def latency_percentiles(session_log: pd.DataFrame, by: str) -> pd.DataFrame:
+    """Summarises the response latency of a session log per group.
+
+    Args:
+        session_log (pd.DataFrame): session log with 'latency_ms' and 'timing' columns, see `response_timing`
+        by (str): column to group by, e.g. 'ecu_address' or 'request_sid'
+
+    Returns:
+        pd.DataFrame: per group, the number of requests, latency percentiles ('p50', 'p90', 'p99'), the maximum
+            latency in milliseconds, and the number of requests that exceeded a timing budget
+    """
+    groups = session_log.groupby(by, sort=True)
+    latency = groups['latency_ms']
+    summary = pd.DataFrame({'requests': groups.size()})
+    for percentile in PERCENTILES:
+        summary[f'p{percentile}'] = latency.quantile(percentile / 100)
+    summary['max'] = latency.max()
+    summary['violations'] = groups['timing'].apply(lambda timing: int((timing != 'OK').sum()))
+    return summary
+
+
+def format_latency_summary(session_log: pd.DataFrame) -> str:
+    """Formats the latency percentiles per ECU and per request SID as text for the session log.
+
+    Args:
+        session_log (pd.DataFrame): session log with 'latency_ms' and 'timing' columns
+
+    Returns:
+        str: one line per ECU and per request SID
+    """
+    lines = []
+    for by, title in (('ecu_address', 'ECU'), ('request_sid', 'SID')):
+        lines.append(f"Response latency by {title} (ms):")
+        for group, row in latency_percentiles(session_log, by).iterrows():
+            percentiles = ' '.join(f"p{percentile}={row[f'p{percentile}']:.1f}" for percentile in PERCENTILES)
+            lines.append(f"{title} '{group}': {int(row['requests'])} requests, {percentiles} max={row['max']:.1f} // {int(row['violations'])} timing violations")
+    return '\n'.join(lines) + '\n'
+
+
+def _seconds(value: float) -> np.timedelta64:
+    """Converts seconds into a ns timedelta."""
+    return np.timedelta64(int(round(value * 1_000_000_000)), 'ns')
@@ -0,0 +1,174 @@
+"""Per-session storage of uploaded captures.
+
+Every chat session gets its own folder below the upload folder, so uploads of different sessions never overwrite or
+delete each other's files. A session keeps at most `max_captures` captures and `max_bytes` of files; the oldest
+captures (with their CSV exports) are deleted to make room for a new upload. Folders of sessions without an upload for
+`max_idle` seconds are deleted by `cleanup`, which `start_cleanup` runs periodically in a daemon thread.
+"""
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from typing import BinaryIO
+
+from .sessions import MAX_CAPTURES_PER_SESSION
+
+# pylint: disable=C0301
+
+UPLOAD_FOLDER = "uploads"
+MAX_SESSION_BYTES = 512 * 1024 * 1024
+MAX_IDLE_SECONDS = 24 * 3600
+CLEANUP_INTERVAL = 600  # seconds between two runs of the background cleanup
+COPY_CHUNK_SIZE = 1 << 20
+
+_SESSION_ID = re.compile(r"^[0-9A-Za-z_-]{1,64}$")
+
+
+class QuotaExceeded(Exception):
+    """Raised when a single upload is larger than the storage quota of a session."""
+
+
+class CaptureStorage:
+    """Upload folder with one sub-folder per chat session, per-session quotas and idle-session cleanup.
+
+    Args:
+        root (str): upload folder
+        max_captures (int): captures kept per session, the oldest upload is deleted first
+        max_bytes (int): total size of the files kept per session
+        max_idle (float): seconds after the last upload of a session after which `cleanup` deletes its folder
+    """
+
+    def __init__(self, root: str = UPLOAD_FOLDER, max_captures: int = MAX_CAPTURES_PER_SESSION, max_bytes: int = MAX_SESSION_BYTES,
+                 max_idle: float = MAX_IDLE_SECONDS):
+        self.root = root
+        self.max_captures = max_captures
+        self.max_bytes = max_bytes
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+
+    def folder(self, session_id: str) -> str:
+        """Returns the folder of a session's files."""
+        if not _SESSION_ID.match(session_id or ""):
+            raise ValueError(f"Invalid session id {session_id!r}")
+        return os.path.join(self.root, session_id)
+
+    def path(self, session_id: str, filename: str) -> str:
+        """Returns the path of a capture of a session. `filename` must already be secured (`secure_filename`)."""
+        return os.path.join(self.folder(session_id), filename)
+
+    def export_path(self, session_id: str, filename: str) -> str:
+        """Returns the path of the CSV export of a capture of a session, e.g. 'bench.pcap.csv'. The capture's extension
+        is kept, so captures of the same name in different formats (e.g. 'bench.pcap' and 'bench.log') do not share
+        an export."""
+        return os.path.join(self.folder(session_id), f"{filename}.csv")
+
+    def save(self, session_id: str, filename: str, stream: BinaryIO) -> str:
+        """Stores an upload as a capture of a session, replacing a capture of the same name, then deletes the oldest
+        captures of the session beyond its quotas.
+
+        Args:
+            session_id (str): chat session
+            filename (str): secured file name
+            stream (BinaryIO): file contents
+
+        Returns:
+            str: path of the stored capture
+        """
+        folder = self.folder(session_id)
+        os.makedirs(folder, exist_ok=True)
+        # Write to a temporary file first, so a rejected or failed upload leaves the session's captures untouched
+        descriptor, temporary = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as target:
+                size = 0
+                for chunk in iter(lambda: stream.read(COPY_CHUNK_SIZE), b""):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise QuotaExceeded(f"The file is larger than the upload quota of {self.max_bytes // 2**20} MiB.")
+                    target.write(chunk)
+            path = self.path(session_id, filename)
+            with self._lock:
+                os.replace(temporary, path)
+                self._enforce_quota(session_id, keep=filename)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        return path
+
+    def captures(self, session_id: str) -> list[str]:
+        """Returns the file names of a session's captures, oldest upload first."""
+        try:
+            folder = self.folder(session_id)
+            entries = [(os.stat(os.path.join(folder, name)).st_mtime, name) for name in os.listdir(folder) if name.lower().endswith((".pcap", ".pcapng", ".log"))]
+        except (FileNotFoundError, ValueError):
+            return []
+        return [name for _, name in sorted(entries)]
+
+    def remove(self, session_id: str, filename: str) -> None:
+        """Deletes a capture of a session and its CSV export."""
+        for path in (self.path(session_id, filename), self.export_path(session_id, filename)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def drop(self, session_id: str) -> None:
+        """Deletes all files of a session."""
+        with self._lock:
+            shutil.rmtree(self.folder(session_id), ignore_errors=True)
+
+    def _enforce_quota(self, session_id: str, keep: str) -> None:
+        """Deletes the oldest captures of a session, except `keep`, until the session is within its quotas."""
+        folder = self.folder(session_id)
+        captures = [name for name in self.captures(session_id) if name != keep]
+        total = sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+        while captures and (len(captures) + 1 > self.max_captures or total > self.max_bytes):
+            oldest = captures.pop(0)
+            for path in (self.path(session_id, oldest), self.export_path(session_id, oldest)):
+                try:
+                    total -= os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def cleanup(self) -> int:
+        """Deletes the folders of sessions whose newest file is older than `max_idle` seconds.
+
+        Returns:
+            int: number of deleted session folders
+        """
+        cutoff = time.time() - self.max_idle
+        deleted = 0
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            if not entry.is_dir() or not _SESSION_ID.match(entry.name):
+                continue
+            with self._lock:
+                try:
+                    newest = max([entry.stat().st_mtime] + [file.stat().st_mtime for file in os.scandir(entry.path)])
+                except FileNotFoundError:
+                    continue
+                if newest < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    deleted += 1
+        return deleted
+
+    def start_cleanup(self, interval: float = CLEANUP_INTERVAL) -> threading.Thread:
+        """Runs `cleanup` every `interval` seconds in a daemon thread.
+
+        Returns:
+            threading.Thread: the started thread
+        """
+        def run():
+            while True:
+                self.cleanup()
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name="upload-cleanup", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,344 @@
+"""Persistent, queryable store of the request/reply pairs of all processed captures.
+
+`CaptureWarehouse` appends every processed session log to a SQLite database, so statistics over past captures
+("which ECU returned NRC 0x33 most last week", "p95 latency per SID") can be answered long after the upload. Codes and
+addresses are stored as integers and timestamps as nanoseconds since the epoch (UTC; session logs hold local times).
+
+Besides the raw pairs (indexed for drill-down by capture, ECU and time), each insert maintains hourly rollups keyed by
+the columns the queries filter on:
+
+- `service_hours`: requests, negative replies and missing replies per hour, ECU and SID;
+- `nrc_hours`: negative replies per NRC, hour, ECU and SID;
+- `latency_hours`: a log-scale latency histogram per SID, hour and ECU (8 buckets per doubling, i.e. percentiles are
+  exact to about 4.5%).
+
+The statistics queries only read the rollups, whose size grows with the number of distinct hours, ECUs and services
+rather than with the number of pairs, so they stay well below a second at tens of millions of pairs.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from .scan import to_utc_time
+
+# pylint: disable=C0301
+
+WAREHOUSE_DB = "uds/captures.db"
+HOUR_NS = 3600 * 10**9
+LATENCY_BUCKETS_PER_DOUBLING = 8
+PERCENTILES = (50, 95, 99)
+BUSY_TIMEOUT = 300  # seconds a writer waits for another process's transaction
+
+_SCHEMA = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+CREATE TABLE IF NOT EXISTS captures (
+    capture_id INTEGER PRIMARY KEY,
+    digest TEXT UNIQUE,
+    name TEXT NOT NULL,
+    source TEXT,
+    loaded REAL NOT NULL,
+    pairs INTEGER NOT NULL,
+    first_request INTEGER,
+    last_request INTEGER
+);
+CREATE TABLE IF NOT EXISTS pairs (
+    capture_id INTEGER NOT NULL,
+    ecu INTEGER NOT NULL,
+    request_sid INTEGER NOT NULL,
+    reply_sid INTEGER,
+    nrc INTEGER,
+    request_time INTEGER,
+    latency_ms REAL,
+    pending_responses INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pairs_capture ON pairs (capture_id);
+CREATE INDEX IF NOT EXISTS pairs_ecu_time ON pairs (ecu, request_time);
+CREATE TABLE IF NOT EXISTS service_hours (
+    hour INTEGER NOT NULL,
+    ecu INTEGER NOT NULL,
+    sid INTEGER NOT NULL,
+    requests INTEGER NOT NULL,
+    negative INTEGER NOT NULL,
+    missing INTEGER NOT NULL,
+    PRIMARY KEY (hour, ecu, sid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS nrc_hours (
+    nrc INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    ecu INTEGER NOT NULL,
+    sid INTEGER NOT NULL,
+    replies INTEGER NOT NULL,
+    PRIMARY KEY (nrc, hour, ecu, sid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS latency_hours (
+    sid INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    ecu INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    pairs INTEGER NOT NULL,
+    PRIMARY KEY (sid, hour, ecu, bucket)
+) WITHOUT ROWID;
+"""
+
+
+def _codes(values: pd.Series) -> np.ndarray:
+    """Converts hex strings ('0x22') to integers, anything else (None, 'No error', 'Unknown error') to -1."""
+    unique = values.dropna().unique()
+    mapping = {}
+    for value in unique:
+        try:
+            mapping[value] = int(value, 16)
+        except (TypeError, ValueError):
+            mapping[value] = -1
+    return values.map(mapping).fillna(-1).to_numpy(dtype=np.int64)
+
+
+def _to_ns(day: str | datetime | None) -> int | None:
+    """Converts an ISO date/time (UTC if naive) to nanoseconds since the epoch."""
+    if day is None:
+        return None
+    timestamp = pd.Timestamp(day)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize(timezone.utc)
+    return int(timestamp.value)
+
+
+def latency_bucket(latency_ms: np.ndarray) -> np.ndarray:
+    """Returns the histogram bucket of each latency, see the module docstring."""
+    return np.floor(np.log2(np.maximum(latency_ms, 1e-3)) * LATENCY_BUCKETS_PER_DOUBLING).astype(np.int64)
+
+
+def bucket_latency(bucket: int) -> float:
+    """Returns the representative latency of a bucket (its geometric center) in milliseconds."""
+    return 2 ** ((bucket + 0.5) / LATENCY_BUCKETS_PER_DOUBLING)
+
+
+class CaptureWarehouse:
+    """SQLite store of the pairs of all processed captures with hourly rollups, see the module docstring.
+
+    Args:
+        db_path (str): database file, created with its folder on first use
+    """
+
+    def __init__(self, db_path: str = WAREHOUSE_DB):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.db_path):
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            # Batch workers in other processes may hold the write lock for a while, see `pipeline.batch`
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=BUSY_TIMEOUT)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def add(self, session_log: pd.DataFrame, name: str, source: str | None = None, digest: str | None = None) -> int:
+        """Appends the pairs of a processed capture and updates the rollups. A capture whose `digest` is already
+        stored is not added again.
+
+        Args:
+            session_log (pd.DataFrame): session log, see `utils.combine_request_reply`
+            name (str): capture file name
+            source (str | None): where the capture came from, e.g. 'upload' or a batch input directory
+            digest (str | None): content hash identifying the capture, e.g. `SessionStore.digest`
+
+        Returns:
+            int: id of the capture in the warehouse
+        """
+        request_time = to_utc_time(session_log['request_timestamp'].to_numpy(dtype='datetime64[ns]'))  # session logs hold local times
+        valid_time = ~np.isnat(request_time)
+        frame = pd.DataFrame({
+            'ecu': _codes(session_log['ecu_address']),
+            'request_sid': _codes(session_log['request_sid']),
+            'reply_sid': _codes(session_log['reply_sid']),
+            'nrc': _codes(session_log['error']),
+            'request_time': np.where(valid_time, request_time.view(np.int64), -1),
+            'latency_ms': session_log['latency_ms'].to_numpy(dtype=float) if 'latency_ms' in session_log.columns else np.nan,
+            'pending_responses': session_log['pending_responses'].to_numpy(dtype=np.int64) if 'pending_responses' in session_log.columns else 0,
+        })
+        frame = frame.sort_values(['ecu', 'request_time'], kind='stable')  # inserts in index order
+        valid_time = frame['request_time'].to_numpy() != -1
+        frame['hour'] = np.where(valid_time, frame['request_time'] // HOUR_NS, -1)
+        frame['negative'] = frame['reply_sid'] == 0x7F
+        frame['missing'] = frame['reply_sid'] == -1
+
+        with self._lock:
+            conn = self._connection()
+            if digest is not None:
+                row = conn.execute("SELECT capture_id FROM captures WHERE digest = ?", (digest,)).fetchone()
+                if row is not None:
+                    return row[0]
+            with conn:  # one transaction: the capture, its pairs and the rollups are added together or not at all
+                times = frame.loc[valid_time, 'request_time']
+                capture_id = conn.execute(
+                    "INSERT INTO captures (digest, name, source, loaded, pairs, first_request, last_request) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (digest, name, source, time.time(), len(frame), int(times.min()) if len(times) else None, int(times.max()) if len(times) else None),
+                ).lastrowid
+                self._insert_pairs(conn, capture_id, frame)
+                self._update_rollups(conn, frame)
+        return capture_id
+
+    @staticmethod
+    def _insert_pairs(conn: sqlite3.Connection, capture_id: int, frame: pd.DataFrame) -> None:
+        rows = zip(
+            [capture_id] * len(frame),
+            frame['ecu'].tolist(),
+            frame['request_sid'].tolist(),
+            [None if sid == -1 else sid for sid in frame['reply_sid'].tolist()],
+            [None if nrc == -1 or not negative else nrc for nrc, negative in zip(frame['nrc'].tolist(), frame['negative'].tolist())],
+            [None if value == -1 else value for value in frame['request_time'].tolist()],
+            [None if math.isnan(value) else value for value in frame['latency_ms'].tolist()],
+            frame['pending_responses'].tolist(),
+        )
+        conn.executemany("INSERT INTO pairs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    @staticmethod
+    def _update_rollups(conn: sqlite3.Connection, frame: pd.DataFrame) -> None:
+        services = frame.groupby(['hour', 'ecu', 'request_sid']).agg(requests=('negative', 'size'), negative=('negative', 'sum'), missing=('missing', 'sum'))
+        conn.executemany(
+            "INSERT INTO service_hours VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (hour, ecu, sid) DO UPDATE SET "
+            "requests = requests + excluded.requests, negative = negative + excluded.negative, missing = missing + excluded.missing",
+            [tuple(int(value) for value in key + row) for key, row in zip(services.index, services.itertuples(index=False))],
+        )
+
+        negative = frame[frame['negative'] & (frame['nrc'] != -1)]
+        nrcs = negative.groupby(['nrc', 'hour', 'ecu', 'request_sid']).size()
+        conn.executemany(
+            "INSERT INTO nrc_hours VALUES (?, ?, ?, ?, ?) ON CONFLICT (nrc, hour, ecu, sid) DO UPDATE SET replies = replies + excluded.replies",
+            [tuple(int(value) for value in key) + (int(count),) for key, count in nrcs.items()],
+        )
+
+        replied = frame[frame['latency_ms'].notnull()]
+        latency = replied.assign(bucket=latency_bucket(replied['latency_ms'].to_numpy())).groupby(['request_sid', 'hour', 'ecu', 'bucket']).size()
+        conn.executemany(
+            "INSERT INTO latency_hours VALUES (?, ?, ?, ?, ?) ON CONFLICT (sid, hour, ecu, bucket) DO UPDATE SET pairs = pairs + excluded.pairs",
+            [tuple(int(value) for value in key) + (int(count),) for key, count in latency.items()],
+        )
+
+    def _query(self, sql: str, parameters: list) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_sql_query(sql, self._connection(), params=parameters)
+
+    @staticmethod
+    def _filters(since: str | datetime | None, until: str | datetime | None, ecu: str | None = None, sid: str | None = None) -> tuple[str, list]:
+        """WHERE clause on the rollup columns hour, ecu and sid."""
+        clauses, parameters = [], []
+        if since is not None:
+            clauses.append("hour >= ?")
+            parameters.append(_to_ns(since) // HOUR_NS)
+        if until is not None:
+            clauses.append("hour < ?")
+            parameters.append(-(-_to_ns(until) // HOUR_NS))
+        if ecu is not None:
+            clauses.append("ecu = ?")
+            parameters.append(int(ecu, 16))
+        if sid is not None:
+            clauses.append("sid = ?")
+            parameters.append(int(sid, 16))
+        return (" AND " + " AND ".join(clauses)) if clauses else "", parameters
+
+    def nrc_counts(self, nrc: str | None = None, since: str | datetime | None = None, until: str | datetime | None = None,
+                   ecu: str | None = None, sid: str | None = None, limit: int = 20) -> pd.DataFrame:
+        """Counts negative replies per ECU, SID and NRC, most frequent first.
+
+        Args:
+            nrc (str | None): only this NRC, e.g. '0x33'
+            since (str | datetime | None): first request time, e.g. '2024-09-01' (UTC)
+            until (str | datetime | None): end of the request time range
+            ecu (str | None): only this ECU address, e.g. '0x0E80'
+            sid (str | None): only this request SID, e.g. '0x27'
+            limit (int): maximum number of rows
+
+        Returns:
+            pd.DataFrame: columns ecu_address, request_sid, nrc, replies
+        """
+        where, parameters = self._filters(since, until, ecu, sid)
+        if nrc is not None:
+            where += " AND nrc = ?"
+            parameters.append(int(nrc, 16))
+        result = self._query(
+            f"SELECT ecu, sid, nrc, SUM(replies) AS replies FROM nrc_hours WHERE 1 = 1{where} GROUP BY ecu, sid, nrc ORDER BY replies DESC LIMIT ?",
+            parameters + [limit],
+        )
+        return pd.DataFrame({
+            'ecu_address': [f"0x{value:04x}" for value in result['ecu']],
+            'request_sid': [f"0x{value:02X}" for value in result['sid']],
+            'nrc': [f"0x{value:02X}" for value in result['nrc']],
+            'replies': result['replies'].astype(int),
+        })
+
+    def service_counts(self, since: str | datetime | None = None, until: str | datetime | None = None, ecu: str | None = None,
+                       sid: str | None = None, limit: int = 50) -> pd.DataFrame:
+        """Counts requests, negative replies and missing replies per ECU and SID, most requested first.
+
+        Returns:
+            pd.DataFrame: columns ecu_address, request_sid, requests, negative, missing
+        """
+        where, parameters = self._filters(since, until, ecu, sid)
+        result = self._query(
+            f"SELECT ecu, sid, SUM(requests) AS requests, SUM(negative) AS negative, SUM(missing) AS missing FROM service_hours "
+            f"WHERE 1 = 1{where} GROUP BY ecu, sid ORDER BY requests DESC LIMIT ?",
+            parameters + [limit],
+        )
+        return pd.DataFrame({
+            'ecu_address': [f"0x{value:04x}" for value in result['ecu']],
+            'request_sid': [f"0x{value:02X}" for value in result['sid']],
+            'requests': result['requests'].astype(int),
+            'negative': result['negative'].astype(int),
+            'missing': result['missing'].astype(int),
+        })
+
+    def latency_percentiles(self, since: str | datetime | None = None, until: str | datetime | None = None, ecu: str | None = None,
+                            sid: str | None = None, by_ecu: bool = False, percentiles: tuple[int, ...] = PERCENTILES) -> pd.DataFrame:
+        """Latency percentiles per request SID (and ECU), from the latency histograms.
+
+        Args:
+            since (str | datetime | None): first request time, e.g. '2024-09-01' (UTC)
+            until (str | datetime | None): end of the request time range
+            ecu (str | None): only this ECU address
+            sid (str | None): only this request SID
+            by_ecu (bool): one row per SID and ECU instead of per SID
+            percentiles (tuple[int, ...]): percentiles to compute
+
+        Returns:
+            pd.DataFrame: columns request_sid (and ecu_address), pairs and one column per percentile (e.g. p95_ms)
+        """
+        where, parameters = self._filters(since, until, ecu, sid)
+        group = "sid, ecu" if by_ecu else "sid"
+        histogram = self._query(f"SELECT {group}, bucket, SUM(pairs) AS pairs FROM latency_hours WHERE 1 = 1{where} GROUP BY {group}, bucket ORDER BY {group}, bucket", parameters)
+
+        rows = []
+        for key, buckets in histogram.groupby(['sid', 'ecu'] if by_ecu else ['sid'], sort=True):
+            cumulative = buckets['pairs'].cumsum().to_numpy()
+            row = {'request_sid': f"0x{key[0]:02X}"}
+            if by_ecu:
+                row['ecu_address'] = f"0x{key[1]:04x}"
+            row['pairs'] = int(cumulative[-1])
+            for percentile in percentiles:
+                index = int(np.searchsorted(cumulative, cumulative[-1] * percentile / 100))
+                row[f"p{percentile}_ms"] = round(bucket_latency(int(buckets['bucket'].iloc[index])), 2)
+            rows.append(row)
+        columns = ['request_sid'] + (['ecu_address'] if by_ecu else []) + ['pairs'] + [f"p{percentile}_ms" for percentile in percentiles]
+        return pd.DataFrame(rows, columns=columns)
+
+    def captures(self, limit: int = 20) -> pd.DataFrame:
+        """Returns the most recently added captures: id, name, source, number of pairs and request time range."""
+        result = self._query("SELECT capture_id, name, source, pairs, first_request, last_request FROM captures ORDER BY capture_id DESC LIMIT ?", [limit])
+        for column in ('first_request', 'last_request'):
+            result[column] = pd.to_datetime(result[column], unit='ns')
+        return result
+
+    def time_range(self) -> tuple[datetime | None, datetime | None]:
+        """Returns the first and last request time of all stored pairs (UTC)."""
+        first, last = self._query("SELECT MIN(first_request) AS first, MAX(last_request) AS last FROM captures", []).iloc[0]
+        convert = lambda value: None if pd.isnull(value) else datetime.fromtimestamp(value / 1e9, timezone.utc)  # pylint: disable=C3001
+        return convert(first), convert(last)
@@ -0,0 +1,89 @@
+"""Regression and parity tests of the native DoIP/UDS decoder (`pipeline.scan.scan_pcap_file`) on the captures in
+`data/`.
+
+The expected packet counts, UDS columns and session logs in `tests/expected/<capture>.json` are snapshots of the
+native decoder, which was checked by hand against the raw DoIP payloads and the pyshark decoder when it was
+introduced. Parity with pyshark itself is only tested when pyshark and tshark are installed. Capture times are
+formatted in local time, so both decoders run with the time zone pinned to UTC and the snapshots hold UTC times.
+After an intended change of the decoder or the pairing, regenerate the snapshots with:
+
+    python -m tests.test_decoder_parity
+"""
+import asyncio
+import glob
+import json
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from tests.timezones import local_timezone
+from utils import read_pcap_file, combine_request_reply
+
+# pylint: disable=C0301
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+EXPECTED_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'expected')
+CAPTURES = sorted(glob.glob(os.path.join(DATA_DIRECTORY, '*.pcap')))
+UDS_COLUMNS = ['number', 'source', 'target', 'request', 'sid', 'error']
+SESSION_LOG_COLUMNS = ['ecu_address', 'request_sid', 'reply_sid', 'error', 'request_timestamp', 'reply_timestamp']
+
+
+def decode(capture: str) -> dict:
+    """Decodes a capture natively into the values stored in its expected file, with times in UTC."""
+    with local_timezone('UTC'):
+        packets = asyncio.run(read_pcap_file(capture))
+        session_log = combine_request_reply(packets)
+    return {
+        'packets': len(packets),
+        'uds': {name: packets[name].tolist() for name in UDS_COLUMNS},
+        'session_log': {name: [None if pd.isnull(value) else str(value) for value in session_log[name]] for name in SESSION_LOG_COLUMNS},
+    }
+
+
+def expected_path(capture: str) -> str:
+    return os.path.join(EXPECTED_DIRECTORY, os.path.splitext(os.path.basename(capture))[0] + '.json')
+
+
+def test_captures_present():
+    assert CAPTURES, f"no captures in {DATA_DIRECTORY}"
+
+
+@pytest.mark.parametrize('capture', CAPTURES, ids=os.path.basename)
+def test_native_decoder_matches_expected(capture):
+    with open(expected_path(capture), encoding='utf-8') as stream:
+        expected = json.load(stream)
+    decoded = decode(capture)
+
+    assert decoded['packets'] == expected['packets']
+    for name in UDS_COLUMNS:
+        assert decoded['uds'][name] == expected['uds'][name], name
+    for name in SESSION_LOG_COLUMNS:
+        assert decoded['session_log'][name] == expected['session_log'][name], name
+
+
+@pytest.mark.parametrize('capture', CAPTURES, ids=os.path.basename)
+def test_native_decoder_matches_pyshark(capture):
+    pytest.importorskip('pyshark')
+    if shutil.which('tshark') is None:
+        pytest.skip("tshark is not installed")
+    with local_timezone('UTC'):
+        native = asyncio.run(read_pcap_file(capture))
+        reference = asyncio.run(read_pcap_file(capture, use_pyshark=True))
+
+    assert len(native) == len(reference)
+    for name in UDS_COLUMNS + ['timestamp']:
+        assert native[name].astype(str).str.lower().tolist() == reference[name].astype(str).str.lower().tolist(), name
+
+
+if __name__ == '__main__':
+
+    os.makedirs(EXPECTED_DIRECTORY, exist_ok=True)
+    for path in CAPTURES:
+        values = decode(path)
+        lines = [f'"packets": {values["packets"]}']
+        lines += [f'"{part}": {{' + ',\n  '.join(f'"{name}": {json.dumps(column)}' for name, column in values[part].items()) + '}' for part in ('uds', 'session_log')]
+        with open(expected_path(path), 'w', encoding='utf-8') as output:
+            output.write('{' + ',\n '.join(lines) + '}\n')
+        print(f"{os.path.basename(path)} -> {expected_path(path)}")
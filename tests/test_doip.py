@@ -0,0 +1,24 @@
+"""Malformed captures in the native DoIP reader (`pipeline.doip.RecordReader`)."""
+import struct
+
+import pytest
+
+from pipeline.scan import scan_pcap_file
+
+# pylint: disable=C0301
+
+
+def pcapng_block(kind: int, body: bytes) -> bytes:
+    body += b'\0' * (-len(body) % 4)
+    return struct.pack('<II', kind, len(body) + 12) + body + struct.pack('<I', len(body) + 12)
+
+
+@pytest.mark.parametrize('kind, header', [(6, struct.pack('<IIIII', 1, 0, 0, 4, 4)), (2, struct.pack('<HHIIII', 1, 0, 0, 0, 4, 4))])
+def test_packet_block_of_undeclared_interface_is_rejected(tmp_path, kind, header):
+    capture = tmp_path / 'undeclared.pcapng'
+    capture.write_bytes(pcapng_block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1))
+                        + pcapng_block(1, struct.pack('<HHI', 1, 0, 65535))
+                        + pcapng_block(kind, header + b'\0' * 4))
+
+    with pytest.raises(ValueError, match="interface 1 is not declared"):
+        scan_pcap_file(str(capture))
@@ -0,0 +1,74 @@
+"""Per-ECU session and security tracking (`pipeline.ecu_state.diagnostic_state`) and its root-cause hints."""
+import numpy as np
+import pandas as pd
+
+from pipeline.doip import UDS_NEGATIVE_RESPONSE, UDS_REPLY_FLAG
+from pipeline.ecu_state import diagnostic_state
+from pipeline.matching import pair_packets
+
+# pylint: disable=C0301
+
+TESTER, ECU = 0x0E00, 0x1000
+
+
+def session_pairs(exchanges: list[tuple[float, int, int, int | None]]) -> pd.DataFrame:
+    """Pairs of (seconds, SID, sub-function, NRC) exchanges between the tester and one ECU; NRC None for a positive
+    reply. Each reply follows its request by 10 ms."""
+    rows = []
+    for seconds, sid, subfunction, nrc in exchanges:
+        rows.append((seconds, TESTER, ECU, True, sid, 0, subfunction))
+        rows.append((seconds + 0.01, ECU, TESTER, False, UDS_NEGATIVE_RESPONSE if nrc is not None else sid + UDS_REPLY_FLAG, nrc or 0, subfunction))
+    seconds, source, target, request, sid, error, subfunction = zip(*rows)
+    packets = pd.DataFrame({
+        'number': np.arange(1, len(rows) + 1, dtype=np.uint32),
+        'timestamp': (np.array(seconds) * 1e9).astype(np.int64).view('datetime64[ns]'),
+        'source': np.array(source, dtype=np.uint16),
+        'target': np.array(target, dtype=np.uint16),
+        'request': np.array(request),
+        'sid': np.array(sid, dtype=np.uint8),
+        'error': np.array(error, dtype=np.uint8),
+        'subfunction': np.array(subfunction, dtype=np.uint8),
+    })
+    return pair_packets(packets)
+
+
+def test_session_and_security_follow_the_exchanges():
+    pairs = session_pairs([(0.0, 0x10, 0x03, None), (0.1, 0x27, 0x01, None), (0.2, 0x27, 0x02, None),
+                           (0.3, 0x2E, 0xF1, None), (0.4, 0x11, 0x01, None), (0.5, 0x2E, 0xF1, 0x7F)])
+
+    state = diagnostic_state(pairs)
+
+    assert state['session'].tolist() == ['default', 'extended', 'extended', 'extended', 'extended', 'default']
+    assert state['security'].tolist() == ['locked', 'locked', 'locked', 'unlocked 0x01', 'unlocked 0x01', 'locked']
+    assert state['state_hint'].iloc[-1] == "ECU was back in the default session after the ECUReset at #9"
+
+
+def test_s3_timeout_ends_session():
+    pairs = session_pairs([(0.0, 0x10, 0x03, None), (6.0, 0x2E, 0xF1, 0x7F)])
+
+    state = diagnostic_state(pairs)
+
+    assert state['session'].tolist() == ['default', 'default']
+    assert state['state_hint'].iloc[-1].startswith("ECU was back in the default session. S3 timeout")
+
+
+def test_security_hint_names_the_s3_timeout_before_a_session_change():
+    # Unlocked, then locked again by an S3 timeout; the later session change finds the ECU locked already
+    pairs = session_pairs([(0.0, 0x10, 0x03, None), (0.1, 0x27, 0x01, None), (0.2, 0x27, 0x02, None),
+                           (6.0, 0x10, 0x03, None), (6.1, 0x2E, 0xF1, 0x33)])
+
+    state = diagnostic_state(pairs)
+
+    assert state['security'].tolist() == ['locked', 'locked', 'locked', 'locked', 'locked']
+    hint = state['state_hint'].iloc[-1]
+    assert hint.startswith("Security access unlocked at #5 was locked again. S3 timeout")
+    assert "before #7" in hint
+
+
+def test_security_hint_names_the_session_change_that_locked():
+    pairs = session_pairs([(0.0, 0x10, 0x03, None), (0.1, 0x27, 0x01, None), (0.2, 0x27, 0x02, None),
+                           (0.3, 0x10, 0x02, None), (0.4, 0x10, 0x03, None), (0.5, 0x2E, 0xF1, 0x33)])
+
+    hint = diagnostic_state(pairs)['state_hint'].iloc[-1]
+
+    assert hint == "Security access unlocked at #5 was locked again by the change to the programming session at #7"
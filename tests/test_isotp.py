@@ -0,0 +1,88 @@
+"""ISO-TP reassembly of UDS over CAN (`pipeline.isotp`) from hand-written candump logs and SocketCAN captures."""
+import numpy as np
+import pandas as pd
+
+from benchmarks.isotp_reassembly import write_socketcan_pcap
+from pipeline.isotp import IsoTpReassembler, read_can_frames, reassemble
+from pipeline.scan import scan_pcap_file
+
+# pylint: disable=C0301
+
+# ReadDataByIdentifier of the VIN (0xF190) from the ECU at 0x7E0: a single frame request, flow control from the
+# tester and a 20-byte reply in a first frame and two consecutive frames
+REQUEST = '(1726646400.000000) can0 7E0#0322F19000000000'
+FIRST_FRAME = '(1726646400.002000) can0 7E8#101462F190574155'
+FLOW_CONTROL = '(1726646400.002500) can0 7E0#3000000000000000'
+CONSECUTIVE_1 = '(1726646400.003000) can0 7E8#215A5A5A38563931'
+CONSECUTIVE_2 = '(1726646400.004000) can0 7E8#2231323334353637'
+VIN_REPLY = bytes.fromhex('62F190') + b'WAUZZZ8V911234567'
+
+
+def write_log(tmp_path, *lines: str) -> str:
+    path = str(tmp_path / 'capture.log')
+    with open(path, 'w', encoding='ascii') as stream:
+        stream.write('\n'.join(lines) + '\n')
+    return path
+
+
+def reassemble_log(tmp_path, *lines: str) -> tuple:
+    """Returns the messages and counts of `reassemble`, and the payloads of `IsoTpReassembler`, of a candump log."""
+    frames = read_can_frames(write_log(tmp_path, *lines))
+    reassembler = IsoTpReassembler()
+    payloads = [reassembler.add(timestamp, can_id, data[:length].tobytes())
+                for timestamp, can_id, length, data in zip(frames.timestamp.tolist(), frames.can_id.tolist(), frames.length.tolist(), frames.data)]
+    messages, stats = reassemble(frames)
+    return messages, stats, [payload for payload in payloads if payload]
+
+
+def test_multi_frame_message(tmp_path):
+    messages, stats, payloads = reassemble_log(tmp_path, REQUEST, FIRST_FRAME, FLOW_CONTROL, CONSECUTIVE_1, CONSECUTIVE_2)
+
+    assert messages.number.tolist() == [1, 5]  # a multi-frame message completes at its last consecutive frame
+    assert messages.can_id.tolist() == [0x7E0, 0x7E8]
+    assert messages.length.tolist() == [3, 20]
+    assert messages.sid.tolist() == [0x22, 0x62]
+    assert messages.subfunction.tolist() == [0xF1, 0xF1]
+    assert payloads == [bytes.fromhex('22F190'), VIN_REPLY]
+    assert (stats['messages'], stats['flow_control_frames'], stats['wrong_sequence'], stats['timeouts']) == (2, 1, 0, 0)
+
+
+def test_dropped_consecutive_frame(tmp_path):
+    messages, stats, payloads = reassemble_log(tmp_path, REQUEST, FIRST_FRAME, FLOW_CONTROL, CONSECUTIVE_2)
+
+    assert messages.sid.tolist() == [0x22]
+    assert payloads == [bytes.fromhex('22F190')]
+    assert stats['wrong_sequence'] == 1
+
+
+def test_wrong_sequence_number(tmp_path):
+    skipped = CONSECUTIVE_2.replace('7E8#22', '7E8#23')  # sequence number 3 where 2 is due
+    messages, stats, payloads = reassemble_log(tmp_path, REQUEST, FIRST_FRAME, FLOW_CONTROL, CONSECUTIVE_1, skipped)
+
+    assert messages.sid.tolist() == [0x22]
+    assert payloads == [bytes.fromhex('22F190')]
+    assert stats['wrong_sequence'] == 1
+
+
+def test_n_cr_timeout(tmp_path):
+    late = CONSECUTIVE_2.replace('(1726646400.004000)', '(1726646401.500000)')
+    messages, stats, payloads = reassemble_log(tmp_path, REQUEST, FIRST_FRAME, FLOW_CONTROL, CONSECUTIVE_1, late)
+
+    assert messages.sid.tolist() == [0x22]
+    assert payloads == [bytes.fromhex('22F190')]
+    assert (stats['wrong_sequence'], stats['timeouts']) == (0, 1)
+
+
+def test_socketcan_capture_gives_the_packets_of_the_candump_log(tmp_path):
+    log = write_log(tmp_path, REQUEST, FIRST_FRAME, FLOW_CONTROL, CONSECUTIVE_1, CONSECUTIVE_2)
+    frames = read_can_frames(log)
+    capture = str(tmp_path / 'capture.pcap')
+    write_socketcan_pcap(capture, frames.timestamp, frames.can_id, frames.data)
+
+    from_log, from_capture = scan_pcap_file(log), scan_pcap_file(capture)
+
+    pd.testing.assert_frame_equal(from_log, from_capture)
+    assert from_log['source'].tolist() == [0x0000, 0x07E0]
+    assert from_log['target'].tolist() == [0x07E0, 0x0000]
+    assert from_log['request'].tolist() == [True, False]
+    assert from_log['timestamp'].to_numpy().view(np.int64).tolist() == [1_726_646_400_000_000_000, 1_726_646_400_004_000_000]
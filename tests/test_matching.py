@@ -0,0 +1,94 @@
+"""Batch request/reply pairing (`pipeline.matching.pair_packets`): P6 deadlines, response pending chains and
+agreement with the streaming `IncrementalMatcher`."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic_capture import write_capture
+from pipeline.doip import UDS_NEGATIVE_RESPONSE, UDS_RESPONSE_PENDING
+from pipeline.matching import PAIR_DTYPES, pair_packets
+from pipeline.scan import scan_pcap_file
+from pipeline.streaming import IncrementalMatcher
+
+# pylint: disable=C0301
+
+TESTER, ECU = 0x0E00, 0x1000
+
+
+def packet_table(messages: list[tuple[float, bool, int, int]]) -> pd.DataFrame:
+    """Typed packet table from (seconds, request, SID, NRC) tuples between the tester and one ECU."""
+    seconds, request, sid, error = zip(*messages)
+    request = np.array(request)
+    return pd.DataFrame({
+        'number': np.arange(1, len(messages) + 1, dtype=np.uint32),
+        'timestamp': (np.array(seconds) * 1e9).astype(np.int64).view('datetime64[ns]'),
+        'source': np.where(request, TESTER, ECU).astype(np.uint16),
+        'target': np.where(request, ECU, TESTER).astype(np.uint16),
+        'request': request,
+        'sid': np.array(sid, dtype=np.uint8),
+        'error': np.array(error, dtype=np.uint8),
+    })
+
+
+def test_dropped_reply_leaves_request_unanswered():
+    packets = packet_table([(0.0, True, 0x22, 0), (6.0, True, 0x22, 0), (6.002, False, 0x62, 0)])
+
+    pairs = pair_packets(packets, timeout=5.0)
+
+    assert pairs['replied'].tolist() == [False, True]
+    assert pairs['reply_number'].tolist() == [0, 3]
+    # Without a deadline, the first request takes the reply of the second one
+    assert pair_packets(packets, timeout=None)['reply_number'].tolist() == [3, 0]
+
+
+def test_reply_within_deadline_is_paired():
+    packets = packet_table([(0.0, True, 0x22, 0), (4.9, False, 0x62, 0)])
+
+    assert pair_packets(packets, timeout=5.0)['replied'].tolist() == [True]
+
+
+def test_late_negative_reply_is_left_for_a_later_request():
+    packets = packet_table([(0.0, True, 0x31, 0), (10.0, True, 0x22, 0), (10.001, False, UDS_NEGATIVE_RESPONSE, 0x31)])
+
+    pairs = pair_packets(packets, timeout=5.0)
+
+    assert pairs['reply_number'].tolist() == [0, 3]
+    assert pairs['error'].tolist() == [0, 0x31]
+
+
+def test_response_pending_extends_deadline():
+    packets = packet_table([(0.0, True, 0x31, 0), (4.0, False, UDS_NEGATIVE_RESPONSE, UDS_RESPONSE_PENDING),
+                            (8.0, False, UDS_NEGATIVE_RESPONSE, UDS_RESPONSE_PENDING), (12.0, False, 0x71, 0)])
+
+    pairs = pair_packets(packets, timeout=5.0)
+
+    assert pairs['reply_number'].tolist() == [4]
+    assert pairs['pending_responses'].tolist() == [2]
+
+
+def test_late_response_pending_does_not_extend_deadline():
+    packets = packet_table([(0.0, True, 0x31, 0), (6.0, False, UDS_NEGATIVE_RESPONSE, UDS_RESPONSE_PENDING), (7.0, False, 0x71, 0)])
+
+    pairs = pair_packets(packets, timeout=5.0)
+
+    assert pairs['replied'].tolist() == [False]
+    assert pairs['pending_responses'].tolist() == [0]
+
+
+@pytest.mark.parametrize('missing_rate, pending_rate, timeout', [(0.01, 0.02, 5.0), (0.2, 0.5, 5.0), (0.2, 0.5, 0.5)])
+def test_batch_pairing_matches_streaming(tmp_path, missing_rate, pending_rate, timeout):
+    capture = str(tmp_path / 'synthetic.pcap')
+    write_capture(capture, 20_000, 2, None, 0.05, missing_rate, pending_rate, 3)
+    packets = scan_pcap_file(capture)
+
+    batch = pair_packets(packets, timeout)
+
+    matcher = IncrementalMatcher(timeout)
+    streamed = []
+    for message in zip(packets['number'].tolist(), packets['timestamp'].to_numpy().view(np.int64).tolist(), packets['source'].tolist(),
+                       packets['target'].tolist(), packets['sid'].tolist(), packets['error'].tolist()):
+        streamed += matcher.add(*message)
+    streamed = pd.DataFrame(streamed + matcher.flush(), columns=list(PAIR_DTYPES)).sort_values('request_number')
+
+    for name in ['request_number', 'replied', 'reply_number', 'error', 'pending_responses']:
+        assert batch[name].tolist() == streamed[name].tolist(), name
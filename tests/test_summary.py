@@ -0,0 +1,33 @@
+"""Token budget of `pipeline.summary.summarize_session_log` on captures with many ECUs and NRCs."""
+import pytest
+
+from benchmarks.synthetic_capture import write_capture
+from pipeline.scan import scan_pcap_file
+from pipeline.summary import MAX_AGGREGATE_LINES, estimate_tokens, summarize_session_log
+from utils import combine_request_reply, uds_codes
+
+# pylint: disable=C0301
+
+
+@pytest.fixture(scope='module')
+def session_log(tmp_path_factory):
+    capture = str(tmp_path_factory.mktemp('summary') / 'synthetic.pcap')
+    write_capture(capture, 20_000, 64, None, 0.2, 0.01, 0.02, 3)
+    return combine_request_reply(scan_pcap_file(capture))
+
+
+@pytest.mark.parametrize('token_budget', [1, 50, 200, 500, 1000, 4000])
+def test_summary_fits_token_budget(session_log, token_budget):
+    assert estimate_tokens(summarize_session_log(session_log, token_budget, codes=uds_codes)) <= token_budget
+
+
+def test_aggregates_are_capped(session_log):
+    summary = summarize_session_log(session_log, 4000, codes=uds_codes)
+    lines = summary.splitlines()
+
+    ecu_lines = [line for line in lines if line.startswith("ECU '") and ' requests, ' in line]
+    nrc_lines = [line for line in lines if line.startswith('NRC ')]
+    assert len(ecu_lines) <= MAX_AGGREGATE_LINES
+    assert len(nrc_lines) <= MAX_AGGREGATE_LINES
+    assert f"... {64 - len(ecu_lines)} more ECUs" in lines
+    assert lines.index("Per ECU:") < lines.index("Per NRC:")
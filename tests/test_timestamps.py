@@ -0,0 +1,54 @@
+"""Capture times: UTC in the typed packets and pairs, local time in the session logs of every decoding path."""
+import asyncio
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline.scan import format_uds_packets, parse_uds_packets, scan_pcap_file, to_local_time, to_utc_time
+from tests.timezones import local_timezone
+from utils import read_pcap_file, combine_request_reply, pcap_transformation
+
+# pylint: disable=C0301
+
+CAPTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'EMSSession11.pcap')
+
+
+@pytest.mark.parametrize('zone', ['America/New_York', 'Asia/Kolkata'])
+def test_upload_and_string_paths_agree(zone):
+    with local_timezone(zone):
+        typed, _ = pcap_transformation(CAPTURE, use_cache=False)
+        string = combine_request_reply(asyncio.run(read_pcap_file(CAPTURE)))
+
+    for name in ['request_timestamp', 'reply_timestamp']:
+        assert typed[name].tolist() == string[name].tolist(), name
+
+
+def test_session_log_holds_local_time():
+    with local_timezone('America/New_York'):
+        session_log, _ = pcap_transformation(CAPTURE, use_cache=False)
+
+    assert str(session_log['request_timestamp'].iloc[0]) == '2024-09-18 04:19:20.124487'
+    assert str(scan_pcap_file(CAPTURE)['timestamp'].iloc[0]) == '2024-09-18 08:19:20.124487'
+
+
+def test_string_packets_are_parsed_back_to_utc():
+    packets = scan_pcap_file(CAPTURE)
+
+    with local_timezone('Asia/Kolkata'):
+        parsed = parse_uds_packets(format_uds_packets(packets))
+
+    assert parsed['timestamp'].tolist() == packets['timestamp'].dt.floor('us').tolist()
+
+
+def test_conversion_follows_daylight_saving_changes():
+    utc = np.array(['2024-03-10T06:59:59', '2024-03-10T07:00:00', '2024-11-03T05:30:00', '2024-11-03T06:30:00', 'NaT'], dtype='datetime64[ns]')
+
+    with local_timezone('America/New_York'):
+        local = to_local_time(utc)
+        back = to_utc_time(local)
+
+    assert pd.Series(local).astype(str).tolist() == ['2024-03-10 01:59:59', '2024-03-10 03:00:00', '2024-11-03 01:30:00', '2024-11-03 01:30:00', 'NaT']
+    # 01:30 occurs twice on 3 November and is read back as the earlier one
+    assert pd.Series(back).astype(str).tolist() == ['2024-03-10 06:59:59', '2024-03-10 07:00:00', '2024-11-03 05:30:00', '2024-11-03 05:30:00', 'NaT']
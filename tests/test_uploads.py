@@ -0,0 +1,34 @@
+"""Per-session capture storage (`pipeline.uploads.CaptureStorage`): CSV exports of captures and their deletion."""
+import io
+import os
+
+from pipeline.uploads import CaptureStorage
+
+# pylint: disable=C0301
+
+SESSION = 'session-1'
+
+
+def test_captures_of_the_same_name_have_separate_exports(tmp_path):
+    storage = CaptureStorage(str(tmp_path))
+    for filename in ('bench.pcap', 'bench.log'):
+        storage.save(SESSION, filename, io.BytesIO(b'capture'))
+        with open(storage.export_path(SESSION, filename), 'w', encoding='utf-8') as export:
+            export.write(filename)
+
+    assert storage.export_path(SESSION, 'bench.pcap') != storage.export_path(SESSION, 'bench.log')
+
+    storage.remove(SESSION, 'bench.pcap')
+
+    assert sorted(os.listdir(storage.folder(SESSION))) == ['bench.log', 'bench.log.csv']
+
+
+def test_quota_deletes_the_export_of_the_oldest_capture(tmp_path):
+    storage = CaptureStorage(str(tmp_path), max_captures=1)
+    storage.save(SESSION, 'bench.pcap', io.BytesIO(b'capture'))
+    with open(storage.export_path(SESSION, 'bench.pcap'), 'w', encoding='utf-8') as export:
+        export.write('bench.pcap')
+
+    storage.save(SESSION, 'bench.log', io.BytesIO(b'capture'))
+
+    assert os.listdir(storage.folder(SESSION)) == ['bench.log']
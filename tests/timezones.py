@@ -0,0 +1,21 @@
+"""Local time zone of the test process, for code that formats capture times in local time."""
+import contextlib
+import os
+import time
+
+
+@contextlib.contextmanager
+def local_timezone(name: str):
+    """Runs the enclosed code with the process time zone set to `name` (an IANA name such as 'UTC' or
+    'America/New_York'), then restores the previous one."""
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = name
+    time.tzset()
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = previous
+        time.tzset()
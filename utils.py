@@ -1,22 +1,45 @@
 import os
-import asyncio
 import pandas as pd
-import pyshark
-import sqlite3
 import numpy as np
+from typing import Callable
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
+from langchain_core.runnables import RunnableConfig
+
+from pipeline.scan import scan_pcap_file, format_uds_packets, parse_uds_packets, format_addresses, to_local_time, HEX_BYTES, NO_ERROR
+from pipeline.matching import pair_packets
+from pipeline.cache import PairCache
+from pipeline.codes import CodeIndex, UDS_CODES_DB
+from pipeline.timing import response_timing, TimingParameters, DEFAULT_TIMING
+from pipeline.ecu_state import diagnostic_state
+from pipeline.summary import format_session_log
+from pipeline.sessions import SessionStore
+from pipeline.llm_cache import LLMResponseCache
+from pipeline.warehouse import CaptureWarehouse
+from pipeline.metrics import span
+from pipeline.payloads import PayloadIndex
 
 # pylint: disable=C0303
 # pylint: disable=C0301
 # pylint: disable=e1133
 
+UDS_PACKET_COLUMNS = ['number', 'timestamp', 'source', 'target', 'request', 'sid', 'error']
 
-async def read_pcap_file(file_path: str) -> pd.DataFrame:
-    """Reads a pcap file and returns a Pandas DataFrame with UDS packets.
+uds_codes = CodeIndex(UDS_CODES_DB)  # SID/NRC descriptions, reloaded when the database file changes
+pair_cache = PairCache(workers=os.cpu_count() or 1)  # processed captures, keyed by content hash
+session_store = SessionStore()  # parsed session logs of the uploads, by chat session (= graph thread id)
+llm_cache = LLMResponseCache()  # model responses shared by all agents, see `instantiate_llm`
+capture_warehouse = CaptureWarehouse()  # pairs of all processed captures, for statistics across captures
+
+
+async def read_pcap_file(file_path: str, use_pyshark: bool = False) -> pd.DataFrame:
+    """Reads a pcap file and returns a Pandas DataFrame with UDS packets. Packets are decoded natively by
+    `pipeline.scan.scan_pcap_file`; pyshark (tshark) is only used when explicitly requested. Use `scan_pcap_file`
+    directly to get the typed, columnar representation instead of hex strings.
 
     Args:
         file_path (str): string path to the pcap file
+        use_pyshark (bool): decode with pyshark/tshark instead of the native decoder. Defaults to False.
 
     Returns:
         pd.DataFrame: DataFrame with UDS packets, with columns:
@@ -28,6 +51,24 @@ async def read_pcap_file(file_path: str) -> pd.DataFrame:
             - sid: Service ID
             - error: Error code (if present)
     """
+    if use_pyshark:
+        return await read_pcap_file_pyshark(file_path)
+
+    return format_uds_packets(scan_pcap_file(file_path))
+
+
+async def read_pcap_file_pyshark(file_path: str) -> pd.DataFrame:
+    """Reads a pcap file with pyshark (requires tshark) and returns a Pandas DataFrame with UDS packets. This is 
+    the original decoder, kept as an opt-in fallback for captures the native decoder cannot handle.
+
+    Args:
+        file_path (str): string path to the pcap file
+
+    Returns:
+        pd.DataFrame: DataFrame with UDS packets, same columns as `read_pcap_file`
+    """
+    import pyshark  # optional dependency, only needed for this fallback
+
     capture = pyshark.FileCapture(file_path, include_raw=True, use_json=True)
         
     uds_packets = {}
@@ -38,7 +79,7 @@ async def read_pcap_file(file_path: str) -> pd.DataFrame:
         if hasattr(packet, "uds"):  # note - only keeps UDS packets
             
             packet_info = {
-                'number': packet.number,  # Packet number
+                'number': int(packet.number),  # Packet number
                 'timestamp': packet.sniff_time.strftime("%Y-%m-%d %H:%M:%S.%f"),  # timestamp of when packet captured by the network sniffer
                 'source': packet.doip.source_address if hasattr(packet.doip, 'source_address') else None,
                 'target': packet.doip.target_address if hasattr(packet.doip, 'target_address') else None,
@@ -64,66 +105,88 @@ async def read_pcap_file(file_path: str) -> pd.DataFrame:
     
     capture.close()  # Close the capture
     
-    return pd.DataFrame(uds_packets).T.sort_values(by='number').reset_index(drop=True)
+    return pd.DataFrame(list(uds_packets.values()), columns=UDS_PACKET_COLUMNS).sort_values(by='number').reset_index(drop=True)
 
 
-def combine_request_reply(df: pd.DataFrame) -> pd.DataFrame:
+def combine_request_reply(df: pd.DataFrame, timing: TimingParameters = DEFAULT_TIMING) -> pd.DataFrame:
     """Combines request SIDs, reply SIDs, and errors (if present) into single row in a DataFrame. Replies are matched 
     to requests based on the source and target addresses, conditional on the reply having a higher packet number than 
-    the request.
+    the request. Each request takes the first unused reply with the positive (request SID + 0x40) or negative (0x7F)
+    reply SID, see `pipeline.matching.match_request_reply`, as long as the reply comes within the P6 deadline of
+    `timing`. Response pending replies (NRC 0x78) are not final replies and are only counted.
 
     Args:
-        df (pd.DataFrame): DataFrame of PCAP file, with replies and requests in separate rows
+        df (pd.DataFrame): DataFrame of PCAP file, with replies and requests in separate rows. Either the typed output
+            of `scan_pcap_file` or the string output of `read_pcap_file`
+        timing (TimingParameters): P2/P2*/P6 budgets the response times are checked against
 
     Returns:
         pd.DataFrame: DataFrame with combined requests and replies, with columns:
             - ecu_address: ECU address
             - request_sid: Service ID of the request
             - reply_sid: Service ID of the reply
-            - error: Description of the error code (if present, else 'No error')
+            - error: NRC of a negative reply (e.g. '0x31', 'Unknown error' if it is not in the code database),
+              'p6 parameter timout' if there is no reply, else 'No error'
+            - request_timestamp: Local time of the request
+            - reply_timestamp: Local time of the final reply (NaT if no reply)
+            - latency_ms: Response time in milliseconds (NaN if no reply)
+            - pending_responses: Number of response pending replies before the final reply
+            - timing: Exceeded timing budgets (e.g. 'P2 exceeded'), else 'OK'
+            - session: Active diagnostic session of the ECU when the request arrived (e.g. 'extended')
+            - security: Security access state of the ECU, 'locked' or the unlocked level (e.g. 'unlocked 0x01')
+            - idle_ms: Time since the previous request or reply of the ECU (S3 timer) in milliseconds
+            - state_hint: Root cause of session or security related negative replies (else None)
             - request_description: Description of the request SID
-            - reply_description: Description of the reply SID
-            - error_description: Description of the error code (if present, else None)
+            - reply_description: Description of the reply SID ('Timeout: No Reply' if there is no reply)
+
+            The session, security, idle_ms and state_hint columns need the typed packets of `scan_pcap_file`; the
+            string output of `read_pcap_file` carries no sub-functions.
     """
-    requests = df[df['request'] == True].drop(columns=['source', 'request', 'error'])
-    replies = df[df['request'] == False].drop(columns=['target', 'request'])
+    return describe_request_reply(pair_packets(parse_uds_packets(df), timing.p6), timing)
 
-    combined = []
 
-    for _, request in requests.iterrows():
+def describe_request_reply(pairs: pd.DataFrame, timing: TimingParameters = DEFAULT_TIMING) -> pd.DataFrame:
+    """Converts typed request/reply pairs (see `pipeline.matching.PAIR_DTYPES`) into the session log format of
+    `combine_request_reply`: hex codes as strings, SID and NRC descriptions merged, a 'p6 parameter timout'
+    error for requests without a reply, capture times converted from UTC to local time, the response timing (see `pipeline.timing.response_timing`) and the
+    session and security state of the ECU (see `pipeline.ecu_state.diagnostic_state`).
 
-        # Match the request with the corresponding reply
-        request_sid = request['sid']
-        expected_reply_sid = f"0x{(int(request_sid, 16) + 0x40):X}"  # positive reply code
-        expected_error_sid = "0x7F"  # negative reply code
+    Args:
+        pairs (pd.DataFrame): typed request/reply pairs
+        timing (TimingParameters): P2/P2*/P6 budgets the response times are checked against
 
-        reply = replies[(replies['source'] == request['target']) &
-                        (request['number'] < replies['number']) & 
-                        (replies['sid'].isin([expected_reply_sid, expected_error_sid]))].head(1)\
-                            [['source', 'sid', 'error', 'timestamp']] # presorted on packet number so the first reply is the one we want
-        
-        if reply.empty:  # no corresponding reply found, so engineer a response too long error
-            
-            reply = pd.DataFrame({'source': [request['target']], 
-                                  'sid': None,  # p6 timing response too long
-                                  'error': 'p6 parameter timout',  # p6 timing response too long 
-                                  'timestamp': pd.NaT})
-        
-        else:
-            # Drop reply from the replies dataframe, if there was a normal match
-            replies = replies.drop(reply.index)
-            
-        combined.append([reply['source'].values[0], request['sid'], reply['sid'].values[0], reply['error'].values[0]])
-    
-    reply_request = pd.DataFrame(combined, columns=['ecu_address', 'request_sid', 'reply_sid', 'error'])
+    Returns:
+        pd.DataFrame: DataFrame with combined requests and replies, see `combine_request_reply`
+    """
+    replied = pairs['replied'].to_numpy()
+    error = pairs['error'].to_numpy()
+    request_sid = pairs['request_sid'].to_numpy()
+    reply_sid = pairs['reply_sid'].to_numpy()
+
+    reply_request = pd.DataFrame({
+        'ecu_address': format_addresses(pairs['ecu_address'].to_numpy()),
+        'request_sid': HEX_BYTES[request_sid],
+        'reply_sid': np.where(replied, HEX_BYTES[reply_sid], None),
+        'error': np.where(replied, np.where(error == NO_ERROR, None, HEX_BYTES[error]), 'p6 parameter timout'),  # no corresponding reply found, so engineer a response too long error
+        'request_timestamp': to_local_time(pairs['request_timestamp'].to_numpy()),
+        'reply_timestamp': to_local_time(pairs['reply_timestamp'].to_numpy()),
+    })
+    reply_request = reply_request.join(response_timing(pairs.reset_index(drop=True), timing))
+    if 'request_subfunction' in pairs:  # pairs of `pair_packets`; live pairs (see `pipeline.streaming`) carry no payload columns
+        reply_request = reply_request.join(diagnostic_state(pairs.reset_index(drop=True), timing))
     
-    # Merge SID descriptions
-    reply_request = merge_sid_description(reply_request)
+    # Attach SID descriptions
+    request_description = uds_codes.describe('sid', request_sid)
+    reply_description = uds_codes.describe('sid', reply_sid)
+    reply_request['request_description'] = np.where(request_description == None, 'Unknown Request', request_description)  # pylint: disable=C0121
+    reply_request['reply_description'] = np.where(replied, np.where(reply_description == None, 'Unknown Reply', reply_description), 'Timeout: No Reply')  # pylint: disable=C0121
     
-    # Merge NRC descriptions (if present)
+    # Resolve NRCs (if present): codes missing from the database become 'Unknown error'
     if reply_request['error'].notnull().mean() > 0:
     
-        reply_request = merge_nrc_description(reply_request)
+        unknown = replied & (reply_sid == 0x7F) & (uds_codes.describe('nrc', error) == None)  # pylint: disable=C0121
+        reply_request['error'] = np.where(unknown, 'Unknown error', reply_request['error'])
+        reply_request['error'] = reply_request['error'].fillna('No error')
     
     else:
         reply_request['error'] = 'No error'
@@ -140,18 +203,13 @@ def merge_sid_description(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: DataFrame with descriptions of the service IDs, in addition to the codes themselves
     """
-    # Load the service IDs from the SQLite database
-    conn = sqlite3.connect('uds/uds_codes.db')
-    sid_codes = pd.read_sql_query("SELECT * FROM sid;", conn)
+    df = df.copy()
     
-    # Merge the service description with request_sid
-    df = df.merge(sid_codes, left_on='request_sid', right_on='Code', how='left')\
-        .rename(columns={'Description': 'request_description'}).drop(columns='Code')
+    # Look up the service descriptions of request_sid and reply_sid
+    df['request_description'] = uds_codes.describe_hex('sid', df['request_sid'])
     df['request_description'] = df['request_description'].fillna('Unknown Request')
     
-    # Merge the service description with reply_sid
-    df = df.merge(sid_codes, left_on='reply_sid', right_on='Code', how='left')\
-        .rename(columns={'Description': 'reply_description'}).drop(columns='Code')
+    df['reply_description'] = uds_codes.describe_hex('sid', df['reply_sid'])
     df['reply_description'] = df['reply_description'].fillna('Unknown Reply')
     
     # If reply_sid is None, this means an ECU timeout, so fill in 'Timeout: No Reply'
@@ -170,21 +228,16 @@ def merge_nrc_description(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: DataFrame with descriptions of the error codes rather than the codes themselves
     """
-    # Load the negative response codes from the SQLite database
-    conn = sqlite3.connect('uds/uds_codes.db')
-    nrc_codes = pd.read_sql_query("SELECT * FROM nrc;", conn)
-    
-    # Merge the error codes with the negative response codes
-    df = df.merge(nrc_codes, left_on='error', right_on='Code', how='left')
+    df = df.copy()
     
     # Error codes with no match in db, fill with 'unknown error'
-    # Also replaces info from 'Description' column in 'error' column
-    df['error'] = np.where((df['reply_sid']=='0x7F') & (df['Description'].isnull()), 'Unknown error', df['error'])
+    description = uds_codes.describe_hex('nrc', df['error'])
+    df['error'] = np.where((df['reply_sid']=='0x7F') & (description == None), 'Unknown error', df['error'])  # pylint: disable=C0121
     
     # Fill in missing error descriptions
     df['error'] = df['error'].fillna('No error')
     
-    return df.drop(columns=['Code', 'Description'])
+    return df
 
 
 def convert_session_log_to_str(df: pd.DataFrame) -> str:
@@ -196,37 +249,88 @@ def convert_session_log_to_str(df: pd.DataFrame) -> str:
     Returns:
         str: string representation of the session log
     """
-    session_log = ""
+    return format_session_log(df)
 
-    for _, row in df.iterrows():
+def pcap_transformation_wrapper(file_path: str, use_cache: bool = True, progress: Callable[..., None] | None = None) -> pd.DataFrame:
+    """Wrapper function to transform a pcap file into a Pandas DataFrame. Captures that were processed before (same
+    bytes, any file name) are loaded from `pair_cache` instead of being decoded again.
 
-        ecu = row['ecu_address']
-        request_sid = row['request_sid']
-        request_description = row['request_description']
-        reply_sid = row['reply_sid']
-        reply_description = row['reply_description']
-        error = row['error']
-        
-        session_log += f"ECU '{ecu}': SID {request_sid} ({request_description}) -> SID {reply_sid} ({reply_description}) // {error}\n"
-    
-    return session_log
+    Args:
+        file_path (str): string path to the pcap file
+        use_cache (bool): look up and store the decoded pairs in `pair_cache`. Defaults to True.
+        progress (Callable | None): receives decoding progress as keyword counts, see `PairCache.pairs`
+
+    Returns:
+        df: DataFrame representation of the pcap session log
+    """
+    return pcap_transformation(file_path, use_cache, progress)[0]
 
-def pcap_transformation_wrapper(file_path: str) -> pd.DataFrame:
-    """Wrapper function to transform a pcap file into a Pandas DataFrame
+def pcap_transformation(file_path: str, use_cache: bool = True, progress: Callable[..., None] | None = None) -> tuple[pd.DataFrame, PayloadIndex]:
+    """Transforms a pcap file into its session log like `pcap_transformation_wrapper`, and also returns the payload
+    index of the capture, for decoding the full payloads of selected rows on demand (see `pipeline.payloads`).
 
     Args:
         file_path (str): string path to the pcap file
+        use_cache (bool): look up and store the decoded pairs in `pair_cache`. Defaults to True.
+        progress (Callable | None): receives decoding progress as keyword counts, see `PairCache.pairs`
 
     Returns:
-        df: DataFrame representation of the pcap session log
+        tuple: session log and payload index
     """
-    df = asyncio.run(read_pcap_file(file_path))
-    df = combine_request_reply(df)
+    if use_cache:
+        pairs = pair_cache.pairs(file_path, progress)
+    else:
+        with span("scan") as stage:
+            packets = scan_pcap_file(file_path, progress)
+            stage.rows = len(packets)
+        with span("pair") as stage:
+            pairs = pair_packets(parse_uds_packets(packets))
+            stage.rows = len(pairs)
+        if progress is not None:
+            progress(pairs=len(pairs))
 
-    return df
+    with span("describe") as stage:
+        df = describe_request_reply(pairs)
+        stage.rows = len(df)
+
+    return df, PayloadIndex(file_path, pairs)
+
+def get_session_log(config: RunnableConfig, capture: str | None = None) -> pd.DataFrame | str:
+    """Returns a read-only view of a session log of the chat session running the graph, for agent tools.
+    The chat session is the graph thread id (see `app.py`).
+
+    Args:
+        config (RunnableConfig): config of the tool call, injected by LangGraph
+        capture (str | None): file name of an uploaded capture, defaults to the active (most recent) one
+
+    Returns:
+        pd.DataFrame | str: the session log, or an error message if no such PCAP file was uploaded in this session
+    """
+    session_id = str(config.get("configurable", {}).get("thread_id"))
+    session_log = session_store.get(session_id, capture)
+    if session_log is None and capture is not None:
+        return f"Error: No PCAP file named '{capture}' was uploaded in this session. Uploaded files: {', '.join(session_store.captures(session_id)) or 'none'}."
+    if session_log is None:
+        return "Error: No PCAP file has been uploaded in this session. Please upload a PCAP file first."
+    return session_log
+
+def get_payload_index(config: RunnableConfig, capture: str | None = None) -> PayloadIndex | str:
+    """Returns the payload index of a capture of the chat session running the graph, for agent tools, see
+    `get_session_log`.
+
+    Returns:
+        PayloadIndex | str: the payload index, or an error message if the capture was not uploaded in this session
+    """
+    session_id = str(config.get("configurable", {}).get("thread_id"))
+    payloads = session_store.payloads(session_id, capture)
+    if payloads is None:
+        session_log = get_session_log(config, capture)
+        return session_log if isinstance(session_log, str) else "Error: The payloads of this PCAP file are not available, please upload it again."
+    return payloads
 
 def instantiate_llm(model: str = "gpt-4o") -> ChatOpenAI:
-    """Instantiates the Langchain AzureChatOpenAI model.
+    """Instantiates the Langchain AzureChatOpenAI model. All instances share `llm_cache`, so a prompt answered before
+    (by any agent, within the same session log scope) is not sent to the model again.
     
     Args: 
         model (str): The model to use. Defaults to "gpt-4o".
@@ -241,5 +345,6 @@ def instantiate_llm(model: str = "gpt-4o") -> ChatOpenAI:
         azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT"), 
         openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
         deployment_name=model,
-        api_version="2024-02-01"
+        api_version="2024-02-01",
+        cache=llm_cache,
     )
\ No newline at end of file